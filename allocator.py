@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""allocator.py"""
+
+import re
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class AddressError(Error):
+    """Exception raised for invalid or already used PLC addresses.
+
+    Attributes:
+        address -- concerned address
+        object -- object already using the address, if any
+    """
+
+    def __init__(self, address, object=None):
+        self.address = address
+        self.object = object
+
+    def __str__(self):
+        if self.object is None:
+            return "{} is not a valid bit address".format(self.address)
+        return "{} is already used by {}".format(self.address, self.object)
+
+
+class AddressOverflowError(Error):
+    """Exception raised when the memory area is full.
+
+    Attributes:
+        area -- concerned memory area
+    """
+
+    def __init__(self, area):
+        self.area = area
+
+    def __str__(self):
+        return "No more free bit in memory area {}".format(self.area)
+
+
+class AddressAllocator:
+    """Allocates bits of the PLC memory shared by several GRAFCETs"""
+
+    bitAddress = re.compile(r'^([A-Z]+)(\d+)\.([0-7])$')
+
+    def __init__(self, area='V', start=0, size=8192):
+        self.area = area
+        self.start = start
+        self.size = size
+
+        self.owners = dict()
+        self.blocks = list()
+        self.nextBit = start * 8
+
+    def __str__(self):
+        return "Address allocator of area {}".format(self.area)
+
+    def __repr__(self):
+        return str(self)
+
+    @classmethod
+    def parse(cls, address):
+        match = cls.bitAddress.match(address.strip())
+        if match is None:
+            raise AddressError(address)
+        return match.group(1), int(match.group(2)) * 8 + int(match.group(3))
+
+    @staticmethod
+    def format(area, bit):
+        return "{}{}.{}".format(area, bit // 8, bit % 8)
+
+    def get_area(self):
+        return self.area
+
+    def get_owners(self):
+        return self.owners
+
+    def get_blocks(self):
+        return self.blocks
+
+    def get_owner(self, address):
+        return self.owners.get(self.parse(address))
+
+    def is_used(self, address):
+        return self.parse(address) in self.owners
+
+    def reserve(self, address, object=None):
+        key = self.parse(address)
+        if key in self.owners and self.owners[key] is not object:
+            raise AddressError(address, self.owners[key])
+        self.owners[key] = object
+
+    def release(self, address):
+        self.owners.pop(self.parse(address), None)
+
+    def allocate(self, object=None):
+        end = (self.start + self.size) * 8
+        while self.nextBit < end and (self.area, self.nextBit) in self.owners:
+            self.nextBit += 1
+
+        if self.nextBit >= end:
+            raise AddressOverflowError(self.area)
+
+        self.owners[(self.area, self.nextBit)] = object
+        self.nextBit += 1
+
+        return self.format(self.area, self.nextBit - 1)
+
+    def find_block(self, length, alignment):
+        bit = -(-self.start * 8 // alignment) * alignment
+        end = (self.start + self.size) * 8
+
+        while bit + length <= end:
+            for offset in range(length):
+                if (self.area, bit + offset) in self.owners:
+                    bit = ((bit + offset) // alignment + 1) * alignment
+                    break
+            else:
+                return bit
+
+        raise AddressOverflowError(self.area)
+
+    def allocate_block(self, objects, alignment=None):
+        objects = list(objects)
+
+        if len(objects) == 0:
+            return list()
+
+        # Blocks wider than a byte start on a word so that they can be handled with word instructions
+        if alignment is None:
+            alignment = 16 if len(objects) > 8 else 8
+
+        start = self.find_block(len(objects), alignment)
+
+        addresses = list()
+        for offset, object in enumerate(objects):
+            self.owners[(self.area, start + offset)] = object
+            addresses.append(self.format(self.area, start + offset))
+
+        self.blocks.append((addresses[0], len(objects)))
+
+        return addresses
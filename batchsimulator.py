@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""batchsimulator.py"""
+
+from functools import reduce
+
+import numpy
+
+from grafcet import *
+from simulator import UnstableSituationError
+
+
+class BatchSimulator:
+    """Evolution of many scenarios of the same GRAFCET at once
+
+    Situations, inputs and outputs are boolean matrices with one row per scenario and one column per
+    step, input or output of the frozen GRAFCET. Columns are contiguous so that every condition is
+    evaluated for all the scenarios with a few vector operations. Delays and their timers are kept
+    with one contiguous row per delay.
+    """
+
+    timeTolerance = 1e-9
+    idleTime = 1e300
+    gatherRatio = 8
+
+    def __init__(self, grafcet, scenarios, maxIterations=None):
+        self.grafcet = grafcet.freeze()
+        self.scenarios = scenarios
+
+        grafcet = self.grafcet
+
+        self.maxIterations = maxIterations
+        if self.maxIterations is None:
+            self.maxIterations = len(grafcet.transitions) + 1
+
+        self.precedingMatrix = numpy.zeros((len(grafcet.transitions), len(grafcet.steps)), dtype=bool)
+        self.succeedingMatrix = numpy.zeros((len(grafcet.transitions), len(grafcet.steps)), dtype=bool)
+        for transition, (precedingSteps, succeedingSteps) in enumerate(zip(grafcet.precedingSteps,
+                                                                           grafcet.succeedingSteps)):
+            self.precedingMatrix[transition, list(precedingSteps)] = True
+            self.succeedingMatrix[transition, list(succeedingSteps)] = True
+
+        self.delaySlots = dict()
+        self.delayKinds = list()
+        self.delayTimes = list()
+        self.delayExpressions = list()
+
+        self.outputActions = [self.build_output(actions) for actions in grafcet.outputActions]
+
+        self.conditions = list()
+        for condition in grafcet.conditions:
+            if condition is None:
+                condition = ('CT', 1)
+            self.conditions.append(self.build(condition))
+
+        self.isDelay = numpy.array([kind == 'DE' for kind in self.delayKinds], dtype=bool)
+        self.isDelay = self.isDelay[:, numpy.newaxis]
+        self.hasFallingDelays = not self.isDelay.all() or any(delayFe > 0 for delayRe, delayFe in self.delayTimes)
+        self.delayRe = numpy.array([delayRe for delayRe, delayFe in self.delayTimes], dtype=float).reshape(-1, 1)
+        self.delayFe = numpy.array([delayFe for delayRe, delayFe in self.delayTimes], dtype=float).reshape(-1, 1)
+
+        self.precedingLists = [list(steps) for steps in grafcet.precedingSteps]
+
+        self.reset()
+
+    def __str__(self):
+        return 'Batch simulator of {} for {} scenarios'.format(self.grafcet, self.scenarios)
+
+    def __repr__(self):
+        return str(self)
+
+    def matrix(self, columns, value=False, dtype=bool):
+        return numpy.full((self.scenarios, columns), value, dtype=dtype, order='F')
+
+    def build(self, condition):
+        kind, value = condition
+
+        if kind == 'IN':
+            id = self.grafcet.get_input_id(value)
+            return lambda m, i, d, pm, pi, pd: i[:, id]
+
+        elif kind == 'ST':
+            id = self.grafcet.get_step_id(value)
+            return lambda m, i, d, pm, pi, pd: m[:, id]
+
+        elif kind == 'OU':
+            output = self.outputActions[self.grafcet.get_output_id(value)]
+            return lambda m, i, d, pm, pi, pd: output(m, i, d, pm, pi, pd)
+
+        elif kind == 'CT':
+            value = bool(value)
+            return lambda m, i, d, pm, pi, pd: numpy.full(len(m), value)
+
+        elif kind == 'NOT':
+            member = self.build(value)
+            return lambda m, i, d, pm, pi, pd: ~member(m, i, d, pm, pi, pd)
+
+        elif kind == 'RE':
+            member = self.build(value)
+            return lambda m, i, d, pm, pi, pd: member(m, i, d, pm, pi, pd) & ~member(pm, pi, pd, pm, pi, pd)
+
+        elif kind == 'FE':
+            member = self.build(value)
+            return lambda m, i, d, pm, pi, pd: ~member(m, i, d, pm, pi, pd) & member(pm, pi, pd, pm, pi, pd)
+
+        elif kind == 'AND' or kind == 'OR':
+            members = [self.build(member) for member in value]
+            operator = numpy.logical_and if kind == 'AND' else numpy.logical_or
+            return lambda m, i, d, pm, pi, pd: reduce(operator, [member(m, i, d, pm, pi, pd)
+                                                                 for member in members])
+
+        elif kind == 'DE' or kind == 'DU':
+            slot = self.get_delay_slot(condition)
+            return lambda m, i, d, pm, pi, pd: d[slot]
+
+        else:
+            raise ExpressionIdentifierError(kind)
+
+    def build_output(self, actions):
+        steps = [stepId for stepId, rank in actions if self.grafcet.actions[stepId][rank][1] is None]
+        conditioned = [(stepId, self.build(self.grafcet.actions[stepId][rank][1]))
+                       for stepId, rank in actions if self.grafcet.actions[stepId][rank][1] is not None]
+
+        def output(m, i, d, pm, pi, pd):
+            value = m[:, steps].any(axis=1)
+            for stepId, condition in conditioned:
+                value |= m[:, stepId] & condition(m, i, d, pm, pi, pd)
+            return value
+
+        return output
+
+    def get_delay_slot(self, condition):
+        if condition not in self.delaySlots:
+            kind, value = condition
+            self.delaySlots[condition] = len(self.delayKinds)
+            self.delayKinds.append(kind)
+            self.delayExpressions.append(None)
+            if kind == 'DE':
+                self.delayTimes.append((value[0], value[2]))
+            else:
+                self.delayTimes.append((value[0], 0))
+            self.delayExpressions[self.delaySlots[condition]] = self.build(value[1])
+
+        return self.delaySlots[condition]
+
+    def reset(self):
+        grafcet = self.grafcet
+
+        self.situations = self.matrix(len(grafcet.steps))
+        self.situations[:, list(grafcet.initialSteps)] = True
+        self.inputs = self.matrix(len(grafcet.inputs))
+        self.delays = numpy.zeros((len(self.delayKinds), self.scenarios), dtype=bool)
+        self.time = 0.
+
+        self.previousSituations = self.situations.copy(order='F')
+        self.previousInputs = self.inputs.copy(order='F')
+        self.previousDelays = self.delays.copy()
+
+        self.riseTimes = numpy.full((len(self.delayKinds), self.scenarios), self.idleTime)
+        self.fallTimes = numpy.full((len(self.delayKinds), self.scenarios), self.idleTime)
+
+        self.stable = numpy.zeros(self.scenarios, dtype=bool)
+        self.changed = ~self.stable
+
+    def get_grafcet(self):
+        return self.grafcet
+
+    def set_inputs(self, inputs):
+        inputs = numpy.array(numpy.broadcast_to(numpy.asarray(inputs, dtype=bool),
+                                                (self.scenarios, len(self.grafcet.inputs))), order='F')
+        self.stable &= ~(inputs != self.inputs).any(axis=1)
+        self.inputs = inputs
+
+    def get_inputs(self):
+        return self.inputs
+
+    def set_time(self, time):
+        if time != self.time:
+            self.stable &= ~self.get_pending_delays()
+            self.time = time
+
+    def get_time(self):
+        return self.time
+
+    def set_situations(self, situations):
+        self.situations = numpy.array(numpy.broadcast_to(numpy.asarray(situations, dtype=bool),
+                                                         (self.scenarios, len(self.grafcet.steps))), order='F')
+        self.stable[:] = False
+
+    def get_situations(self):
+        return self.situations
+
+    def is_stable(self):
+        return self.stable
+
+    def get_pending_delays(self):
+        """Returns the scenarios where a delay is waiting for the end of its rising or falling time"""
+        rising = (self.riseTimes < self.idleTime) & (self.riseTimes + self.delayRe > self.time + self.timeTolerance)
+        falling = (self.fallTimes < self.idleTime) & self.delays
+
+        return (rising | falling).any(axis=0)
+
+    def update_delays(self, m, i, d, pm, pi, pd, riseTimes, fallTimes):
+        time = self.time + self.timeTolerance
+
+        values = numpy.empty(d.shape, dtype=bool)
+        for slot, expression in enumerate(self.delayExpressions):
+            values[slot] = expression(m, i, d, pm, pi, pd)
+
+        # All the slots are updated together with arithmetic only, idle times are set to a far future
+        riseTimes = numpy.minimum(riseTimes, self.time) + ~values * self.idleTime
+        delays = riseTimes <= time - self.delayRe
+
+        if self.hasFallingDelays:
+            falling = ~values & d
+            fallTimes = numpy.minimum(fallTimes, self.time) + ~falling * self.idleTime
+            # A delay still set when its condition comes back stays set, as it never fell
+            delays = (self.isDelay & (delays | values & d | falling & (fallTimes > time - self.delayFe))
+                      | ~self.isDelay & values & ~delays)
+
+        return delays, riseTimes, fallTimes
+
+    def evolution(self, m, i, d, pm, pi, pd, riseTimes, fallTimes):
+        changed = numpy.zeros(m.shape[0], dtype=bool)
+        if self.delayKinds:
+            delays, riseTimes, fallTimes = self.update_delays(m, i, d, pm, pi, pd, riseTimes, fallTimes)
+            changed = (delays != d).any(axis=0)
+            d = delays
+
+        # Only transitions enabled in at least one scenario are evaluated
+        activeSteps = m.any(axis=0)
+        candidates = numpy.flatnonzero(~(self.precedingMatrix & ~activeSteps).any(axis=1))
+
+        cleared = numpy.zeros(m.shape, dtype=bool, order='F')
+        activated = numpy.zeros(m.shape, dtype=bool, order='F')
+        fired = numpy.zeros(m.shape[0], dtype=bool)
+
+        for transition in candidates:
+            precedingSteps = self.precedingLists[transition]
+            if len(precedingSteps) == 1:
+                enabled = m[:, precedingSteps[0]]
+            else:
+                enabled = m[:, precedingSteps].all(axis=1)
+            if not enabled.any():
+                continue
+
+            firing = enabled & self.conditions[transition](m, i, d, pm, pi, pd)
+            if not firing.any():
+                continue
+
+            fired |= firing
+            for step in precedingSteps:
+                cleared[:, step] |= firing
+            for step in self.grafcet.succeedingSteps[transition]:
+                activated[:, step] |= firing
+
+        # Activation has priority over deactivation when a step is both cleared and activated
+        return m & ~cleared | activated, d, riseTimes, fallTimes, fired, fired | changed
+
+    def cycle(self, rows=None):
+        """Runs one cycle on all the scenarios, or on the scenarios given by a boolean mask or by their
+        indexes, the other ones being kept as they are with their edges"""
+        if rows is None or rows.dtype == bool:
+            m, i = self.situations, self.inputs
+            situations, delays, riseTimes, fallTimes, fired, changed = self.evolution(
+                m, i, self.delays, self.previousSituations, self.previousInputs, self.previousDelays,
+                self.riseTimes, self.fallTimes)
+
+        if rows is None:
+            self.previousSituations, self.previousInputs, self.previousDelays = m, i, delays
+            self.situations, self.delays, self.riseTimes, self.fallTimes = situations, delays, riseTimes, fallTimes
+            self.changed = changed
+
+            return fired
+
+        if rows.dtype == bool:
+            # Every row is evaluated, only the masked ones are updated
+            fired, changed = fired & rows, changed & rows
+            situations, delays = situations[rows], delays[:, rows]
+            riseTimes, fallTimes = riseTimes[:, rows], fallTimes[:, rows]
+            m, i = m[rows], i[rows]
+        else:
+            m, i = self.situations[rows], self.inputs[rows]
+            situations, delays, riseTimes, fallTimes, fired, changed = self.evolution(
+                m, i, self.delays[:, rows], self.previousSituations[rows], self.previousInputs[rows],
+                self.previousDelays[:, rows], self.riseTimes[:, rows], self.fallTimes[:, rows])
+            changed, gathered = numpy.zeros(self.scenarios, dtype=bool), changed
+            changed[rows] = gathered
+
+        self.previousSituations[rows], self.previousInputs[rows], self.previousDelays[:, rows] = m, i, delays
+        self.situations[rows], self.delays[:, rows] = situations, delays
+        self.riseTimes[:, rows], self.fallTimes[:, rows] = riseTimes, fallTimes
+        self.changed = changed
+
+        return fired
+
+    def evolve(self, inputs=None, time=None):
+        if inputs is not None:
+            self.set_inputs(inputs)
+        if time is not None:
+            self.set_time(time)
+
+        # As for the Simulator, a scenario is cycled from a change of its inputs or the expiry of one of its
+        # delays until it is stable, and the other ones are left as they are: their edges keep comparing
+        # with the cycle before. Once few scenarios still evolve, they are gathered. A cycle changing only
+        # delays is followed by another one for the delays reading them.
+        iterations = numpy.zeros(self.scenarios, dtype=int)
+        self.changed = ~self.stable
+
+        for iteration in range(self.maxIterations + len(self.delayKinds) + 1):
+            rows = numpy.flatnonzero(self.changed)
+            if len(rows) == 0:
+                self.stable[:] = True
+                return iterations
+            if len(rows) == self.scenarios:
+                iterations += self.cycle()
+            elif len(rows) * self.gatherRatio > self.scenarios:
+                iterations += self.cycle(self.changed)
+            else:
+                iterations[rows] += self.cycle(rows)
+
+        row = numpy.flatnonzero(self.changed)[0]
+        raise UnstableSituationError([self.grafcet.steps[id] for id in numpy.flatnonzero(self.situations[row])])
+
+    def run(self, inputs, times):
+        situations = list()
+        for stepInputs, time in zip(inputs, times):
+            self.evolve(stepInputs, time)
+            situations.append(self.situations.copy())
+
+        return situations
+
+    def get_outputs(self):
+        state = (self.situations, self.inputs, self.delays,
+                 self.previousSituations, self.previousInputs, self.previousDelays)
+
+        outputs = self.matrix(len(self.grafcet.outputs))
+        for id, output in enumerate(self.outputActions):
+            outputs[:, id] = output(*state)
+
+        return outputs
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""conditioncompiler.py"""
+
+import functools
+
+from grafcet import *
+
+# Number of compiled functions kept for the conditions compiled the most recently
+cacheSize = 4096
+
+
+@functools.lru_cache(maxsize=cacheSize)
+def compile_source(source):
+    """Returns the function of a condition from its flat expression on the states s and p"""
+    return eval(compile('lambda s, p: {}'.format(source), '<condition>', 'eval'))
+
+
+class ConditionCompiler:
+    """Compiles the frozen conditions of a GRAFCET into Python functions
+
+    The state of the GRAFCET is one integer holding the steps from bit 0, then the inputs, then the
+    delays. A condition is compiled into a function of the current and of the previous states, as one
+    flat boolean expression on masks of that integer. Edges compare both states and delays read their
+    slot in the state, the timers themselves are managed by the caller.
+
+    Functions are cached on the expression of the condition with its bit positions resolved, so a
+    condition used by several transitions or GRAFCETs with the same layout is only compiled once. The
+    cache keeps the last cacheSize functions, so long runs compiling many GRAFCETs do not grow it.
+    """
+
+    def __init__(self, grafcet):
+        self.grafcet = grafcet.freeze()
+
+        self.inputOffset = len(self.grafcet.steps)
+        self.delayOffset = self.inputOffset + len(self.grafcet.inputs)
+
+        self.delaySlots = dict()
+        self.delays = list()
+
+    def __str__(self):
+        return 'Condition compiler of {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    def get_delays(self):
+        return self.delays
+
+    def get_delay_slot(self, condition):
+        # Identical delays share their slot
+        if condition not in self.delaySlots:
+            self.delaySlots[condition] = len(self.delays)
+            self.delays.append(condition)
+
+        return self.delaySlots[condition]
+
+    def state(self, situation, inputs, delays):
+        return situation | inputs << self.inputOffset | delays << self.delayOffset
+
+    def position(self, condition):
+        kind, value = condition
+
+        if kind == 'IN':
+            return 'B', self.inputOffset + self.grafcet.get_input_id(value)
+
+        elif kind == 'ST':
+            return 'B', self.grafcet.get_step_id(value)
+
+        elif kind == 'OU':
+            return self.output_position(self.grafcet.get_output_id(value))
+
+        elif kind == 'CT':
+            return 'CT', int(bool(value))
+
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return kind, self.position(value)
+
+        elif kind == 'AND' or kind == 'OR':
+            return kind, tuple(self.position(member) for member in value)
+
+        elif kind == 'DE' or kind == 'DU':
+            return 'B', self.delayOffset + self.get_delay_slot(condition)
+
+        else:
+            raise ExpressionIdentifierError(kind)
+
+    def output_position(self, id):
+        members = list()
+        for stepId, rank in self.grafcet.outputActions[id]:
+            actionCondition = self.grafcet.actions[stepId][rank][1]
+            if actionCondition is None:
+                members.append(('B', stepId))
+            else:
+                members.append(('AND', (('B', stepId), self.position(actionCondition))))
+        return ('OR', tuple(members)) if members else ('CT', 0)
+
+    def source(self, condition, state='s'):
+        kind, value = condition
+
+        if kind == 'B':
+            return '{} & {}'.format(state, hex(1 << value))
+
+        elif kind == 'CT':
+            return 'True' if value else 'False'
+
+        elif kind == 'NOT':
+            return 'not ({})'.format(self.source(value, state))
+
+        elif kind == 'RE':
+            return '({}) and not ({})'.format(self.source(value, state), self.source(value, 'p'))
+
+        elif kind == 'FE':
+            return 'not ({}) and ({})'.format(self.source(value, state), self.source(value, 'p'))
+
+        # Direct and negated bits of a product or of a sum are tested with a single mask
+        positive = negative = 0
+        members = list()
+        for member in value:
+            if member[0] == 'B':
+                positive |= 1 << member[1]
+            elif member[0] == 'NOT' and member[1][0] == 'B':
+                negative |= 1 << member[1][1]
+            else:
+                members.append('({})'.format(self.source(member, state)))
+
+        # A bit both direct and negated makes a product false and a sum true
+        if positive & negative:
+            return 'False' if kind == 'AND' else 'True'
+
+        if kind == 'AND':
+            if positive or negative:
+                members.insert(0, '{} & {} == {}'.format(state, hex(positive | negative), hex(positive)))
+            return ' and '.join(members)
+        else:
+            if negative:
+                members.insert(0, '{} & {} != {}'.format(state, hex(negative), hex(negative)))
+            if positive:
+                members.insert(0, '{} & {}'.format(state, hex(positive)))
+            return ' or '.join(members)
+
+    def compile(self, condition):
+        if condition is None:
+            condition = ('CT', 1)
+
+        return self.compile_position(self.position(condition))
+
+    def compile_output(self, id):
+        return self.compile_position(self.output_position(id))
+
+    def compile_position(self, condition):
+        return compile_source(self.source(condition))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""costmodel.py"""
+
+import argparse
+import json
+import sys
+
+from ir import LD, LDN, A, AN, O, ON, NOT, ALD, OLD, EU, ED, OUT, TON, LPS, LRD, LPP, Network
+from grafcet import Grafcet
+from plc import Simatic_S7_200
+from emulator import Simatic_S7_200_Emulator
+from differential import CodeGenerationError
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class CpuTypeError(Error):
+    """Exception raised for CPU types without cost model.
+
+    Attributes:
+        cpu -- concerned CPU type
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+    def __str__(self):
+        return "No cost model for {}".format(self.cpu)
+
+
+class BudgetError(Error):
+    """Exception raised when the cost of a program exceeds its budget.
+
+    Attributes:
+        kind -- 'scanTime' or 'memory'
+        cost -- estimated cost
+        budget -- allowed cost
+    """
+
+    def __init__(self, kind, cost, budget):
+        self.kind = kind
+        self.cost = cost
+        self.budget = budget
+
+    def __str__(self):
+        return "Estimated {} {} exceeds the budget of {}".format(self.kind, self.cost, self.budget)
+
+
+# Execution times in seconds of the instructions on bit operands. These are estimates: they should be
+# checked against the execution times given by the manual of the CPU
+cpu21xTimes = {LD: 0.8e-6, LDN: 0.8e-6, A: 0.8e-6, AN: 0.8e-6, O: 0.8e-6, ON: 0.8e-6, NOT: 0.8e-6,
+               ALD: 0.8e-6, OLD: 0.8e-6, EU: 0.8e-6, ED: 0.8e-6, OUT: 0.8e-6, TON: 40e-6,
+               LPS: 0.8e-6, LRD: 0.8e-6, LPP: 0.8e-6}
+cpu22xTimes = {LD: 0.22e-6, LDN: 0.22e-6, A: 0.22e-6, AN: 0.22e-6, O: 0.22e-6, ON: 0.22e-6, NOT: 0.22e-6,
+               ALD: 0.22e-6, OLD: 0.22e-6, EU: 0.22e-6, ED: 0.22e-6, OUT: 0.22e-6, TON: 15e-6,
+               LPS: 0.22e-6, LRD: 0.22e-6, LPP: 0.22e-6}
+
+# Program memory in bytes of the instructions, estimates too
+instructionSizes = {LD: 3, LDN: 3, A: 3, AN: 3, O: 3, ON: 3, NOT: 1,
+                    ALD: 1, OLD: 1, EU: 1, ED: 1, OUT: 3, TON: 6,
+                    LPS: 1, LRD: 1, LPP: 1}
+
+# CPU type: (execution times, program memory in bytes)
+cpuTypes = {'CPU 212': (cpu21xTimes, 1024),
+            'CPU 214': (cpu21xTimes, 4096),
+            'CPU 221': (cpu22xTimes, 4096),
+            'CPU 222': (cpu22xTimes, 4096),
+            'CPU 224': (cpu22xTimes, 8192),
+            'CPU 224XP': (cpu22xTimes, 12288),
+            'CPU 226': (cpu22xTimes, 16384)}
+
+
+class CostModel:
+    """Estimated scan time and program memory of a program for a CPU of the S7-200 family
+
+    Each instruction costs its execution time and its size, so the cost of a network is the sum of
+    the costs of its instructions. The time of a scan is the execution time of every network, the
+    reading of the inputs, the writing of the outputs and the communications not being counted.
+
+    Networks are grouped by chart: the transitions and the steps of a GRAFCET belong to its chart, the
+    networks shared by the charts of a project, like outputs, delays or scratch bits, belong to no chart,
+    even for the program of a single GRAFCET.
+    """
+
+    sharedChart = 'shared'
+
+    def __init__(self, networks, cpu='CPU 224', charts=None):
+        if cpu not in cpuTypes:
+            raise CpuTypeError(cpu)
+
+        self.cpu = cpu
+        self.instructionTimes, self.memorySize = cpuTypes[cpu]
+        self.instructionSizes = instructionSizes
+        charts = dict() if charts is None else charts
+
+        self.networks = list()
+        for number, network in enumerate(networks, 1):
+            scanTime = sum(self.instructionTimes[opcode] for opcode, operand in network)
+            memory = sum(self.instructionSizes[opcode] for opcode, operand in network)
+            self.networks.append({'number': number,
+                                  'comment': str(network.get_comment()).strip(),
+                                  'chart': charts.get(network.get_comment(), self.sharedChart),
+                                  'instructions': len(network),
+                                  'scanTime': scanTime,
+                                  'memory': memory})
+
+        self.charts = dict()
+        for network in self.networks:
+            chart = self.charts.setdefault(network['chart'], {'networks': 0, 'instructions': 0,
+                                                              'scanTime': 0., 'memory': 0})
+            chart['networks'] += 1
+            chart['instructions'] += network['instructions']
+            chart['scanTime'] += network['scanTime']
+            chart['memory'] += network['memory']
+
+    def __str__(self):
+        return 'Cost model of {} networks for {}'.format(len(self.networks), self.cpu)
+
+    def __repr__(self):
+        return str(self)
+
+    @classmethod
+    def for_code(cls, code, cpu='CPU 224'):
+        """Estimates the cost of an instruction list, the comments of its networks being kept"""
+        comments = [line.partition('//')[2] for line in code.splitlines() if line.strip().startswith('Network')]
+        networks = [Network(comment, instructions)
+                    for comment, instructions in zip(comments, Simatic_S7_200_Emulator(code).get_networks())]
+
+        return cls(networks, cpu)
+
+    @staticmethod
+    def get_charts(grafcets):
+        """Returns the chart of the step and transition networks, commented by their step or transition"""
+        charts = dict()
+        for key in grafcets:
+            for objects in (grafcets[key].get_steps(), grafcets[key].get_transitions()):
+                for index in objects:
+                    charts[objects[index]] = key
+
+        return charts
+
+    @classmethod
+    def for_grafcet(cls, grafcet, cpu='CPU 224'):
+        # The networks are commented by the objects of the GRAFCET converted, not of a frozen one
+        if not isinstance(grafcet, Grafcet):
+            grafcet = grafcet.thaw()
+
+        networks = Simatic_S7_200().get_networks(grafcet)
+        if networks is None:
+            raise CodeGenerationError(grafcet)
+
+        return cls(networks, cpu, cls.get_charts({grafcet.name: grafcet}))
+
+    @classmethod
+    def for_project(cls, project, cpu='CPU 224'):
+        networks = Simatic_S7_200().get_project_networks(project)
+        if networks is None:
+            raise CodeGenerationError(project)
+
+        return cls(networks, cpu, cls.get_charts(project.get_grafcets()))
+
+    def get_cpu(self):
+        return self.cpu
+
+    def get_scan_time(self):
+        return sum(network['scanTime'] for network in self.networks)
+
+    def get_memory(self):
+        return sum(network['memory'] for network in self.networks)
+
+    def get_memory_size(self):
+        return self.memorySize
+
+    def get_network_costs(self):
+        return self.networks
+
+    def get_chart_costs(self):
+        return self.charts
+
+    def get_report(self):
+        return {'cpu': self.cpu,
+                'networks': len(self.networks),
+                'instructions': sum(network['instructions'] for network in self.networks),
+                'scanTime': self.get_scan_time(),
+                'memory': self.get_memory(),
+                'memorySize': self.memorySize,
+                'charts': self.charts,
+                'networkCosts': self.networks}
+
+    def write_report(self, file):
+        json.dump(self.get_report(), file, indent=2)
+
+    def check_budget(self, scanTime=None, memory=None):
+        """Raises a BudgetError when the scan time or the memory exceeds its budget, the memory budget
+        being the program memory of the CPU by default"""
+        if scanTime is not None and self.get_scan_time() > scanTime:
+            raise BudgetError('scanTime', self.get_scan_time(), scanTime)
+
+        memory = self.memorySize if memory is None else memory
+        if self.get_memory() > memory:
+            raise BudgetError('memory', self.get_memory(), memory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estimates the scan time and the memory of an S7-200 program")
+    parser.add_argument('code', help="instruction list file")
+    parser.add_argument('--cpu', default='CPU 224', choices=sorted(cpuTypes))
+    parser.add_argument('--scan-time', type=float, help="scan time budget in seconds")
+    parser.add_argument('--memory', type=int, help="program memory budget in bytes")
+    parser.add_argument('--json', help="file where the JSON report is written")
+    arguments = parser.parse_args()
+
+    with open(arguments.code, 'r', encoding='utf-8') as file:
+        model = CostModel.for_code(file.read(), arguments.cpu)
+
+    if arguments.json is not None:
+        with open(arguments.json, 'w', encoding='utf-8') as file:
+            model.write_report(file)
+
+    print("{} networks, {:.1f} us per scan, {} of {} bytes".format(len(model.get_network_costs()),
+                                                                    model.get_scan_time() * 1e6,
+                                                                    model.get_memory(), model.get_memory_size()))
+    try:
+        model.check_budget(arguments.scan_time, arguments.memory)
+    except BudgetError as err:
+        print(err)
+        sys.exit(1)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""differential.py"""
+
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from plc import Simatic_S7_200
+from emulator import Simatic_S7_200_Emulator
+from simulator import Simulator
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class CodeGenerationError(Error):
+    """Exception raised when no PLC code can be generated for a GRAFCET.
+
+    Attributes:
+        grafcet -- concerned GRAFCET
+    """
+
+    def __init__(self, grafcet):
+        self.grafcet = grafcet
+
+    def __str__(self):
+        return "No PLC code generated for {}".format(self.grafcet)
+
+
+class Divergence:
+    """Difference between the GRAFCET model and the PLC code after a scan
+
+    Attributes:
+        scan -- number of the scan, 0 being the initialisation scan
+        kind -- 'step', 'transition' or 'output'
+        name -- index of the step or transition, or name of the output
+        model -- value given by the model
+        plc -- value given by the PLC code
+    """
+
+    def __init__(self, scan, kind, name, model, plc):
+        self.scan = scan
+        self.kind = kind
+        self.name = name
+        self.model = model
+        self.plc = plc
+
+    def __str__(self):
+        return "Scan {}: {} {} is {} in the model and {} in the PLC".format(self.scan, self.kind, self.name,
+                                                                           self.model, self.plc)
+
+    def __repr__(self):
+        return str(self)
+
+
+class ScanSimulator(Simulator):
+    """Simulator following the order of the networks generated for one PLC scan
+
+    A scan does one evolution cycle with the delays of the previous scan, then computes the outputs
+    and updates the delays on the new situation, like the TON networks placed at the end of the code.
+    Each group of networks compares its edges with the state it saw at the previous scan.
+    """
+
+    def start(self, inputs=0, time=0.):
+        # At the first scan, the transition networks see no active step and the edge memories are clear
+        super().start(inputs, time)
+        self.previousState = self.compiler.state(0, self.inputs, 0)
+        self.scanState = 0
+        self.end_scan()
+
+    def end_scan(self):
+        state = self.compiler.state(self.situation, self.inputs, self.delays)
+
+        self.outputs = 0
+        for id, output in enumerate(self.outputActions):
+            if output(state, self.scanState):
+                self.outputs |= 1 << id
+
+        # A nested delay has a greater slot than the delay using it and its TON network comes first
+        if self.delayKinds:
+            previousState, self.previousState = self.previousState, self.scanState
+            for slot in reversed(range(len(self.delayKinds))):
+                self.update_delays((slot,))
+            self.previousState = previousState
+
+        self.scanState = state
+
+    def cycle(self):
+        situation = self.situation
+
+        entry = self.situationCache.get(situation)
+        if entry is None:
+            entry = self.analyse(situation)
+
+        state, previousState = self.compiler.state(situation, self.inputs, self.delays), self.previousState
+
+        fired = cleared = activated = 0
+        for bit, precedingMask, succeedingMask, condition in entry[0]:
+            if condition(state, previousState):
+                fired |= bit
+                cleared |= precedingMask
+                activated |= succeedingMask
+
+        self.previousState = state
+        self.situation = situation & ~cleared | activated
+
+        self.end_scan()
+
+        return fired
+
+    def get_outputs(self):
+        return self.outputs
+
+
+class DifferentialTester:
+    """Compares the GRAFCET semantics with the execution of the code generated for a Simatic S7-200
+
+    A scenario is a list of input bitsets, one per scan, on the inputs of the frozen GRAFCET. The PLC
+    reset input is raised at the first scan and kept high. The model is a ScanSimulator doing one
+    evolution cycle per scan, which is what the generated networks compute, so step, transition and
+    output bits must be equal after every scan.
+    """
+
+    def __init__(self, grafcet, period=0.1):
+        self.grafcet = grafcet.freeze()
+        self.period = period
+
+        self.code = Simatic_S7_200().get_code(self.grafcet)
+        if self.code is None:
+            raise CodeGenerationError(self.grafcet)
+
+        self.emulator = Simatic_S7_200_Emulator(self.code)
+        self.simulator = ScanSimulator(self.grafcet)
+
+        # The reset may also be read by conditions: it is kept high on both sides
+        self.resetMask = 0
+        if self.grafcet.plcReset[0] in self.grafcet.inputIds:
+            self.resetMask = 1 << self.grafcet.get_input_id(self.grafcet.plcReset[0])
+
+        self.coverage = (0, 0, 0)
+
+    def __str__(self):
+        return 'Differential tester of {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    def get_grafcet(self):
+        return self.grafcet
+
+    def get_code(self):
+        return self.code
+
+    def get_coverage(self):
+        """Returns the masks of the fired transitions, active steps and true outputs seen so far"""
+        return self.coverage
+
+    def reset_coverage(self):
+        self.coverage = (0, 0, 0)
+
+    def set_plc_inputs(self, inputs):
+        for id, address in enumerate(self.grafcet.inputPlcIndexes):
+            self.emulator.set_bit(address, inputs >> id & 1)
+
+    def get_plc_bits(self, addresses):
+        bits = 0
+        for id, address in enumerate(addresses):
+            if self.emulator.get_bit(address):
+                bits |= 1 << id
+        return bits
+
+    def compare(self, scan, fired):
+        grafcet = self.grafcet
+
+        for kind, names, model, plc in (
+                ('step', grafcet.steps, self.simulator.get_situation(),
+                 self.get_plc_bits(grafcet.stepPlcIndexes)),
+                ('transition', grafcet.transitions, fired,
+                 self.get_plc_bits(grafcet.transitionPlcIndexes)),
+                ('output', grafcet.outputs, self.simulator.get_outputs(),
+                 self.get_plc_bits(grafcet.outputPlcIndexes))):
+            difference = model ^ plc
+            if difference:
+                id = (difference & -difference).bit_length() - 1
+                return Divergence(scan, kind, names[id], bool(model >> id & 1), bool(plc >> id & 1))
+
+        return None
+
+    def run(self, scenario):
+        """Runs the scenario, returns the first divergence or None"""
+        emulator, simulator = self.emulator, self.simulator
+        transitions, steps, outputs = self.coverage
+
+        emulator.reset()
+
+        for scan, inputs in enumerate(scenario):
+            time = scan * self.period
+            inputs |= self.resetMask
+
+            self.set_plc_inputs(inputs)
+            emulator.set_bit(self.grafcet.plcReset[1], 1)
+            emulator.scan(time)
+
+            if scan == 0:
+                simulator.start(inputs, time)
+                fired = 0
+            else:
+                simulator.set_inputs(inputs)
+                simulator.set_time(time)
+                fired = simulator.cycle()
+
+            transitions |= fired
+            steps |= simulator.get_situation()
+            outputs |= simulator.get_outputs()
+
+            divergence = self.compare(scan, fired)
+            if divergence is not None:
+                self.coverage = (transitions, steps, outputs)
+                return divergence
+
+        self.coverage = (transitions, steps, outputs)
+
+        return None
+
+    def minimise(self, scenario):
+        """Returns the shortest scenario found which still diverges, and its divergence"""
+        divergence = self.run(scenario)
+        if divergence is None:
+            return scenario, None
+        scenario = list(scenario[:divergence.scan + 1])
+
+        # Chunks of scans are removed while the scenario diverges, then input bits are cleared
+        size = max(1, len(scenario) // 2)
+        while size >= 1:
+            start = 1
+            while start < len(scenario):
+                candidate = scenario[:start] + scenario[start + size:]
+                result = self.run(candidate)
+                if result is not None:
+                    scenario, divergence = candidate[:result.scan + 1], result
+                else:
+                    start += size
+            size //= 2
+
+        scan = 0
+        while scan < len(scenario):
+            for id in range(len(self.grafcet.inputs)):
+                if scan < len(scenario) and scenario[scan] >> id & 1:
+                    candidate = scenario[:scan] + [scenario[scan] & ~(1 << id)] + scenario[scan + 1:]
+                    result = self.run(candidate)
+                    if result is not None:
+                        scenario, divergence = candidate[:result.scan + 1], result
+            scan += 1
+
+        return scenario, divergence
+
+    def check(self, scenarios):
+        """Returns the minimised (scenario, divergence) of every diverging scenario"""
+        counterexamples = list()
+        for scenario in scenarios:
+            if self.run(scenario) is not None:
+                counterexamples.append(self.minimise(scenario))
+        return counterexamples
+
+    def random_scenario(self, length, generator, changeRate=0.1):
+        # Inputs are held for several scans so that delays can elapse
+        inputs = 0
+        scenario = list()
+        for scan in range(length):
+            for id in range(len(self.grafcet.inputs)):
+                if generator.random() < changeRate:
+                    inputs ^= 1 << id
+            scenario.append(inputs)
+        return scenario
+
+    def mutate(self, scenario, generator, changeRate=0.1):
+        scenario = list(scenario)
+        start = generator.randrange(len(scenario))
+        suffix = self.random_scenario(len(scenario) - start, generator, changeRate)
+        flip = scenario[start - 1] if start else 0
+        return scenario[:start] + [inputs ^ flip for inputs in suffix]
+
+
+workerTesters = dict()
+
+
+def check_in_worker(arguments):
+    # Testers are kept by the worker processes from one batch to the next
+    grafcet, period, scenarios = arguments
+    if (grafcet, period) not in workerTesters:
+        workerTesters[(grafcet, period)] = DifferentialTester(grafcet, period)
+    tester = workerTesters[(grafcet, period)]
+
+    results = list()
+    for scenario in scenarios:
+        tester.reset_coverage()
+        if tester.run(scenario) is None:
+            results.append((tester.get_coverage(), None))
+        else:
+            coverage = tester.get_coverage()
+            results.append((coverage, tester.minimise(scenario)))
+
+    return results
+
+
+class DifferentialCampaign:
+    """Batches of scenarios checked in parallel by a pool of processes
+
+    Scenarios are random at first. Coverage-driven campaigns then mutate the scenarios which fired a
+    transition, activated a step or set an output never seen before.
+    """
+
+    def __init__(self, grafcet, period=0.1, workers=None, batchSize=64):
+        self.grafcet = grafcet.freeze()
+        self.period = period
+        self.batchSize = batchSize
+
+        self.workers = workers
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+
+        self.tester = DifferentialTester(self.grafcet, period)
+
+        self.counterexamples = list()
+        self.coverage = (0, 0, 0)
+        self.corpus = list()
+
+    def __str__(self):
+        return 'Differential campaign on {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    def get_counterexamples(self):
+        return self.counterexamples
+
+    def get_coverage(self):
+        return self.coverage
+
+    def get_coverage_ratio(self):
+        transitions, steps, outputs = self.coverage
+        total = len(self.grafcet.transitions) + len(self.grafcet.steps) + len(self.grafcet.outputs)
+        covered = bin(transitions).count('1') + bin(steps).count('1') + bin(outputs).count('1')
+        return covered / total if total else 1.
+
+    def check_batches(self, batches, executor=None):
+        if executor is not None:
+            results = executor.map(check_in_worker, [(self.grafcet, self.period, batch) for batch in batches])
+        else:
+            results = map(check_in_worker, [(self.grafcet, self.period, batch) for batch in batches])
+
+        # Scenarios increasing the coverage are kept to be mutated
+        for batch, batchResults in zip(batches, results):
+            for scenario, (coverage, counterexample) in zip(batch, batchResults):
+                if counterexample is not None:
+                    self.counterexamples.append(counterexample)
+                merged = tuple(old | new for old, new in zip(self.coverage, coverage))
+                if merged != self.coverage:
+                    self.corpus.append(scenario)
+                    self.coverage = merged
+
+    def run(self, scenarios, length, seed=None, coverageDriven=True):
+        """Checks the given number of scenarios of length scans, returns the counterexamples"""
+        generator = random.Random(seed)
+
+        executor = None
+        if self.workers > 1 and scenarios > self.batchSize:
+            executor = ProcessPoolExecutor(self.workers)
+
+        try:
+            while scenarios > 0:
+                batches = list()
+                while scenarios > 0 and len(batches) < self.workers:
+                    count = min(self.batchSize, scenarios)
+                    scenarios -= count
+                    if coverageDriven and self.corpus:
+                        batches.append([self.tester.mutate(generator.choice(self.corpus), generator)
+                                        for scenario in range(count)])
+                    else:
+                        batches.append([self.tester.random_scenario(length, generator)
+                                        for scenario in range(count)])
+
+                self.check_batches(batches, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return self.counterexamples
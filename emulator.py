@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""emulator.py"""
+
+import re
+
+from plc import Simatic_S7_200
+from ir import instructionSet, mnemonics, OUT
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class InstructionError(Error):
+    """Exception raised for instructions which can not be emulated.
+
+    Attributes:
+        line -- number of the line in the code
+        instruction -- text of the instruction
+    """
+
+    def __init__(self, line, instruction):
+        self.line = line
+        self.instruction = instruction
+
+    def __str__(self):
+        return "Line {}: {} can not be emulated".format(self.line, self.instruction)
+
+
+class StackError(Error):
+    """Exception raised when a network overflows or underflows the logic stack.
+
+    Attributes:
+        network -- number of the network
+        depth -- depth of the stack reached
+    """
+
+    def __init__(self, network, depth):
+        self.network = network
+        self.depth = depth
+
+    def __str__(self):
+        return "Network {} uses a logic stack of depth {}".format(self.network, self.depth)
+
+
+class Simatic_S7_200_Emulator:
+    """Execution of the instruction list generated for a Simatic S7-200
+
+    The code is parsed once into networks of (opcode, operand) instructions. Bit operands are slots of
+    one flat memory image shared by the I, Q, V, M, SM and T areas. The depth of the logic stack is
+    known for every instruction, so the decoded program is translated into a single Python function
+    where each level of the stack is a local variable and each instruction a single statement.
+
+    Timers are updated when their TON instruction is executed, with the time given to the scan.
+    """
+
+    stackSize = 9
+
+    bitAddress = re.compile(r'^(I|Q|V|M|SM)(\d+)\.([0-7])$')
+    timerAddress = re.compile(r'^T(\d+)$')
+
+    instructionSet = instructionSet
+
+    requiredDepths = {'LD': 0, 'LDN': 0, 'ALD': 2, 'OLD': 2, 'LRD': 2}
+
+    opcodes = mnemonics
+
+    ignoredLines = ('SUBROUTINE_BLOCK', 'ORGANIZATION_BLOCK', 'TITLE=', 'BEGIN', 'END_SUBROUTINE_BLOCK',
+                    'END_ORGANIZATION_BLOCK', '//')
+
+    def __init__(self, code):
+        self.slots = dict()
+        self.addresses = list()
+        self.edgeCount = 0
+        self.timers = list()
+        self.timerSlots = dict()
+
+        timeBases = Simatic_S7_200().delayIndexes
+        self.timeBases = {index: timeBase for timeBase, indexes in timeBases.items() for index in indexes}
+
+        # SM0.0 is always on and SM0.1 only on the first scan
+        self.get_slot('SM0.0')
+        self.get_slot('SM0.1')
+
+        self.networks = self.parse(code)
+        self.instructionCount = sum(len(network) for network in self.networks)
+
+        self.scanFunction = self.translate()
+
+        self.reset()
+
+    def __str__(self):
+        return 'Emulator of {} instructions'.format(self.instructionCount)
+
+    def __repr__(self):
+        return str(self)
+
+    def get_slot(self, address):
+        if address not in self.slots:
+            self.slots[address] = len(self.addresses)
+            self.addresses.append(address)
+        return self.slots[address]
+
+    def decode(self, lineNumber, line):
+        mnemonic, _, operands = line.partition(' ')
+        if mnemonic not in self.instructionSet:
+            raise InstructionError(lineNumber, line)
+        opcode, kind, change = self.instructionSet[mnemonic]
+        operands = operands.strip()
+
+        if kind is None:
+            if operands:
+                raise InstructionError(lineNumber, line)
+            return opcode, None
+
+        elif kind == 'edge':
+            if operands:
+                raise InstructionError(lineNumber, line)
+            self.edgeCount += 1
+            return opcode, self.edgeCount - 1
+
+        elif kind == 'timer':
+            timer, _, preset = operands.partition(',')
+            match = self.timerAddress.match(timer.strip())
+            if match is None or int(match.group(1)) not in self.timeBases or not preset.strip().isdigit():
+                raise InstructionError(lineNumber, line)
+            index = int(match.group(1))
+            if index in self.timerSlots:
+                raise InstructionError(lineNumber, line)
+            self.timerSlots[index] = len(self.timers)
+            self.timers.append((self.get_slot(timer.strip()), self.timeBases[index], int(preset)))
+            return opcode, self.timerSlots[index]
+
+        else:
+            if self.bitAddress.match(operands) is None and self.timerAddress.match(operands) is None:
+                raise InstructionError(lineNumber, line)
+            if opcode == OUT and (operands.startswith('I') or operands.startswith('SM')
+                                 or self.timerAddress.match(operands)):
+                raise InstructionError(lineNumber, line)
+            return opcode, self.get_slot(operands)
+
+    def parse(self, code):
+        networks = list()
+        network = None
+
+        for lineNumber, line in enumerate(code.splitlines(), 1):
+            line = line.strip()
+
+            if not line or line.startswith(self.ignoredLines):
+                continue
+
+            if line.startswith('Network'):
+                network = list()
+                networks.append(network)
+                continue
+
+            if network is None:
+                raise InstructionError(lineNumber, line)
+
+            network.append(self.decode(lineNumber, line.split('//')[0].strip()))
+
+        return networks
+
+    def get_networks(self):
+        return self.networks
+
+    def get_instructions(self):
+        return [(self.opcodes[opcode], operand) for network in self.networks for opcode, operand in network]
+
+    def get_instruction_count(self):
+        return self.instructionCount
+
+    def translate_network(self, number, network):
+        lines = list()
+        depth = 0
+
+        for opcode, operand in network:
+            mnemonic = self.opcodes[opcode]
+            change = self.instructionSet[mnemonic][2]
+            top = 's{}'.format(depth - 1)
+            below = 's{}'.format(depth - 2)
+
+            if depth < self.requiredDepths.get(mnemonic, 1):
+                raise StackError(number, depth + change)
+
+            if mnemonic == 'LD':
+                lines.append('s{} = b[{}]'.format(depth, operand))
+            elif mnemonic == 'LDN':
+                lines.append('s{} = b[{}] ^ 1'.format(depth, operand))
+            elif mnemonic == 'A':
+                lines.append('{} &= b[{}]'.format(top, operand))
+            elif mnemonic == 'AN':
+                lines.append('{} &= b[{}] ^ 1'.format(top, operand))
+            elif mnemonic == 'O':
+                lines.append('{} |= b[{}]'.format(top, operand))
+            elif mnemonic == 'ON':
+                lines.append('{} |= b[{}] ^ 1'.format(top, operand))
+            elif mnemonic == 'NOT':
+                lines.append('{} ^= 1'.format(top))
+            elif mnemonic == 'ALD':
+                lines.append('{} &= {}'.format(below, top))
+            elif mnemonic == 'OLD':
+                lines.append('{} |= {}'.format(below, top))
+            elif mnemonic == 'EU':
+                lines.append('{0}, e[{1}] = {0} & (e[{1}] ^ 1), {0}'.format(top, operand))
+            elif mnemonic == 'ED':
+                lines.append('{0}, e[{1}] = ({0} ^ 1) & e[{1}], {0}'.format(top, operand))
+            elif mnemonic == '=':
+                lines.append('b[{}] = {}'.format(operand, top))
+            elif mnemonic == 'TON':
+                lines.append('b[{}] = ton({}, {})'.format(self.timers[operand][0], operand, top))
+            elif mnemonic == 'LPS':
+                lines.append('s{} = {}'.format(depth, top))
+            elif mnemonic == 'LRD':
+                lines.append('{} = {}'.format(top, below))
+
+            depth += change
+            if depth > self.stackSize:
+                raise StackError(number, depth)
+
+        return lines
+
+    def translate(self):
+        lines = ['def scan(b, e, ton):']
+        for number, network in enumerate(self.networks, 1):
+            lines += ['    ' + line for line in self.translate_network(number, network)]
+        lines.append('    return b')
+
+        namespace = dict()
+        exec(compile('\n'.join(lines), '<awl>', 'exec'), namespace)
+        return namespace['scan']
+
+    def reset(self):
+        self.bits = [0] * len(self.addresses)
+        self.edges = [0] * self.edgeCount
+        self.timerStarts = [None] * len(self.timers)
+        self.timerValues = [0] * len(self.timers)
+        self.time = 0.
+        self.scanCount = 0
+
+    def set_bit(self, address, value):
+        slot = self.get_slot(address)
+        if slot == len(self.bits):
+            self.bits.append(0)
+        self.bits[slot] = int(bool(value))
+
+    def get_bit(self, address):
+        if address in self.slots:
+            return bool(self.bits[self.slots[address]])
+        return False
+
+    def set_bits(self, values):
+        for address, value in values.items():
+            self.set_bit(address, value)
+
+    def get_bits(self, area):
+        # Addresses referenced by the code only
+        return {address: bool(self.bits[slot]) for address, slot in self.slots.items()
+                if self.bitAddress.match(address) and self.bitAddress.match(address).group(1) == area}
+
+    def get_timer_value(self, index):
+        return self.timerValues[self.timerSlots[index]]
+
+    def ton(self, timer, enabled):
+        if not enabled:
+            self.timerStarts[timer] = None
+            self.timerValues[timer] = 0
+            return 0
+
+        if self.timerStarts[timer] is None:
+            self.timerStarts[timer] = self.time
+
+        slot, timeBase, preset = self.timers[timer]
+        value = min(int((self.time - self.timerStarts[timer]) / timeBase + 1e-9), 32767)
+        self.timerValues[timer] = value
+
+        return int(value >= preset)
+
+    def scan(self, time=None):
+        if time is not None:
+            self.time = time
+
+        bits = self.bits
+        bits[0] = 1
+        bits[1] = int(self.scanCount == 0)
+
+        self.scanFunction(bits, self.edges, self.ton)
+        self.scanCount += 1
+
+    def run(self, scans, period, inputs=None):
+        """Runs scans spaced by period seconds, inputs being a function of the time returning bit values"""
+        for scan in range(scans):
+            if inputs is not None:
+                self.set_bits(inputs(self.time))
+            self.scan()
+            self.time += period
+
+    def get_executed_instruction_count(self):
+        return self.scanCount * self.instructionCount
@@ -6,6 +6,9 @@
 import sys
 import warnings
 from functools import partial
+from types import MappingProxyType
+
+from allocator import AddressAllocator
 
 
 class Error(Exception):
@@ -24,17 +27,36 @@ class ExpressionIdentifierError(Error):
         self.type = type
 
 
+class FrozenGrafcetError(Error):
+    """Exception raised for modification of a frozen GRAFCET.
+
+    Attributes:
+        object -- object concerned
+    """
+
+    def __init__(self, object):
+        self.object = object
+
+    def __str__(self):
+        return "{} is frozen and can not be modified".format(self.object)
+
+
 class Grafcet:
     """Represents a GRAFCET"""
 
-    def __init__(self, name=None):
+    def __init__(self, name=None, inputs=None, outputs=None):
         self.name = name
 
         self.steps = dict()
         self.transitions = dict()
 
-        self.inputs = dict()
-        self.outputs = dict()
+        self.inputs = inputs
+        self.outputs = outputs
+
+        if self.inputs is None:
+            self.inputs = dict()
+        if self.outputs is None:
+            self.outputs = dict()
 
         self.plcReset = None
 
@@ -76,12 +98,158 @@ class Grafcet:
     def get_transitions(self):
         return self.transitions
 
+    def get_branches(self):
+        branches = list()
+        visited = set()
+
+        initialSteps = [step for step in self.steps.values() if step.is_initial()]
+        otherSteps = [step for step in self.steps.values() if not step.is_initial()]
+
+        for root in initialSteps + otherSteps:
+            if root.get_index() in visited:
+                continue
+
+            # Depth-first walk: each branch holds steps following each other in the GRAFCET
+            branch = list()
+            pending = [root]
+            while pending:
+                step = pending.pop()
+                if step.get_index() in visited:
+                    continue
+                visited.add(step.get_index())
+
+                if branch and not any(step in transition.get_succeeding_steps()
+                                      for transition in branch[-1].get_succeeding_transitions()):
+                    branches.append(branch)
+                    branch = list()
+                branch.append(step)
+
+                for transition in reversed(step.get_succeeding_transitions()):
+                    for succeedingStep in reversed(transition.get_succeeding_steps()):
+                        if succeedingStep.get_index() not in visited:
+                            pending.append(succeedingStep)
+
+            branches.append(branch)
+
+        return branches
+
+    def get_ordered_transitions(self):
+        transitions = list()
+        visited = set()
+
+        for branch in self.get_branches():
+            for step in branch:
+                for transition in step.get_succeeding_transitions():
+                    if transition.get_index() not in visited:
+                        visited.add(transition.get_index())
+                        transitions.append(transition)
+
+        for transition in self.transitions.values():
+            if transition.get_index() not in visited:
+                transitions.append(transition)
+
+        return transitions
+
+    def reserve_plc_indexes(self, allocator):
+        for output in self.outputs.values():
+            if output.get_plc_index() is not None:
+                allocator.reserve(output.get_plc_index(), output)
+
+        for step in self.steps.values():
+            if step.get_plc_index() is not None:
+                allocator.reserve(step.get_plc_index(), step)
+
+        for transition in self.transitions.values():
+            if transition.get_plc_index() is not None:
+                allocator.reserve(transition.get_plc_index(), transition)
+
+    def allocate_plc_indexes(self, allocator=None):
+        """Gives an address to the steps and transitions without one, the addresses already given being kept
+
+        Steps are packed branch by branch in one block, transitions in the same order in another one.
+        Returns the allocator holding the addresses used.
+        """
+        if allocator is None:
+            allocator = AddressAllocator()
+
+        self.reserve_plc_indexes(allocator)
+
+        steps = [step for branch in self.get_branches() for step in branch if step.get_plc_index() is None]
+        for step, address in zip(steps, allocator.allocate_block(steps)):
+            step.set_plc_index(address)
+
+        transitions = [transition for transition in self.get_ordered_transitions()
+                       if transition.get_plc_index() is None]
+        for transition, address in zip(transitions, allocator.allocate_block(transitions)):
+            transition.set_plc_index(address)
+
+        return allocator
+
     def check_consistency(self):
 
         # TODO: to implement
 
         return True
 
+    def freeze(self):
+        steps = list(self.steps.values())
+        transitions = list(self.transitions.values())
+        inputs = list(self.inputs.values())
+        outputs = list(self.outputs.values())
+
+        stepIds = {step.get_index(): id for id, step in enumerate(steps)}
+        transitionIds = {transition.get_index(): id for id, transition in enumerate(transitions)}
+        outputIds = {output.get_name(): id for id, output in enumerate(outputs)}
+
+        actions = list()
+        for step in steps:
+            stepActions = list()
+            for action in step.get_actions():
+                condition = action.get_condition()
+                stepActions.append((outputIds[action.get_output().get_name()],
+                                    condition.freeze() if condition is not None else None))
+            actions.append(tuple(stepActions))
+
+        outputActions = list()
+        for output in outputs:
+            references = list()
+            for action in output.get_actions():
+                step = action.get_step()
+                # Outputs shared in a project also hold actions of other GRAFCETs
+                if self.steps.get(step.get_index()) is step:
+                    references.append((stepIds[step.get_index()], step.get_actions().index(action)))
+            outputActions.append(tuple(references))
+
+        plcReset = None
+        if self.plcReset is not None:
+            plcReset = (self.plcReset.get_name(), self.plcReset.get_plc_index())
+
+        return FrozenGrafcet((
+            self.name,
+            tuple(step.get_index() for step in steps),
+            tuple(tuple(step.commentary) if type(step.commentary) is list else step.commentary for step in steps),
+            tuple(stepIds[step.get_index()] for step in steps if step.is_initial()),
+            tuple(step.get_plc_index() for step in steps),
+            tuple(transition.get_index() for transition in transitions),
+            tuple(transition.get_plc_index() for transition in transitions),
+            tuple(transition.get_condition().freeze() if transition.get_condition() is not None else None
+                  for transition in transitions),
+            tuple(input.get_name() for input in inputs),
+            tuple(input.get_plc_index() for input in inputs),
+            tuple(output.get_name() for output in outputs),
+            tuple(output.get_plc_index() for output in outputs),
+            plcReset,
+            tuple(tuple(stepIds[step.get_index()] for step in transition.get_preceding_steps())
+                  for transition in transitions),
+            tuple(tuple(stepIds[step.get_index()] for step in transition.get_succeeding_steps())
+                  for transition in transitions),
+            tuple(tuple(transitionIds[transition.get_index()] for transition in step.get_preceding_transitions())
+                  for step in steps),
+            tuple(tuple(transitionIds[transition.get_index()] for transition in step.get_succeeding_transitions())
+                  for step in steps),
+            tuple(actions),
+            tuple(outputActions)))
+
     def generate(self, code):
 
         self.name = code[0]
@@ -161,7 +329,7 @@ class Grafcet:
             elif rawExpression[0] == 'DE' or rawExpression[0] == 'DU':
                 subexpression = [rawExpression[1][0]]
                 subexpression.append(self.preprocess_expression(rawExpression[1][1]))
-                subexpression.append(0)
+                subexpression.append(rawExpression[1][2] if len(rawExpression[1]) > 2 else 0)
                 expression.append(subexpression)
                 # TODO: add other cases
 
@@ -196,6 +364,57 @@ class Grafcet:
     def get_outputs(self):
         return self.outputs
 
+    def share_symbols(self, inputs, outputs):
+        if inputs is self.inputs and outputs is self.outputs:
+            return
+
+        for name, input in self.inputs.items():
+            if name not in inputs:
+                inputs[name] = input
+            elif inputs[name].get_plc_index() is None:
+                inputs[name].set_plc_index(input.get_plc_index())
+
+        for name, output in self.outputs.items():
+            if name not in outputs:
+                outputs[name] = output
+            elif outputs[name] is not output:
+                if outputs[name].get_plc_index() is None:
+                    outputs[name].set_plc_index(output.get_plc_index())
+                for action in output.get_actions():
+                    action.set_output(outputs[name])
+                    outputs[name].add_action(action)
+
+        if self.plcReset is not None and self.plcReset.get_name() in inputs:
+            self.plcReset = inputs[self.plcReset.get_name()]
+
+        for transition in self.transitions.values():
+            self.share_expression_symbols(transition.get_condition(), inputs, outputs)
+
+        for step in self.steps.values():
+            for action in step.get_actions():
+                self.share_expression_symbols(action.get_condition(), inputs, outputs)
+
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def share_expression_symbols(self, expression, inputs, outputs):
+        if expression is None:
+            return
+
+        member = expression.get_expression()
+
+        if type(member) is ExpressionBinary:
+            for subexpression in member.get_members():
+                self.share_expression_symbols(subexpression, inputs, outputs)
+        elif type(member) is ExpressionUnary:
+            self.share_expression_symbols(member.get_member(), inputs, outputs)
+        elif type(member) is Delay or type(member) is Duration:
+            self.share_expression_symbols(member.get_expression(), inputs, outputs)
+        elif type(member) is Input:
+            expression.expression = inputs[member.get_name()]
+        elif type(member) is Output:
+            expression.expression = outputs[member.get_name()]
+
     def import_plc_data_inputs(self, content):
         for row in content:
             if row[0] not in self.inputs.keys():
@@ -228,6 +447,21 @@ class Grafcet:
             else:
                 self.transitions[row[0][1:]].set_plc_index(row[1])
 
+    def export_plc_data_steps(self):
+        rows = list()
+        for step in self.steps.values():
+            rows.append(['X' + step.get_index(), step.get_plc_index(), 'Etape ' + step.get_index()])
+
+        return rows
+
+    def export_plc_data_transitions(self):
+        rows = list()
+        for transition in self.transitions.values():
+            rows.append(['Y' + transition.get_index(), transition.get_plc_index(),
+                         'Condition de franchissement de la transition ' + transition.get_index()])
+
+        return rows
+
     def import_plc_data_reset(self, content):
         for row in content:
             if row[0][1:] not in self.transitions.keys():
@@ -235,6 +469,177 @@ class Grafcet:
                 self.plcReset = input
 
 
+class FrozenGrafcet:
+    """Immutable snapshot of a GRAFCET
+
+    Steps, transitions, inputs and outputs are identified by their position in the tuples of
+    indexes and names. Conditions are nested tuples in the form given by Expression.freeze.
+    """
+
+    fieldNames = ('name',
+                  'steps', 'stepCommentaries', 'initialSteps', 'stepPlcIndexes',
+                  'transitions', 'transitionPlcIndexes', 'conditions',
+                  'inputs', 'inputPlcIndexes',
+                  'outputs', 'outputPlcIndexes',
+                  'plcReset',
+                  'precedingSteps', 'succeedingSteps',
+                  'precedingTransitions', 'succeedingTransitions',
+                  'actions', 'outputActions')
+
+    __slots__ = fieldNames + ('fields', 'hash', 'stepIds', 'transitionIds', 'inputIds', 'outputIds')
+
+    def __init__(self, fields):
+        object.__setattr__(self, 'fields', tuple(fields))
+        for name, value in zip(self.fieldNames, self.fields):
+            object.__setattr__(self, name, value)
+
+        object.__setattr__(self, 'hash', hash(self.fields))
+        object.__setattr__(self, 'stepIds', self.lookup(self.steps))
+        object.__setattr__(self, 'transitionIds', self.lookup(self.transitions))
+        object.__setattr__(self, 'inputIds', self.lookup(self.inputs))
+        object.__setattr__(self, 'outputIds', self.lookup(self.outputs))
+
+    @staticmethod
+    def lookup(keys):
+        return MappingProxyType({key: id for id, key in enumerate(keys)})
+
+    def __str__(self):
+        return 'Frozen grafcet {}'.format(self.name)
+
+    def __repr__(self):
+        return str(self)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return type(other) is FrozenGrafcet and self.hash == other.hash and self.fields == other.fields
+
+    def __reduce__(self):
+        return FrozenGrafcet, (self.fields,)
+
+    def __setattr__(self, name, value):
+        raise FrozenGrafcetError(self)
+
+    def __delattr__(self, name):
+        raise FrozenGrafcetError(self)
+
+    def get_step_id(self, index):
+        return self.stepIds[index]
+
+    def get_transition_id(self, index):
+        return self.transitionIds[index]
+
+    def get_input_id(self, name):
+        return self.inputIds[name]
+
+    def get_output_id(self, name):
+        return self.outputIds[name]
+
+    def get_plc_reset(self):
+        return self.plcReset
+
+    def check_consistency(self):
+        return True
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        grafcet = Grafcet(self.name)
+
+        for name, plcIndex in zip(self.inputs, self.inputPlcIndexes):
+            grafcet.inputs[name] = Input(name, plcIndex)
+
+        for name, plcIndex in zip(self.outputs, self.outputPlcIndexes):
+            grafcet.outputs[name] = Output(name, plcIndex)
+
+        if self.plcReset is not None:
+            grafcet.set_plc_reset(Input(*self.plcReset))
+
+        steps = list()
+        for index, commentary, plcIndex in zip(self.steps, self.stepCommentaries, self.stepPlcIndexes):
+            if type(commentary) is tuple:
+                commentary = list(commentary)
+            steps.append(Step(index, commentary=commentary, plcIndex=plcIndex))
+            grafcet.add_step(steps[-1])
+
+        for id in self.initialSteps:
+            steps[id].set_initial(True)
+
+        transitions = list()
+        for index, plcIndex in zip(self.transitions, self.transitionPlcIndexes):
+            transitions.append(Transition(index, plcIndex=plcIndex))
+            grafcet.add_transition(transitions[-1])
+
+        for transition, precedingSteps, succeedingSteps in zip(transitions, self.precedingSteps,
+                                                              self.succeedingSteps):
+            for id in precedingSteps:
+                transition.add_preceding_step(steps[id])
+            for id in succeedingSteps:
+                transition.add_succeeding_step(steps[id])
+
+        for step, precedingTransitions, succeedingTransitions in zip(steps, self.precedingTransitions,
+                                                                    self.succeedingTransitions):
+            for id in precedingTransitions:
+                step.add_preceding_transition(transitions[id])
+            for id in succeedingTransitions:
+                step.add_succeeding_transition(transitions[id])
+
+        for step, actions in zip(steps, self.actions):
+            for outputId, condition in actions:
+                action = Action(output=grafcet.outputs[self.outputs[outputId]])
+                if condition is not None:
+                    action.set_condition(grafcet.process_expression(condition))
+                step.add_action(action)
+
+        for name, references in zip(self.outputs, self.outputActions):
+            for stepId, rank in references:
+                grafcet.outputs[name].add_action(steps[stepId].get_actions()[rank])
+
+        for transition, condition in zip(transitions, self.conditions):
+            if condition is not None:
+                transition.set_condition(grafcet.process_expression(condition))
+
+        return grafcet
+
+    def set_plc_reset(self, plcReset):
+        raise FrozenGrafcetError(self)
+
+    def add_step(self, step):
+        raise FrozenGrafcetError(self)
+
+    def delete_step(self, step):
+        raise FrozenGrafcetError(self)
+
+    def add_transition(self, transition):
+        raise FrozenGrafcetError(self)
+
+    def delete_transition(self, transition):
+        raise FrozenGrafcetError(self)
+
+    def generate(self, code):
+        raise FrozenGrafcetError(self)
+
+    def share_symbols(self, inputs, outputs):
+        raise FrozenGrafcetError(self)
+
+    def import_plc_data_inputs(self, content):
+        raise FrozenGrafcetError(self)
+
+    def import_plc_data_outputs(self, content):
+        raise FrozenGrafcetError(self)
+
+    def import_plc_data_steps(self, content):
+        raise FrozenGrafcetError(self)
+
+    def import_plc_data_transitions(self, content):
+        raise FrozenGrafcetError(self)
+
+    def import_plc_data_reset(self, content):
+        raise FrozenGrafcetError(self)
+
+
 class Step:
     """Step of a GRAFCET"""
 
@@ -493,6 +898,9 @@ class ExpressionBinary:
     def get_members(self):
         return self.members
 
+    def freeze(self):
+        return self.type, tuple(member.freeze() for member in self.members)
+
 
 class ExpressionUnary:
 
@@ -520,6 +928,9 @@ class ExpressionUnary:
     def get_member(self):
         return self.member
 
+    def freeze(self):
+        return self.type, self.member.freeze()
+
 
 class Constant:
 
@@ -538,6 +949,9 @@ class Constant:
     def get_value(self):
         return self.value
 
+    def freeze(self):
+        return 'CT', self.value
+
 
 class Delay:
 
@@ -570,6 +984,9 @@ class Delay:
     def get_delay_fe(self):
         return self.delay_fe
 
+    def freeze(self):
+        return 'DE', (self.delay_re, self.expression.freeze(), self.delay_fe)
+
 
 class Duration:
 
@@ -595,6 +1012,9 @@ class Duration:
     def get_duration(self):
         return self.duration
 
+    def freeze(self):
+        return 'DU', (self.duration, self.expression.freeze())
+
 
 class Input:
 
@@ -684,3 +1104,13 @@ class Expression:
 
     def get_expression(self):
         return self.expression
+
+    def freeze(self):
+        if type(self.expression) is Input:
+            return 'IN', self.expression.get_name()
+        elif type(self.expression) is Output:
+            return 'OU', self.expression.get_name()
+        elif type(self.expression) is Step:
+            return 'ST', self.expression.get_index()
+        else:
+            return self.expression.freeze()
@@ -3,10 +3,13 @@
 
 """grafcet2plc.py"""
 
+import argparse
 import csv
+import sys
 
 from grafcetparser import GrafcetParser
 from plc import *
+from costmodel import CostModel, BudgetError, cpuTypes
 
 introduction = '''
 ================== grafcet2plc =======================
@@ -18,6 +21,13 @@ It will use the files in the folder named "example".
 ======================================================
 '''
 
+parser = argparse.ArgumentParser(description="Converts the GRAFCET of the example folder in S7-200 code")
+parser.add_argument('--cpu', default='CPU 224', choices=sorted(cpuTypes))
+parser.add_argument('--scan-time', type=float, help="scan time budget in seconds")
+parser.add_argument('--memory', type=int, help="program memory budget in bytes")
+parser.add_argument('--json', help="file where the JSON cost report is written")
+arguments = parser.parse_args()
+
 print(introduction)
 
 print(">>> Opening input file…")
@@ -62,9 +72,32 @@ with open('example/plcReset.csv', newline='') as csvfile:
     contentReset = csv.reader(csvfile, delimiter=';', quotechar='"')
     grafcet.import_plc_data_reset(contentReset)
 
+print(">>> Allocate missing PLC addresses…")
+grafcet.allocate_plc_indexes()
+
+print("\t* Steps in 'example/resultSteps.csv'…")
+with open('example/resultSteps.csv', 'w', newline='') as csvfile:
+    csv.writer(csvfile, delimiter=';', quotechar='"').writerows(grafcet.export_plc_data_steps())
+
+print("\t* Transitions in 'example/resultTransitions.csv'…")
+with open('example/resultTransitions.csv', 'w', newline='') as csvfile:
+    csv.writer(csvfile, delimiter=';', quotechar='"').writerows(grafcet.export_plc_data_transitions())
+
 print(">>> Converting Grafcet in S7-200 code…")
 plc = Simatic_S7_200()
 code = plc.get_code(grafcet)
+print(">>> Condition minimization:")
+print(plc.minimizer.get_report())
+print(">>> Common subexpressions:")
+print(plc.eliminator.get_report())
+print(">>> Timer allocation:")
+print(plc.timerAllocator.get_report())
+print(">>> Stack scheduling:")
+print(plc.scheduler.get_report())
+print(">>> Peephole optimization:")
+print(plc.peephole.get_report())
+print(">>> Network ordering:")
+print(plc.orderer.get_report())
 
 print(">>> Result:")
 print(code)
@@ -73,5 +106,22 @@ print(">>> Writing result file in 'example/result.awl'…")
 with open('example/result.awl', 'w', encoding='utf-8') as file:
     file.write(code)
 
+print(">>> Cost estimation for the {}:".format(arguments.cpu))
+model = CostModel.for_grafcet(grafcet, arguments.cpu)
+print("{} networks, {:.1f} us per scan, {} of {} bytes".format(len(model.get_network_costs()),
+                                                                model.get_scan_time() * 1e6,
+                                                                model.get_memory(), model.get_memory_size()))
+
+if arguments.json is not None:
+    print(">>> Writing cost report in '{}'…".format(arguments.json))
+    with open(arguments.json, 'w', encoding='utf-8') as file:
+        model.write_report(file)
+
+try:
+    model.check_budget(arguments.scan_time, arguments.memory)
+except BudgetError as err:
+    print(">>> Budget exceeded:", err)
+    sys.exit(1)
+
 print(">>> Conversion DONE")
 print(">>> Exit")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""ir.py"""
+
+# Opcodes of the Simatic S7-200 instructions generated from GRAFCETs
+LD, LDN, A, AN, O, ON, NOT, ALD, OLD, EU, ED, OUT, TON, LPS, LRD, LPP = range(16)
+
+# Mnemonic: (opcode, operand kind, stack depth change)
+instructionSet = {'LD': (LD, 'bit', 1),
+                  'LDN': (LDN, 'bit', 1),
+                  'A': (A, 'bit', 0),
+                  'AN': (AN, 'bit', 0),
+                  'O': (O, 'bit', 0),
+                  'ON': (ON, 'bit', 0),
+                  'NOT': (NOT, None, 0),
+                  'ALD': (ALD, None, -1),
+                  'OLD': (OLD, None, -1),
+                  'EU': (EU, 'edge', 0),
+                  'ED': (ED, 'edge', 0),
+                  '=': (OUT, 'bit', 0),
+                  'TON': (TON, 'timer', 0),
+                  'LPS': (LPS, None, 1),
+                  'LRD': (LRD, None, 0),
+                  'LPP': (LPP, None, -1)}
+
+mnemonics = {opcode: mnemonic for mnemonic, (opcode, kind, change) in instructionSet.items()}
+
+
+def render_instruction(opcode, operand):
+    if opcode == TON:
+        return 'TON T{}, {}\n'.format(*operand)
+    elif operand is None:
+        return mnemonics[opcode] + '\n'
+    else:
+        return mnemonics[opcode] + ' ' + operand + '\n'
+
+
+class Network:
+    """Network of a PLC program as a list of (opcode, operand) instructions
+
+    Bit operands are addresses, TON operands are (timer index, preset) pairs and the other
+    instructions have no operand. The comment is written after the number of the network.
+    """
+
+    def __init__(self, comment, instructions=None):
+        self.comment = comment
+        self.instructions = list() if instructions is None else instructions
+
+    def __str__(self):
+        return 'Network {}'.format(self.comment)
+
+    def __repr__(self):
+        return str(self)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __iter__(self):
+        return iter(self.instructions)
+
+    def get_comment(self):
+        return self.comment
+
+    def get_instructions(self):
+        return self.instructions
+
+    def set_instructions(self, instructions):
+        self.instructions = instructions
+
+    def append(self, opcode, operand=None):
+        self.instructions.append((opcode, operand))
+
+    def extend(self, instructions):
+        self.instructions.extend(instructions)
+
+    def render(self, number):
+        return 'Network {} // {}\n'.format(number, self.comment) + ''.join(
+            render_instruction(opcode, operand) for opcode, operand in self.instructions)
+
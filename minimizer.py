@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""minimizer.py"""
+
+from grafcet import *
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class CoverSizeError(Error):
+    """Exception raised when the sum of products of a condition has too many products.
+
+    Attributes:
+        size -- number of products reached
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+
+class LogicMinimizer:
+    """Minimizes frozen conditions into sums of products
+
+    Steps, inputs, outputs, edges and delays are the variables of a condition: edges and delays are
+    opaque, their expressions are left as they are. A product is a cube (care, value) of masks on the
+    variables, the bit i of care telling whether the variable i is in the product and the bit i of
+    value whether it is direct or negated.
+
+    Conditions of few variables are minimized by Quine-McCluskey on their truth table: prime
+    implicants, essential ones, then the others greedily. Larger ones follow Espresso: the condition
+    is developed into a sum of products, whose products are expanded into primes then made
+    irredundant, containment being checked by tautology of the cofactors.
+
+    The condition and its complement followed by a NOT are both minimized. The cheapest of them and of
+    the condition as typed is kept, its cost being the number of S7-200 instructions once loads are
+    combined; results fitting in the logic stack of the PLC only are kept. Results are cached by each
+    minimizer on the canonical form of the condition: members of products and sums flattened, sorted
+    and deduplicated. The caller clears the cache once its conditions are minimized.
+    """
+
+    exactLimit = 8
+    cubeLimit = 512
+    # The network loads a step before the condition
+    stackDepth = 8
+    instructionTime = 0.22e-6
+
+    def __init__(self):
+        self.savings = dict()
+        self.results = dict()
+
+    def __str__(self):
+        return 'Logic minimizer'
+
+    def __repr__(self):
+        return str(self)
+
+    def clear_cache(self):
+        self.results = dict()
+
+    @staticmethod
+    def is_atom(condition):
+        return condition[0] not in ('AND', 'OR', 'NOT', 'CT')
+
+    def canonical(self, condition):
+        kind, value = condition
+
+        if kind == 'CT':
+            return 'CT', int(bool(value))
+
+        elif kind == 'NOT':
+            member = self.canonical(value)
+            if member[0] == 'NOT':
+                return member[1]
+            elif member[0] == 'CT':
+                return 'CT', 1 - member[1]
+            return 'NOT', member
+
+        elif kind == 'AND' or kind == 'OR':
+            neutral = 1 if kind == 'AND' else 0
+            members = set()
+            for member in value:
+                member = self.canonical(member)
+                if member[0] == kind:
+                    members.update(member[1])
+                elif member == ('CT', neutral):
+                    continue
+                elif member == ('CT', 1 - neutral):
+                    return member
+                else:
+                    members.add(member)
+            if not members:
+                return 'CT', neutral
+            elif len(members) == 1:
+                return members.pop()
+            return kind, tuple(sorted(members, key=repr))
+
+        else:
+            return condition
+
+    def get_atoms(self, condition, atoms):
+        if self.is_atom(condition):
+            atoms.add(condition)
+        elif condition[0] == 'NOT':
+            self.get_atoms(condition[1], atoms)
+        elif condition[0] != 'CT':
+            for member in condition[1]:
+                self.get_atoms(member, atoms)
+
+        return atoms
+
+    def get_truth_table(self, condition, variables, count):
+        """Returns the truth table of the condition as an integer, the bit m being its value for the
+        minterm m: the whole table is computed by a single pass on the condition"""
+        kind, value = condition
+        full = (1 << (1 << count)) - 1
+
+        if kind == 'CT':
+            return full if value else 0
+        elif kind == 'NOT':
+            return full ^ self.get_truth_table(value, variables, count)
+        elif kind == 'AND':
+            table = full
+            for member in value:
+                table &= self.get_truth_table(member, variables, count)
+            return table
+        elif kind == 'OR':
+            table = 0
+            for member in value:
+                table |= self.get_truth_table(member, variables, count)
+            return table
+        else:
+            # Minterms having the variable set: blocks of 2 ** variable ones and zeros
+            variable = variables[condition]
+            block = ((1 << (1 << variable)) - 1) << (1 << variable)
+            table = 0
+            for start in range(0, 1 << count, 2 << variable):
+                table |= block << start
+            return table
+
+    def quine_mccluskey(self, condition, variables):
+        count = len(variables)
+        table = self.get_truth_table(condition, variables, count)
+        minterms = [minterm for minterm in range(1 << count) if table >> minterm & 1]
+
+        # Implicants are (value, dashes): they are merged while they differ by one bit only
+        implicants = {(minterm, 0) for minterm in minterms}
+        primes = set()
+        while implicants:
+            merged = set()
+            used = set()
+            for value, dashes in implicants:
+                for variable in range(count):
+                    bit = 1 << variable
+                    if not (dashes | value) & bit and (value | bit, dashes) in implicants:
+                        merged.add((value, dashes | bit))
+                        used.add((value, dashes))
+                        used.add((value | bit, dashes))
+            primes |= implicants - used
+            implicants = merged
+
+        full = (1 << count) - 1
+        cubes = sorted(((full & ~dashes, value) for value, dashes in primes),
+                       key=lambda cube: (bin(cube[0]).count('1'), cube))
+
+        covering = {minterm: [cube for cube in cubes if minterm & cube[0] == cube[1]] for minterm in minterms}
+        cover = list()
+        for minterm in minterms:
+            if len(covering[minterm]) == 1 and covering[minterm][0] not in cover:
+                cover.append(covering[minterm][0])
+
+        uncovered = {minterm for minterm in minterms if not any(minterm & care == value for care, value in cover)}
+        while uncovered:
+            best = max(cubes, key=lambda cube: sum(1 for minterm in uncovered if minterm & cube[0] == cube[1]))
+            cover.append(best)
+            uncovered = {minterm for minterm in uncovered if minterm & best[0] != best[1]}
+
+        return cover
+
+    def develop(self, condition, variables, negated=False):
+        # Sum of products of the condition, NOT being pushed down to the variables
+        kind, value = condition
+
+        if kind == 'CT':
+            return [(0, 0)] if bool(value) != negated else []
+
+        elif kind == 'NOT':
+            return self.develop(value, variables, not negated)
+
+        elif kind == 'AND' or kind == 'OR':
+            if (kind == 'OR') != negated:
+                cover = list()
+                for member in value:
+                    cover.extend(self.develop(member, variables, negated))
+                    if len(cover) > self.cubeLimit:
+                        raise CoverSizeError(len(cover))
+                return cover
+
+            cover = [(0, 0)]
+            for member in value:
+                memberCover = self.develop(member, variables, negated)
+                product = list()
+                for care, cubeValue in cover:
+                    for memberCare, memberValue in memberCover:
+                        if (care & memberCare) & (cubeValue ^ memberValue):
+                            continue
+                        product.append((care | memberCare, cubeValue | memberValue))
+                        if len(product) > self.cubeLimit:
+                            raise CoverSizeError(len(product))
+                cover = product
+            return cover
+
+        else:
+            bit = 1 << variables[condition]
+            return [(bit, 0 if negated else bit)]
+
+    @staticmethod
+    def cofactor(cover, cube):
+        care, value = cube
+        return [(cubeCare & ~care, cubeValue & ~care) for cubeCare, cubeValue in cover
+                if not (cubeCare & care) & (cubeValue ^ value)]
+
+    def is_tautology(self, cover):
+        if not cover:
+            return False
+
+        positive = dict()
+        negative = dict()
+        for care, value in cover:
+            if not care:
+                return True
+            bits = care
+            while bits:
+                bit = bits & -bits
+                if value & bit:
+                    positive[bit] = positive.get(bit, 0) + 1
+                else:
+                    negative[bit] = negative.get(bit, 0) + 1
+                bits ^= bit
+
+        # A unate cover without the universal cube is not a tautology
+        binates = [bit for bit in positive if bit in negative]
+        if not binates:
+            return False
+
+        bit = max(binates, key=lambda bit: (positive[bit] + negative[bit], bit))
+        return self.is_tautology(self.cofactor(cover, (bit, bit))) and self.is_tautology(self.cofactor(cover, (bit, 0)))
+
+    def contains(self, cover, cube):
+        return self.is_tautology(self.cofactor(cover, cube))
+
+    def espresso(self, condition, variables):
+        onSet = self.develop(condition, variables)
+
+        # Expand: literals are removed while the product stays in the on-set, longest products first
+        expanded = list()
+        for care, value in sorted(set(onSet), key=lambda cube: -bin(cube[0]).count('1')):
+            if any(care & expandedCare == expandedCare and value & expandedCare == expandedValue
+                   for expandedCare, expandedValue in expanded):
+                continue
+            bits = care
+            while bits:
+                bit = bits & -bits
+                bits ^= bit
+                if self.contains(onSet, (care & ~bit, value & ~bit)):
+                    care &= ~bit
+                    value &= ~bit
+            expanded.append((care, value))
+
+        # Irredundant: products covered by the others are removed, longest first
+        cover = list(dict.fromkeys(expanded))
+        for cube in sorted(cover, key=lambda cube: -bin(cube[0]).count('1')):
+            others = [other for other in cover if other != cube]
+            if self.contains(others, cube):
+                cover = others
+
+        return cover
+
+    def build(self, cover, atoms):
+        products = list()
+        for care, value in cover:
+            literals = list()
+            for variable, atom in enumerate(atoms):
+                if care >> variable & 1:
+                    literals.append(atom if value >> variable & 1 else ('NOT', atom))
+            if not literals:
+                return 'CT', 1
+            products.append(literals[0] if len(literals) == 1 else ('AND', tuple(literals)))
+
+        if not products:
+            return 'CT', 0
+        return products[0] if len(products) == 1 else ('OR', tuple(products))
+
+    def is_simple(self, condition):
+        # Loads which are combined in a single A, AN, O or ON instruction
+        if condition[0] == 'NOT':
+            condition = condition[1]
+        return self.is_atom(condition) and condition[0] not in ('RE', 'FE')
+
+    def get_cost(self, condition):
+        """Returns the number of instructions of the condition once loads are combined"""
+        kind, value = condition
+
+        if kind == 'CT':
+            return 0 if value else 1
+        elif kind == 'NOT':
+            return self.get_cost(value) + (not self.is_simple(condition))
+        elif kind == 'RE' or kind == 'FE':
+            return self.get_cost(value) + 1
+        elif kind == 'AND' or kind == 'OR':
+            return sum(self.get_cost(member) + (rank > 0 and not self.is_simple(member))
+                       for rank, member in enumerate(value))
+        else:
+            return 1
+
+    def get_depth(self, condition):
+        """Returns the depth of the logic stack needed by the condition"""
+        kind, value = condition
+
+        if kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return self.get_depth(value)
+        elif kind == 'AND' or kind == 'OR':
+            return max([self.get_depth(value[0])] + [self.get_depth(member) + 1 for member in value[1:]
+                                                    if not self.is_simple(member)])
+        else:
+            return 1
+
+    def search(self, canonical):
+        atoms = sorted(self.get_atoms(canonical, set()), key=repr)
+        variables = {atom: variable for variable, atom in enumerate(atoms)}
+
+        candidates = list()
+        for negated in (False, True):
+            condition = ('NOT', canonical) if negated else canonical
+            try:
+                if len(atoms) <= self.exactLimit:
+                    cover = self.quine_mccluskey(condition, variables)
+                else:
+                    cover = self.espresso(condition, variables)
+            except CoverSizeError:
+                continue
+            result = self.canonical(('NOT', self.build(cover, atoms))) if negated else self.build(cover, atoms)
+            if self.get_depth(result) <= self.stackDepth:
+                candidates.append(result)
+
+        return min(candidates, key=self.get_cost) if candidates else None
+
+    def minimize(self, condition, name=None):
+        """Returns the cheapest condition equivalent to the frozen condition, the condition itself if it
+        is not improved. Savings are recorded under the name."""
+        if condition is None:
+            return condition
+
+        canonical = self.canonical(condition)
+        if canonical not in self.results:
+            self.results[canonical] = self.search(canonical)
+
+        result = self.results[canonical]
+        before = self.get_cost(condition)
+        if result is None or self.get_cost(result) >= before:
+            result = condition
+
+        if name is not None:
+            self.savings[name] = (before, self.get_cost(result))
+
+        return result
+
+    def get_savings(self):
+        """Returns {name: (instructions before, instructions after)} for the conditions minimized"""
+        return dict(self.savings)
+
+    def get_report(self):
+        before = sum(counts[0] for counts in self.savings.values())
+        after = sum(counts[1] for counts in self.savings.values())
+        lines = ['{} conditions, {} instructions before, {} after, {:.2f} us saved per scan'.format(
+            len(self.savings), before, after, (before - after) * self.instructionTime * 1e6)]
+        for name, (before, after) in self.savings.items():
+            if after < before:
+                lines.append('{}: {} -> {} instructions, {:.2f} us saved per scan'.format(
+                    name, before, after, (before - after) * self.instructionTime * 1e6))
+        return '\n'.join(lines)
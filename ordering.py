@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""ordering.py"""
+
+import heapq
+
+from ir import LD, LDN, A, AN, O, ON, OUT, TON
+from transient import strongly_connected_components
+
+
+class NetworkOrderer:
+    """Program pass ordering the networks by their read and write dependencies
+
+    A network depends on every network writing a bit it reads: the change is read during the same
+    scan when the writer is placed before, during the next scan otherwise. Backward edges are the
+    feedback set breaking the cycles of the dependency graph, each one costing a scan.
+
+    Latches, networks reading a bit they write like steps, and TON networks keep a state from a scan
+    to the next: the networks placed before a latch and reading it see the situation before the
+    evolution, like transitions, the ones placed after see the new situation, like outputs. Every
+    dependency between a latch and another network is kept in the order of the conversion, which
+    fires the transitions of a GRAFCET simultaneously. So is every pair of networks writing the same
+    bit. The other networks are combinational: a backward edge between two of them is turned forward,
+    the writer being moved before the reader, when this makes no cycle and the latches the writer
+    reads during the scan are all placed before the reader, which then keeps seeing the situation it
+    was placed after. Edges are turned until none can be anymore, so the feedback set left is
+    minimal: each of its edges either is kept by a latch or closes a cycle. The networks are then
+    sorted topologically, the order of the conversion being kept otherwise.
+
+    The propagation scans of a path are its backward edges. Components crossing at most once each of
+    their networks having a backward edge inside, the worst propagation is the longest path of the
+    condensed graph, computed before and after the ordering. Called on several windows of a program,
+    the report sums their edges and keeps their worst propagation.
+    """
+
+    readOpcodes = (LD, LDN, A, AN, O, ON)
+
+    def __init__(self):
+        self.reset()
+
+    def __str__(self):
+        return 'Network orderer'
+
+    def __repr__(self):
+        return str(self)
+
+    def __call__(self, networks):
+        networks = list(networks)
+        order = self.order(networks)
+
+        return [networks[number] for number in order]
+
+    def reset(self):
+        self.networks = 0
+        self.scansBefore = 0
+        self.scansAfter = 0
+        self.feedbackBefore = 0
+        self.feedbackAfter = 0
+
+    @classmethod
+    def get_bits(cls, network):
+        """Returns the sets of the bits read and written by the network"""
+        reads = set()
+        writes = set()
+        for opcode, operand in network:
+            if opcode in cls.readOpcodes:
+                reads.add(operand)
+            elif opcode == OUT:
+                writes.add(operand)
+            elif opcode == TON:
+                writes.add('T' + str(operand[0]))
+
+        return reads, writes
+
+    def get_dependencies(self, networks):
+        # Readers of every network, latches and pairs of networks which must keep their order
+        bits = [self.get_bits(network) for network in networks]
+        writers = dict()
+        for number, (reads, writes) in enumerate(bits):
+            for bit in writes:
+                writers.setdefault(bit, list()).append(number)
+
+        readers = [set() for network in networks]
+        pinned = set()
+        for number, (reads, writes) in enumerate(bits):
+            for bit in reads:
+                for writer in writers.get(bit, ()):
+                    if writer != number:
+                        readers[writer].add(number)
+        for bit, numbers in writers.items():
+            for rank, writer in enumerate(numbers):
+                pinned.update((writer, other) for other in numbers[rank + 1:])
+
+        latches = {number for number, (reads, writes) in enumerate(bits)
+                   if reads & writes or any(opcode == TON for opcode, operand in networks[number])}
+
+        return readers, latches, pinned
+
+    @staticmethod
+    def reaches(successors, source, target):
+        visited = {source}
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            for successor in successors[node]:
+                if successor == target:
+                    return True
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append(successor)
+
+        return False
+
+    @staticmethod
+    def get_feeding_latches(writers, successors, latches, number):
+        # Latches whose change the network reads during the same scan
+        feeding = set()
+        visited = {number}
+        stack = [number]
+        while stack:
+            node = stack.pop()
+            for writer in writers[node]:
+                if writer not in visited and node in successors[writer]:
+                    visited.add(writer)
+                    stack.append(writer)
+                    if writer in latches:
+                        feeding.add(writer)
+
+        return feeding
+
+    def order(self, networks):
+        """Returns the numbers of the networks in their new order"""
+        readers, latches, pinned = self.get_dependencies(networks)
+        count = len(networks)
+        writers = [set() for network in networks]
+        for writer in range(count):
+            for reader in readers[writer]:
+                writers[reader].add(writer)
+
+        # Precedence arcs between the dependent networks, in the order of the conversion first
+        successors = [set() for network in networks]
+        for writer in range(count):
+            for reader in readers[writer]:
+                successors[min(writer, reader)].add(max(writer, reader))
+        for first, second in pinned:
+            successors[first].add(second)
+
+        candidates = sorted((reader, writer) for writer in range(count) for reader in readers[writer]
+                            if reader < writer and writer not in readers[reader] and (writer, reader) not in pinned
+                            and reader not in latches and writer not in latches)
+
+        turned = True
+        while turned:
+            turned = False
+            for reader, writer in candidates:
+                if writer not in successors[reader]:
+                    continue
+                successors[reader].discard(writer)
+                feeding = self.get_feeding_latches(writers, successors, latches, writer)
+                if all(latch < reader for latch in feeding) and not self.reaches(successors, reader, writer):
+                    successors[writer].add(reader)
+                    turned = True
+                else:
+                    successors[reader].add(writer)
+
+        predecessorCounts = [0] * count
+        for number in range(count):
+            for successor in successors[number]:
+                predecessorCounts[successor] += 1
+        available = [number for number in range(count) if not predecessorCounts[number]]
+        heapq.heapify(available)
+        order = list()
+        while available:
+            number = heapq.heappop(available)
+            order.append(number)
+            for successor in successors[number]:
+                predecessorCounts[successor] -= 1
+                if not predecessorCounts[successor]:
+                    heapq.heappush(available, successor)
+
+        self.networks += count
+        scans, feedback = self.get_propagation(readers, list(range(count)))
+        self.scansBefore = max(self.scansBefore, scans)
+        self.feedbackBefore += feedback
+        scans, feedback = self.get_propagation(readers, order)
+        self.scansAfter = max(self.scansAfter, scans)
+        self.feedbackAfter += feedback
+
+        return order
+
+    @staticmethod
+    def get_propagation(readers, order):
+        """Returns the scans of the worst propagation path and the number of backward edges"""
+        positions = {number: position for position, number in enumerate(order)}
+        edges = [{reader: int(positions[reader] <= positions[writer]) for reader in readers[writer]}
+                 for writer in range(len(readers))]
+
+        components = strongly_connected_components(edges)
+        componentIds = dict()
+        for id, component in enumerate(components):
+            for number in component:
+                componentIds[number] = id
+
+        scans = [0] * len(components)
+        for id, component in enumerate(components):
+            scans[id] += sum(1 for number in component
+                             if any(weight and componentIds[reader] == id for reader, weight in edges[number].items()))
+            for number in component:
+                for reader, weight in edges[number].items():
+                    target = componentIds[reader]
+                    if target != id:
+                        scans[target] = max(scans[target], scans[id] + weight)
+
+        return max(scans, default=0), sum(sum(edge.values()) for edge in edges)
+
+    def get_scans(self):
+        """Returns the scans of the worst propagation path, before and after the ordering"""
+        return self.scansBefore, self.scansAfter
+
+    def get_feedback_counts(self):
+        """Returns the numbers of backward edges, before and after the ordering"""
+        return self.feedbackBefore, self.feedbackAfter
+
+    def get_report(self):
+        scansBefore, scansAfter = self.get_scans()
+        feedbackBefore, feedbackAfter = self.get_feedback_counts()
+        return ('{} networks, {} backward edges before, {} after, worst propagation {} scans before, {} after'
+                .format(self.networks, feedbackBefore, feedbackAfter, scansBefore, scansAfter))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""peephole.py"""
+
+from ir import LD, LDN, A, AN, O, ON, NOT, ALD, OLD, OUT, Network
+
+# Address of the special memory bit which is always on
+alwaysOn = 'SM0.0'
+
+
+class PeepholeOptimizer:
+    """Network pass rewriting short sequences of instructions into shorter equivalent ones
+
+    A rule is (name, pattern, replacement, atEnd). Patterns and replacements are tuples of (opcode,
+    operand) where an operand starting with '?' is a variable: it matches any address, the same one
+    everywhere in the pattern, and is replaced by this address in the replacement. A rule having atEnd
+    only matches the last instructions of a network, whose stack is discarded once they are executed.
+
+    Rules are tried at every position of a network and the scan goes back after each rewrite, so that
+    the rewritten instructions are matched again with their neighbours, until no rule applies anymore.
+    Every rule shortens the network, which guarantees that this fixpoint is reached.
+
+    Instructions are counted before and after the rewrites of every network seen by the pass.
+    """
+
+    rules = (('double NOT', ((NOT, None), (NOT, None)), (), False),
+             ('load NOT', ((LD, '?x'), (NOT, None)), ((LDN, '?x'),), False),
+             ('negated load NOT', ((LDN, '?x'), (NOT, None)), ((LD, '?x'),), False),
+             ('And load', ((LD, '?x'), (ALD, None)), ((A, '?x'),), False),
+             ('And negated load', ((LDN, '?x'), (ALD, None)), ((AN, '?x'),), False),
+             ('Or load', ((LD, '?x'), (OLD, None)), ((O, '?x'),), False),
+             ('Or negated load', ((LDN, '?x'), (OLD, None)), ((ON, '?x'),), False),
+             ('And chain', ((LD, '?x'), (A, '?y'), (ALD, None)), ((A, '?x'), (A, '?y')), False),
+             ('And chain negated', ((LD, '?x'), (AN, '?y'), (ALD, None)), ((A, '?x'), (AN, '?y')), False),
+             ('Or chain', ((LD, '?x'), (O, '?y'), (OLD, None)), ((O, '?x'), (O, '?y')), False),
+             ('Or chain negated', ((LD, '?x'), (ON, '?y'), (OLD, None)), ((O, '?x'), (ON, '?y')), False),
+             ('load And itself', ((LD, '?x'), (A, '?x')), ((LD, '?x'),), False),
+             ('And true', ((A, alwaysOn),), (), False),
+             ('Or false', ((ON, alwaysOn),), (), False),
+             ('repeated And', ((A, '?x'), (A, '?x')), ((A, '?x'),), False),
+             ('repeated And negated', ((AN, '?x'), (AN, '?x')), ((AN, '?x'),), False),
+             ('repeated Or', ((O, '?x'), (O, '?x')), ((O, '?x'),), False),
+             ('repeated Or negated', ((ON, '?x'), (ON, '?x')), ((ON, '?x'),), False),
+             ('repeated output', ((OUT, '?x'), (OUT, '?x')), ((OUT, '?x'),), False),
+             ('copy to itself', ((LD, '?x'), (OUT, '?x')), (), True))
+
+    def __init__(self, rules=None):
+        self.rules = self.rules if rules is None else tuple(rules)
+        self.window = max(len(pattern) for name, pattern, replacement, atEnd in self.rules)
+
+        for name, pattern, replacement, atEnd in self.rules:
+            assert len(replacement) < len(pattern), "Rule {} does not shorten the code".format(name)
+
+        self.reset()
+
+    def __str__(self):
+        return 'Peephole optimizer of {} rules'.format(len(self.rules))
+
+    def __repr__(self):
+        return str(self)
+
+    def __call__(self, network):
+        instructions = network.get_instructions()
+        self.instructionsBefore += len(instructions)
+
+        instructions = self.optimize(instructions)
+        self.instructionsAfter += len(instructions)
+        network.set_instructions(instructions)
+
+        return network
+
+    def reset(self):
+        self.instructionsBefore = 0
+        self.instructionsAfter = 0
+        self.ruleCounts = {name: 0 for name, pattern, replacement, atEnd in self.rules}
+
+    @staticmethod
+    def match(pattern, instructions, index):
+        # Returns the addresses bound to the variables of the pattern, or None
+        bindings = dict()
+        for offset, (patternOpcode, patternOperand) in enumerate(pattern):
+            opcode, operand = instructions[index + offset]
+            if opcode != patternOpcode:
+                return None
+            if patternOperand is not None and patternOperand.startswith('?'):
+                if bindings.setdefault(patternOperand, operand) != operand:
+                    return None
+            elif operand != patternOperand:
+                return None
+
+        return bindings
+
+    def optimize(self, instructions):
+        instructions = list(instructions)
+
+        index = 0
+        while index < len(instructions):
+            for name, pattern, replacement, atEnd in self.rules:
+                end = index + len(pattern)
+                if end > len(instructions) or atEnd and end != len(instructions):
+                    continue
+                bindings = self.match(pattern, instructions, index)
+                if bindings is not None:
+                    instructions[index:end] = [(opcode, bindings.get(operand, operand))
+                                               for opcode, operand in replacement]
+                    self.ruleCounts[name] += 1
+                    index = max(0, index - self.window + 1)
+                    break
+            else:
+                index += 1
+
+        return instructions
+
+    def optimize_network(self, network):
+        """Returns an optimized copy of the network"""
+        return self(Network(network.get_comment(), list(network.get_instructions())))
+
+    def get_instruction_counts(self):
+        """Returns the numbers of instructions of the networks seen, before and after the rewrites"""
+        return self.instructionsBefore, self.instructionsAfter
+
+    def get_rule_counts(self):
+        return dict(self.ruleCounts)
+
+    def get_report(self):
+        before, after = self.get_instruction_counts()
+        lines = ['{} instructions before, {} after ({} removed)'.format(before, after, before - after)]
+        for name, pattern, replacement, atEnd in self.rules:
+            if self.ruleCounts[name]:
+                lines.append('{}: {}'.format(name, self.ruleCounts[name]))
+        return '\n'.join(lines)
@@ -4,8 +4,17 @@
 """plc.py"""
 
 import warnings
+from itertools import chain
 
 from grafcet import *
+from ir import LD, LDN, A, O, ON, NOT, ALD, OLD, EU, ED, OUT, TON, Network
+from minimizer import LogicMinimizer
+from subexpressions import SubexpressionEliminator
+from allocator import AddressAllocator, AddressError
+from timerallocator import TimerAllocator, TimerOverflowError
+from scheduler import StackScheduler
+from ordering import NetworkOrderer
+from peephole import PeepholeOptimizer, alwaysOn
 
 
 class Error(Exception):
@@ -66,43 +75,268 @@ class Simatic_S7_200(Plc):
 
         self.delayCodes = dict()
         self.delayPlcIndexes = dict()
+        self.timerAllocator = TimerAllocator(self.delayTimeBases, self.delayIndexes, self.get_key)
+        self.resetEdgeIndex = None
+
+        self.minimizer = LogicMinimizer()
+        self.eliminator = SubexpressionEliminator()
+        # Scratch bits are taken from the last 64 bytes of the 2048 bytes of V memory of every CPU 22x,
+        # away from the data the rest of the program keeps at low addresses
+        self.scratchArea = 'V'
+        self.scratchStart = 1984
+        self.scratchSize = 64
+        self.preparedConditions = dict()
+        self.scratchNetworks = dict()
+        self.atoms = dict()
+        self.scheduler = StackScheduler()
+        self.scratchAllocator = None
+        self.splitNetworks = list()
+        self.peephole = PeepholeOptimizer()
+        self.networkPasses = [self.peephole]
+        self.orderer = NetworkOrderer()
+        self.windowPasses = [self.orderer]
+        self.programPasses = list()
 
     def convert_expression(self, expression):
-        code = str()
+        network = Network(None)
+        self.emit_expression(expression, network)
+
+        return network.get_instructions()
+
+    def get_condition(self, expression):
+        # Frozen form of a condition, as rewritten by prepare_conditions
+        self.get_atoms(expression, self.atoms)
+
+        return self.expand_timers(self.preparedConditions.get(expression, self.get_key(expression)))
+
+    def expand_timers(self, condition):
+        # Shared timers are read ANDed with the guard of the delay, ('TM', delay) reading the timer only
+        kind, value = condition
+
+        if kind == 'DE':
+            guard = self.timerAllocator.get_guard(self.atoms[condition].get_expression()) \
+                if self.timerAllocator is not None else []
+            if guard:
+                return 'AND', tuple(('ST', step.get_plc_index()) for step in guard) + (('TM', condition),)
+            return condition
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return kind, self.expand_timers(value)
+        elif kind == 'AND' or kind == 'OR':
+            return kind, tuple(self.expand_timers(member) for member in value)
+        else:
+            return condition
+
+    def schedule_condition(self, condition):
+        """Returns the frozen condition of a network in evaluation order and the (address, network) of the
+        scratch bits it is split into when it does not fit in the logic stack"""
+        if self.scheduler is None:
+            return condition, list()
+
+        condition, scratches = self.scheduler.schedule(condition, self.scratchAllocator)
+
+        return condition, [(address, self.convert_scratch(address, subexpression))
+                           for address, subexpression in scratches]
+
+    def get_key(self, expression):
+        """Returns the frozen form of an expression or a delay, steps being named by their address: equal
+        keys read the same bits, whatever the GRAFCETs of the project they come from"""
+        member = expression.get_expression() if type(expression) is Expression else expression
+
+        if type(member) is Step:
+            return 'ST', member.get_plc_index()
+        elif type(member) is ExpressionBinary:
+            return member.get_type(), tuple(self.get_key(submember) for submember in member.get_members())
+        elif type(member) is ExpressionUnary:
+            return member.get_type(), self.get_key(member.get_member())
+        elif type(member) is Delay:
+            return 'DE', (member.get_delay_re(), self.get_key(member.get_expression()), member.get_delay_fe())
+        elif type(member) is Duration:
+            return 'DU', (member.get_duration(), self.get_key(member.get_expression()))
+        else:
+            return expression.freeze()
+
+    def prepare_conditions(self, grafcets, outputs, allocator):
+        """Minimizes the conditions of the transitions and of the actions, then evaluates their shared
+        subexpressions into scratch bits
+
+        The transitions of each GRAFCET and the actions of the outputs are the scopes of the
+        eliminator: the steps change between them.
+        """
+        self.preparedConditions = dict()
+        self.scratchNetworks = dict()
+        self.atoms = dict()
+        self.scratchAllocator = allocator
+        if self.scheduler is not None:
+            self.scheduler.reset()
+
+        scopes = [(grafcet, [(transition.get_condition(), str(transition))
+                             for transition in grafcet.get_transitions().values()])
+                  for grafcet in grafcets]
+        scopes.append(('outputs', [(action.get_condition(), str(action))
+                                 for output in outputs.values() for action in output.get_actions()
+                                 if action.get_condition() is not None]))
+
+        frozenScopes = list()
+        for key, conditions in scopes:
+            frozenConditions = list()
+            for condition, name in conditions:
+                self.get_atoms(condition, self.atoms)
+                frozen = self.get_key(condition)
+                if self.minimizer is not None:
+                    frozen = self.minimizer.minimize(frozen, name)
+                frozenConditions.append(frozen)
+            frozenScopes.append(frozenConditions)
+
+        if self.minimizer is not None:
+            self.minimizer.clear_cache()
+
+        if self.eliminator is not None:
+            frozenScopes = self.eliminator.eliminate(frozenScopes, allocator)
+
+            # Invariant subexpressions are evaluated first, the others before their scope
+            self.scratchNetworks[None] = self.convert_scratches(None)
+            for number, (key, conditions) in enumerate(scopes):
+                self.scratchNetworks[key] = self.convert_scratches(number)
+
+        for (key, conditions), frozenConditions in zip(scopes, frozenScopes):
+            for (condition, name), frozen in zip(conditions, frozenConditions):
+                if frozen != self.get_key(condition):
+                    self.preparedConditions[condition] = frozen
+
+    def prepare_reset_edge(self, grafcets, allocator):
+        # The rising edge of the reset is detected once per scan for all the initial steps
+        self.resetEdgeIndex = None
+
+        initialSteps = [step for grafcet in grafcets for step in grafcet.get_steps().values() if step.is_initial()]
+        if len(initialSteps) < 2:
+            return
+
+        self.resetEdgeIndex = allocator.allocate('Reset edge')
+
+        network = Network('Reset edge')
+        network.append(LD, self.plcResetIndex)
+        network.append(EU)
+        network.append(OUT, self.resetEdgeIndex)
+        self.scratchNetworks[None] = [network] + list(self.scratchNetworks.get(None, ()))
+
+    def convert_scratches(self, scope):
+        networks = list()
+        for address, subexpression in self.eliminator.get_scratches(scope):
+            condition, scratches = self.schedule_condition(self.expand_timers(subexpression))
+            networks.extend(network for scratchAddress, network in scratches)
+            networks.append(self.convert_scratch(address, condition))
+
+        return networks
+
+    def convert_scratch(self, address, condition):
+        network = Network('Subexpression {}'.format(address))
+        self.emit_condition(condition, self.atoms, network)
+        network.append(OUT, address)
+
+        return network
+
+    def get_scratch_allocator(self, symbols, allocator=None):
+        """Returns an allocator of the scratch bytes of the scratch area where the bits of the symbols
+        are reserved"""
+        scratchAllocator = AddressAllocator(self.scratchArea, self.scratchStart, self.scratchSize)
+        if allocator is not None:
+            scratchAllocator.get_owners().update(allocator.get_owners())
+
+        for objects in symbols:
+            for key in objects:
+                try:
+                    scratchAllocator.get_owners()[AddressAllocator.parse(objects[key].get_plc_index())] = objects[key]
+                except AddressError:
+                    pass
+
+        return scratchAllocator
+
+    def get_atoms(self, expression, atoms):
+        # Frozen variables of a condition mapped to their expressions
+        member = expression.get_expression()
+
+        if type(member) is ExpressionBinary:
+            for submember in member.get_members():
+                self.get_atoms(submember, atoms)
+        elif type(member) is ExpressionUnary:
+            self.get_atoms(member.get_member(), atoms)
+        elif type(member) is not Constant:
+            atoms.setdefault(self.get_key(expression), expression)
+
+        return atoms
+
+    def emit_condition(self, condition, atoms, network):
+        kind, value = condition
+
+        if kind == 'AND' or kind == 'OR':
+            for rank, member in enumerate(value):
+                self.emit_condition(member, atoms, network)
+                if rank:
+                    network.append(ALD if kind == 'AND' else OLD)
+
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            self.emit_condition(value, atoms, network)
+            network.append({'NOT': NOT, 'RE': EU, 'FE': ED}[kind])
+
+        elif kind == 'CT':
+            network.append(LD if value else LDN, alwaysOn)
+
+        elif kind == 'BT' or kind == 'ST':
+            network.append(LD, value)
+
+        elif kind == 'TM':
+            self.emit_timer(atoms[value].get_expression(), network)
+
+        else:
+            self.emit_expression(atoms[condition], network)
 
+    def emit_expression(self, expression, network):
         expression = expression.get_expression()
 
         try:
             if type(expression) is ExpressionBinary:
-                code += self.convert_expression_binary(expression)
+                self.emit_expression_binary(expression, network)
 
             elif type(expression) is ExpressionUnary:
-                code += self.convert_expression_unary(expression)
+                self.emit_expression_unary(expression, network)
 
             elif type(expression) is Input:
-                code += 'LD ' + expression.get_plc_index() + '\n'
+                network.append(LD, expression.get_plc_index())
 
             elif type(expression) is Step:
-                code += 'LD ' + expression.get_plc_index() + '\n'
+                network.append(LD, expression.get_plc_index())
+
+            elif type(expression) is Output:
+                network.append(LD, expression.get_plc_index())
 
             elif type(expression) is Delay:
-                if expression not in self.delayCodes.keys():
-                    self.convert_delay(expression)
-                code += 'LD ' + 'T' + str(self.delayPlcIndexes[expression]) + '\n'
+                # The timer of a shared delay is its own while the steps of its guard are active
+                guard = self.timerAllocator.get_guard(expression) if self.timerAllocator is not None else []
+                for rank, step in enumerate(guard):
+                    network.append(A if rank else LD, step.get_plc_index())
+                self.emit_timer(expression, network)
+                if guard:
+                    network.append(ALD)
 
             elif type(expression) is Constant:
-                if expression.get_value() is 1:
-                    pass  # TODO: Manage values
+                # Constants read the bit which is always on, the peephole optimizer removes them
+                network.append(LD if expression.get_value() == 1 else LDN, alwaysOn)
             else:
                 raise TypeError("{} conversion in expression is not managed".format(type(expression)))
 
-            return code
         except TypeError as err:
             print(err)
 
-    def convert_expression_binary(self, expression):
-        code = str()
-        typeConversion = {'AND': 'ALD', 'OR': 'OLD'}
+    def emit_timer(self, delay, network):
+        # Delays of equal keys share their timer
+        key = self.get_key(delay)
+        if key not in self.delayCodes.keys():
+            self.convert_delay(delay)
+
+        network.append(LD, 'T' + str(self.delayPlcIndexes[key]))
+
+    def emit_expression_binary(self, expression, network):
+        typeConversion = {'AND': ALD, 'OR': OLD}
 
         try:
             assert expression.get_type() in typeConversion.keys()
@@ -110,35 +344,52 @@ class Simatic_S7_200(Plc):
             members = expression.get_members()
 
             for member in members:
-                code += self.convert_expression(member)
+                self.emit_expression(member, network)
 
                 if member is not members[0]:
-                    code += type + '\n'
+                    network.append(type)
 
-            return code
         except AssertionError:
             print("Expression type is not known for binary expressions")
 
-    def convert_expression_unary(self, expression):
-        code = self.convert_expression(expression.get_member())
+    def emit_expression_unary(self, expression, network):
+        self.emit_expression(expression.get_member(), network)
 
-        typesConversion = {'NOT': 'NOT\n', 'RE': 'EU\n', 'FE': 'ED\n'}
+        typesConversion = {'NOT': NOT, 'RE': EU, 'FE': ED}
 
         type = expression.get_type()
 
         try:
             assert type in typesConversion.keys()
-            code += typesConversion[type]
-            return code
+            network.append(typesConversion[type])
 
         except AssertionError:
             print("Expression type is not known for unary expressions")
 
+    def prepare_timers(self, grafcets, outputs):
+        if self.timerAllocator is None:
+            return
+
+        try:
+            self.timerAllocator.allocate(grafcets, outputs)
+        except TimerOverflowError as err:
+            # Delays are then given timers one after the other as they are converted
+            print(err)
+            self.timerAllocator.reset()
+
     def convert_delay(self, delay):
 
         delay_re = delay.get_delay_re()
         delay_fe = delay.get_delay_fe()
 
+        timer = self.timerAllocator.get_timer(delay) if self.timerAllocator is not None else None
+        if timer is not None:
+            if delay_fe != 0:
+                warnings.warn("Falling edge delay of {} is not null."
+                              " Currently falling edge conversion is not implemented. Issues may occur".format(delay))
+            self.convert_shared_delay(delay, *timer)
+            return
+
         try:
             if delay_fe != 0:
                 warnings.warn("Falling edge delay of {} is not null."
@@ -155,167 +406,332 @@ class Simatic_S7_200(Plc):
 
             duration = round(delay_re / self.delayTimeBases[timeBase])
 
-            if self.delayIndexesCounters[self.delayTimeBases[timeBase]] > len(self.delayIndexes[self.delayTimeBases[timeBase]]):
+            if self.delayIndexesCounters[self.delayTimeBases[timeBase]] >= len(self.delayIndexes[self.delayTimeBases[timeBase]]):
                 raise TimerError(timeBase)
 
             index = self.delayIndexes[self.delayTimeBases[timeBase]][self.delayIndexesCounters[self.delayTimeBases[timeBase]]]
 
             self.delayIndexesCounters[self.delayTimeBases[timeBase]] += 1
 
-            code = self.convert_expression(delay.get_expression())
-            code += "TON T{}, {}\n".format(index, duration)
+            network = self.convert_timer([delay.get_expression()], index, duration)
 
-            self.delayCodes[delay] = code
-            self.delayPlcIndexes[delay] = index
+            self.delayCodes[self.get_key(delay)] = network
+            self.delayPlcIndexes[self.get_key(delay)] = index
 
         except AssertionError:
             print("Rising edge delay is smaller than the smallest timer time base of the PLC")
         except TimerError as err:
             print("Index overflow for timer of base type {}".format(err.baseType))
 
-    def write_delays(self):
-        code = str()
-        for key in self.delayCodes:
-            self.networkCounter += 1
-            code += "Network {} // Delay \n".format(self.networkCounter)
-            code += self.delayCodes[key]
+    def convert_shared_delay(self, delay, index, preset):
+        # The timer is enabled by the Or of the expressions of the delays sharing it, its network being
+        # kept with the first of them converted. Like the other delays, it is emitted after the delays its
+        # expressions read
+        members = self.timerAllocator.get_members(index)
+
+        network = self.convert_timer([member.get_expression() for member in members], index, preset)
+
+        key = self.get_key(delay)
+        self.delayCodes[key] = network
+        for member in members:
+            self.delayPlcIndexes[self.get_key(member)] = index
+            if self.get_key(member) != key:
+                self.delayCodes[self.get_key(member)] = None
+
+    def convert_timer(self, expressions, index, preset):
+        # The scratch bits the enable is split into are evaluated just before the timer
+        condition, scratches = self.schedule_condition(('OR', tuple(self.get_condition(expression)
+                                                                    for expression in expressions)))
+        for address, network in scratches:
+            self.delayCodes[('BT', address)] = network
+
+        network = Network('Delay ')
+        self.emit_condition(condition, self.atoms, network)
+        network.append(TON, (index, preset))
 
-        return code
+        return network
+
+    def convert_delays(self):
+        # Delays are numbered as they are found, their networks are emitted once all the others are
+        for key in self.delayCodes:
+            if self.delayCodes[key] is not None:
+                yield Network(self.delayCodes[key].get_comment(), list(self.delayCodes[key].get_instructions()))
 
     def convert_step(self, step):
-        self.networkCounter += 1
-        code = "Network {} // {}\n".format(self.networkCounter, step)
+        network = Network(step)
 
         precedingTransitions = step.get_preceding_transitions()
         succeedingTransitions = step.get_succeeding_transitions()
 
-        code += "LD {}\n".format(precedingTransitions[0].get_plc_index())
+        network.append(LD, precedingTransitions[0].get_plc_index())
         for transition in precedingTransitions[1:]:
-            code += "O {}\n".format(transition.get_plc_index())
+            network.append(O, transition.get_plc_index())
 
         if step.is_initial():
-            code += "LD {}\nEU\nOLD\n".format(self.plcResetIndex)
+            if self.resetEdgeIndex is not None:
+                network.append(LD, self.resetEdgeIndex)
+            else:
+                network.append(LD, self.plcResetIndex)
+                network.append(EU)
+            network.append(OLD)
 
-        code += "LD {}\n".format(succeedingTransitions[0].get_plc_index())
+        network.append(LD, succeedingTransitions[0].get_plc_index())
         for transition in succeedingTransitions[1:]:
-            code += "O {}\n".format(transition.get_plc_index())
+            network.append(O, transition.get_plc_index())
 
-        code += "ON {}\n".format(self.plcResetIndex)
+        network.append(ON, self.plcResetIndex)
 
-        code += "NOT\nA {}\nOLD\n= {}\n".format(step.get_plc_index(), step.get_plc_index())
+        network.append(NOT)
+        network.append(A, step.get_plc_index())
+        network.append(OLD)
+        network.append(OUT, step.get_plc_index())
 
-        return code
+        return network
 
     def convert_transition(self, transition):
-        self.networkCounter += 1
-        code = "Network {} // {}\n".format(self.networkCounter, transition)
+        network = Network(transition)
 
-        steps = transition.get_preceding_steps()
-        code += "LD {}\n".format(steps[0].get_plc_index())
+        steps = [('ST', step.get_plc_index()) for step in transition.get_preceding_steps()]
+        condition = ('AND', tuple(steps) + (self.get_condition(transition.get_condition()),))
+        condition, scratches = self.schedule_condition(condition)
+        self.splitNetworks.extend(scratchNetwork for address, scratchNetwork in scratches)
 
-        for step in steps[1:]:
-            code += "A {}\n".format(step.get_plc_index())
+        self.emit_condition(condition, self.atoms, network)
+        network.append(OUT, transition.get_plc_index())
 
-        expressionConverted = self.convert_expression(transition.get_condition())
+        return network
 
-        if expressionConverted is not '':
-            code += expressionConverted + "ALD\n"
+    def convert_output(self, output):
+        network = Network(output.get_name())
 
-        code += "= {}\n".format(transition.get_plc_index())
+        actions = list()
+        for action in output.get_actions():
+            step = ('ST', action.get_step().get_plc_index())
+            if action.get_condition() is not None:
+                actions.append(('AND', (step, self.get_condition(action.get_condition()))))
+            else:
+                actions.append(step)
 
-        return code
+        condition, scratches = self.schedule_condition(('OR', tuple(actions)))
+        self.splitNetworks.extend(scratchNetwork for address, scratchNetwork in scratches)
 
-    def convert_output(self, output):
-        self.networkCounter += 1
-        code = "Network {} // {}\n".format(self.networkCounter, output.get_name())
+        self.emit_condition(condition, self.atoms, network)
+        network.append(OUT, output.get_plc_index())
 
-        actions = output.get_actions()
+        return network
 
-        code += "LD {}\n".format(actions[0].get_step().get_plc_index())
-        if actions[0].get_condition() is not None:
-            code += "LD {}\n".format(actions[0].get_step().get_plc_index())
-            code += self.convert_expression(actions[0].get_condition())
-            code += "ALD\n"
+    def get_code(self, grafcet):
+        chunks = self.iter_code(grafcet)
+        if chunks is None:
+            return None
 
-        for action in actions[1:]:
-            if action.get_condition() is not None:
-                code += "LD {}\n".format(action.get_step().get_plc_index())
-                code += self.convert_expression(action.get_condition())
-                code += "ALD\n"
-                code += "OLD\n"
-            else:
-                code += "O {}\n".format(action.get_step().get_plc_index())
+        return ''.join(chunks)
 
-        code += "= {}\n".format(output.get_plc_index())
+    def write_code(self, grafcet, file):
+        """Writes the program of the GRAFCET to a file object network by network
 
-        return code
+        Returns False when no code can be generated.
+        """
+        chunks = self.iter_code(grafcet)
+        if chunks is None:
+            return False
 
-    def get_code(self, grafcet):
-        if grafcet.check_consistency() and self.check_grafcet_plc_indexes(grafcet):
-            self.plcResetIndex = grafcet.get_plc_reset().get_plc_index()
+        for chunk in chunks:
+            file.write(chunk)
+
+        return True
+
+    def iter_code(self, grafcet):
+        """Returns an iterator on the chunks of the program of the GRAFCET, one network per chunk, or None"""
+        networks = self.iter_networks(grafcet)
+        if networks is None:
+            return None
+
+        return self.iter_program(networks)
+
+    def get_project_code(self, project):
+        chunks = self.iter_project_code(project)
+        if chunks is None:
+            return None
+
+        return ''.join(chunks)
 
-            code = "SUBROUTINE_BLOCK Mode_Auto:SBR0\n"
-            code += "TITLE=COMMENTAIRES DE SOUS-PROGRAMME\n"
-            code += "BEGIN\n"
+    def write_project_code(self, project, file):
+        chunks = self.iter_project_code(project)
+        if chunks is None:
+            return False
 
-            transitions = grafcet.get_transitions()
+        for chunk in chunks:
+            file.write(chunk)
 
-            for key in transitions:
-                transition = transitions[key]
+        return True
 
-                code += self.convert_transition(transition)
+    def iter_project_code(self, project):
+        networks = self.iter_project_networks(project)
+        if networks is None:
+            return None
 
-            steps = grafcet.get_steps()
+        return self.iter_program(networks)
 
-            for key in steps:
-                step = steps[key]
-                code += self.convert_step(step)
+    def get_networks(self, grafcet):
+        """Returns the networks of the program of the GRAFCET once transformed by the passes, or None"""
+        networks = self.iter_networks(grafcet)
+        if networks is None:
+            return None
 
-            outputs = grafcet.get_outputs()
+        return list(networks)
 
-            for key in outputs:
-                output = outputs[key]
-                code += self.convert_output(output)
+    def get_project_networks(self, project):
+        networks = self.iter_project_networks(project)
+        if networks is None:
+            return None
 
-            code += self.write_delays()
+        return list(networks)
 
-            code += "END_SUBROUTINE_BLOCK\n"
+    def iter_networks(self, grafcet):
+        # A frozen GRAFCET is shared: the conversion works on a private copy
+        if not isinstance(grafcet, Grafcet):
+            grafcet = grafcet.thaw()
 
-            code = self.simplify_code(code)
+        if grafcet.check_consistency() and self.check_grafcet_plc_indexes(grafcet):
+            self.plcResetIndex = grafcet.get_plc_reset().get_plc_index()
+            allocator = self.get_scratch_allocator([grafcet.get_steps(), grafcet.get_transitions(),
+                                                    grafcet.get_inputs(), grafcet.get_outputs()])
+            self.prepare_timers([grafcet], grafcet.get_outputs())
+            self.prepare_conditions([grafcet], grafcet.get_outputs(), allocator)
+            self.prepare_reset_edge([grafcet], allocator)
+
+            return self.transform(chain((self.scratchNetworks.get(None, ()),
+                                         self.convert_grafcet(grafcet),
+                                         self.convert_outputs(grafcet.get_outputs())),
+                                        (self.convert_delays(),)))
+        else:
+            return None
+
+    def iter_project_networks(self, project):
+        if project.check_consistency() and self.check_project_plc_indexes(project):
+            self.plcResetIndex = project.get_plc_reset().get_plc_index()
+
+            grafcets = project.get_grafcets()
 
-            return code
+            symbols = [project.get_inputs(), project.get_outputs()]
+            for key in grafcets:
+                symbols += [grafcets[key].get_steps(), grafcets[key].get_transitions()]
+            allocator = self.get_scratch_allocator(symbols, project.get_allocator())
+            self.prepare_timers(list(grafcets.values()), project.get_outputs())
+            self.prepare_conditions(list(grafcets.values()), project.get_outputs(), allocator)
+            self.prepare_reset_edge(list(grafcets.values()), allocator)
+
+            return self.transform(chain((self.scratchNetworks.get(None, ()),),
+                                        (self.convert_grafcet(grafcets[key]) for key in grafcets),
+                                        (self.convert_outputs(project.get_outputs()), self.convert_delays())))
         else:
             return None
 
-    def check_grafcet_plc_indexes(self, grafcet):
+    def transform(self, windows):
+        """Runs the passes on the networks of the windows
+
+        Windows are the blocks of networks converted together: the global scratch bits, each GRAFCET,
+        the outputs and the delays. Network passes transform the networks one by one as they are
+        converted. Window passes need all the networks of a window, which are gathered one window at a
+        time, so that the memory used is bounded by the largest window. Program passes need all the
+        networks: they are only gathered when there is one.
+        """
+        networks = chain.from_iterable(self.transform_window(window) for window in windows)
+
+        if self.programPasses:
+            networks = list(networks)
+            for programPass in self.programPasses:
+                networks = programPass(networks)
+
+        return networks
+
+    def transform_window(self, networks):
+        for networkPass in self.networkPasses:
+            networks = map(networkPass, networks)
+
+        if self.windowPasses:
+            networks = list(networks)
+            for windowPass in self.windowPasses:
+                networks = windowPass(networks)
+
+        return networks
+
+    def iter_program(self, networks):
+        # Networks are converted lazily: delays found in the others are emitted last
+        yield self.write_header()
+
+        for network in networks:
+            self.networkCounter += 1
+            yield network.render(self.networkCounter)
+
+        yield self.write_footer()
+
+    def write_header(self):
+        return "SUBROUTINE_BLOCK Mode_Auto:SBR0\nTITLE=COMMENTAIRES DE SOUS-PROGRAMME\nBEGIN\n"
+
+    def write_footer(self):
+        return "END_SUBROUTINE_BLOCK\n"
+
+    def convert_grafcet(self, grafcet):
+        yield from self.scratchNetworks.get(grafcet, ())
 
-        steps = grafcet.get_steps()
         transitions = grafcet.get_transitions()
-        inputs = grafcet.get_inputs()
-        outputs = grafcet.get_outputs()
 
-        try:
-            if grafcet.get_plc_reset() is None:
-                raise PlcResetError(grafcet)
+        for key in transitions:
+            network = self.convert_transition(transitions[key])
+            yield from self.pop_split_networks()
+            yield network
 
-            elif grafcet.get_plc_reset().get_plc_index() is None:
-                raise PlcIndexError(grafcet.get_plc_reset())
+        steps = grafcet.get_steps()
 
-            for key in steps:
-                if steps[key].get_plc_index() is None:
-                    raise PlcIndexError(steps[key])
+        for key in steps:
+            yield self.convert_step(steps[key])
 
-            for key in transitions:
-                if transitions[key].get_plc_index() is None:
-                    raise PlcIndexError(transitions[key])
+    def convert_outputs(self, outputs):
+        yield from self.scratchNetworks.get('outputs', ())
+
+        for key in outputs:
+            output = outputs[key]
+            if output.get_actions():
+                network = self.convert_output(output)
+                yield from self.pop_split_networks()
+                yield network
+
+    def pop_split_networks(self):
+        # The scratch bits a network is split into are evaluated just before it
+        networks = self.splitNetworks
+        self.splitNetworks = list()
+
+        return networks
+
+    def check_grafcet_plc_indexes(self, grafcet):
+        return self.check_plc_indexes(grafcet, [grafcet.get_steps(), grafcet.get_transitions(),
+                                                grafcet.get_inputs(), grafcet.get_outputs()])
 
-            for key in inputs:
-                if inputs[key].get_plc_index() is None:
-                    raise PlcIndexError(inputs[key])
+    def check_project_plc_indexes(self, project):
+        symbols = [project.get_inputs(), project.get_outputs()]
 
-            for key in outputs:
-                if outputs[key].get_plc_index() is None:
-                    raise PlcIndexError(outputs[key])
+        grafcets = project.get_grafcets()
+
+        for key in grafcets:
+            symbols += [grafcets[key].get_steps(), grafcets[key].get_transitions()]
+
+        return self.check_plc_indexes(project, symbols)
+
+    def check_plc_indexes(self, container, symbols):
+
+        try:
+            if container.get_plc_reset() is None:
+                raise PlcResetError(container)
+
+            elif container.get_plc_reset().get_plc_index() is None:
+                raise PlcIndexError(container.get_plc_reset())
+
+            for objects in symbols:
+                for key in objects:
+                    if objects[key].get_plc_index() is None:
+                        raise PlcIndexError(objects[key])
 
             return True
 
@@ -325,24 +741,3 @@ class Simatic_S7_200(Plc):
         except PlcIndexError as err:
             print("Missing PLC index information for {}".format(err.object))
             sys.exit(1)  # TODO: Be nicer here
-
-    def simplify_code(self, code):
-
-        codeSimplified = str()
-        codeLines = code.splitlines(True)
-        indexes = iter(range(len(codeLines)))
-
-        for index in indexes:
-            if codeLines[index][0:2] == 'LD':
-                if codeLines[index+1][0:3] == 'ALD':
-                    codeSimplified += codeLines[index].replace('LD', 'A')
-                    next(indexes)
-                elif codeLines[index+1][0:3] == 'OLD':
-                    codeSimplified += codeLines[index].replace('LD', 'O')
-                    next(indexes)
-                else:
-                    codeSimplified += codeLines[index]
-            else:
-                codeSimplified += codeLines[index]
-
-        return codeSimplified
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""project.py"""
+
+import warnings
+
+from grafcet import *
+from allocator import AddressAllocator
+
+
+class Project:
+    """Set of GRAFCETs sharing inputs, outputs and PLC memory"""
+
+    def __init__(self, name=None, allocator=None):
+        self.name = name
+
+        self.grafcets = dict()
+
+        self.inputs = dict()
+        self.outputs = dict()
+
+        self.plcReset = None
+
+        self.allocator = allocator
+
+        if self.allocator is None:
+            self.allocator = AddressAllocator()
+
+    def __str__(self):
+        return 'Project {}'.format(self.name)
+
+    def __repr__(self):
+        return str(self)
+
+    def set_plc_reset(self, plcReset):
+        if plcReset.get_name() in self.inputs:
+            self.inputs[plcReset.get_name()].set_plc_index(plcReset.get_plc_index())
+            plcReset = self.inputs[plcReset.get_name()]
+
+        self.plcReset = plcReset
+
+        for grafcet in self.grafcets.values():
+            grafcet.set_plc_reset(plcReset)
+
+    def get_plc_reset(self):
+        return self.plcReset
+
+    def get_allocator(self):
+        return self.allocator
+
+    def add_grafcet(self, grafcet):
+        if grafcet.name not in self.grafcets:
+            grafcet.share_symbols(self.inputs, self.outputs)
+            if self.plcReset is not None:
+                grafcet.set_plc_reset(self.plcReset)
+            elif grafcet.get_plc_reset() is not None:
+                self.plcReset = grafcet.get_plc_reset()
+            self.grafcets[grafcet.name] = grafcet
+        else:
+            warnings.warn("{} already existing as grafcet for {}".format(grafcet, self), UserWarning)
+
+    def delete_grafcet(self, grafcet):
+        self.grafcets.pop(grafcet.name)
+
+    def get_grafcets(self):
+        return self.grafcets
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_outputs(self):
+        return self.outputs
+
+    def generate(self, code):
+        grafcet = Grafcet(inputs=self.inputs, outputs=self.outputs)
+        grafcet.generate(code)
+        self.add_grafcet(grafcet)
+
+        return grafcet
+
+    def check_consistency(self):
+        for grafcet in self.grafcets.values():
+            if not grafcet.check_consistency():
+                return False
+
+        return True
+
+    def import_plc_data_inputs(self, content):
+        for row in content:
+            if row[0] not in self.inputs.keys():
+                input = Input(row[0], row[1])
+                self.inputs[input.get_name()] = input
+            else:
+                self.inputs[row[0]].set_plc_index(row[1])
+
+    def import_plc_data_outputs(self, content):
+        for row in content:
+            if row[0] not in self.outputs.keys():
+                output = Output(row[0], row[1])
+                self.outputs[output.get_name()] = output
+            else:
+                self.outputs[row[0]].set_plc_index(row[1])
+
+    def import_plc_data_reset(self, content):
+        for row in content:
+            self.set_plc_reset(Input(row[0], row[1]))
+
+    def reserve_plc_indexes(self):
+        for output in self.outputs.values():
+            if output.get_plc_index() is not None:
+                self.allocator.reserve(output.get_plc_index(), output)
+
+        # Addresses given in any GRAFCET are reserved before the first block is allocated
+        for grafcet in self.grafcets.values():
+            grafcet.reserve_plc_indexes(self.allocator)
+
+    def allocate_plc_indexes(self):
+        self.reserve_plc_indexes()
+
+        for grafcet in self.grafcets.values():
+            grafcet.allocate_plc_indexes(self.allocator)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""reachability.py"""
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from grafcet import *
+from conditioncompiler import ConditionCompiler
+
+
+class AbstractConditionCompiler(ConditionCompiler):
+    """Compiles conditions on the markings of a GRAFCET with free atoms
+
+    Steps keep their bit in the state integer. Inputs, edges, delays and durations are abstracted as
+    free boolean atoms placed after the steps, so that a condition is true for a marking as soon as one
+    valuation of its atoms makes it true. This is an over-approximation of the timed behaviour.
+    """
+
+    def __init__(self, grafcet):
+        super().__init__(grafcet)
+
+        self.atomOffset = len(self.grafcet.steps)
+        self.atomIds = dict()
+        self.atoms = list()
+
+    def get_atoms(self):
+        return self.atoms
+
+    def get_atom_id(self, condition):
+        if condition not in self.atomIds:
+            self.atomIds[condition] = len(self.atoms)
+            self.atoms.append(condition)
+
+        return self.atomIds[condition]
+
+    def position(self, condition):
+        kind, value = condition
+
+        if kind == 'IN' or kind == 'RE' or kind == 'FE' or kind == 'DE' or kind == 'DU':
+            return 'B', self.atomOffset + self.get_atom_id(condition)
+
+        return super().position(condition)
+
+    def support(self, condition):
+        # Atoms the condition depends on, as a mask of the state integer
+        kind, value = condition
+
+        if kind == 'B':
+            return 1 << value if value >= self.atomOffset else 0
+        elif kind == 'NOT':
+            return self.support(value)
+        elif kind == 'AND' or kind == 'OR':
+            support = 0
+            for member in value:
+                support |= self.support(member)
+            return support
+        else:
+            return 0
+
+
+class Explorer:
+    """Exhaustive exploration of the markings reachable by a GRAFCET
+
+    Markings are integers whose bit n is the activity of the step n of the frozen GRAFCET. From a
+    marking, every valuation of the atoms read by the enabled transitions is tried and all the
+    fireable transitions are cleared simultaneously, one evolution cycle per exploration edge. Transient
+    markings are thus explored too, which keeps the check conservative.
+
+    The frontier is expanded breadth first, by a pool of processes when it is large enough, so that
+    counterexample traces are as short as possible. Visited markings are kept in a set of integers only.
+    Each layer of the search is appended to a temporary file: frontiers larger than spillSize markings
+    are read back from it, and traces are rebuilt from it by searching the layer before a marking for a
+    marking leading to it.
+    """
+
+    chunkSize = 256
+
+    def __init__(self, grafcet, workers=None, spillSize=None, maxStates=None):
+        self.grafcet = grafcet.freeze()
+
+        self.workers = workers
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+
+        self.spillSize = spillSize
+        self.maxStates = maxStates
+
+        self.compiler = AbstractConditionCompiler(self.grafcet)
+        self.conditions = list()
+        self.supports = list()
+        for condition in self.grafcet.conditions:
+            if condition is None:
+                condition = ('CT', 1)
+            position = self.compiler.position(condition)
+            self.conditions.append(self.compiler.compile_position(position))
+            self.supports.append(self.compiler.support(position))
+
+        self.precedingMasks = [self.mask(steps) for steps in self.grafcet.precedingSteps]
+        self.succeedingMasks = [self.mask(steps) for steps in self.grafcet.succeedingSteps]
+
+        self.initialMarking = self.mask(self.grafcet.initialSteps)
+
+        self.invariants = dict()
+
+        self.width = max(1, (len(self.grafcet.steps) + 7) // 8)
+        self.layerFile = None
+
+        self.reset()
+
+    def __str__(self):
+        return 'Explorer of {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    @staticmethod
+    def mask(ids):
+        mask = 0
+        for id in ids:
+            mask |= 1 << id
+        return mask
+
+    @staticmethod
+    def bits(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def reset(self):
+        if self.layerFile is not None:
+            self.layerFile.close()
+        self.layerFile = None
+        self.layers = list()
+
+        self.visited = {self.initialMarking}
+        self.edgeCount = 0
+        self.depth = 0
+        self.complete = False
+        self.violations = dict()
+
+    def get_grafcet(self):
+        return self.grafcet
+
+    def add_invariant(self, name, predicate):
+        """Adds a predicate on markings which must be true for every reachable marking"""
+        self.invariants[name] = predicate
+
+    def add_exclusion(self, name, steps):
+        """Adds an invariant forbidding the given steps to be active together"""
+        mask = self.mask(self.grafcet.get_step_id(step) for step in steps)
+        self.add_invariant(name, lambda marking: marking & mask != mask)
+
+    def delete_invariant(self, name):
+        self.invariants.pop(name)
+
+    def get_invariants(self):
+        return self.invariants
+
+    def get_edges(self, marking):
+        """Returns the (successor, fired transitions, valuation) reached by each valuation of the atoms
+
+        Valuations are masks of the atom bits of the compiler, only the first valuation found for a
+        successor is kept.
+        """
+        enabled = [transition for transition, precedingMask in enumerate(self.precedingMasks)
+                   if marking & precedingMask == precedingMask]
+
+        support = 0
+        for transition in enabled:
+            support |= self.supports[transition]
+
+        # Every subset of the atoms read by the enabled transitions is one valuation
+        edges = dict()
+        valuation = support
+        while True:
+            state = marking | valuation
+            fired = cleared = activated = 0
+            for transition in enabled:
+                if self.conditions[transition](state, state):
+                    fired |= 1 << transition
+                    cleared |= self.precedingMasks[transition]
+                    activated |= self.succeedingMasks[transition]
+
+            # Activation has priority over deactivation when a step is both cleared and activated
+            if fired:
+                edges.setdefault(marking & ~cleared | activated, (fired, valuation))
+
+            if valuation == 0:
+                break
+            valuation = (valuation - 1) & support
+
+        return [(successor, fired, valuation) for successor, (fired, valuation) in edges.items()]
+
+    def successors(self, marking):
+        return [(successor, fired) for successor, fired, valuation in self.get_edges(marking)]
+
+    def check(self, marking):
+        for name, predicate in self.invariants.items():
+            if name not in self.violations and not predicate(marking):
+                self.violations[name] = marking
+
+    def expand(self, markings):
+        return [(marking, self.successors(marking)) for marking in markings]
+
+    def store(self, markings, frontier):
+        """Appends markings of the layer being searched to the layer file, and to the frontier kept in
+        memory until it holds more than spillSize markings"""
+        if self.layerFile is None:
+            self.layerFile = tempfile.TemporaryFile()
+
+        self.layerFile.seek(0, os.SEEK_END)
+        self.layerFile.write(b''.join(marking.to_bytes(self.width, 'little') for marking in markings))
+
+        if frontier is not None:
+            frontier.extend(markings)
+            if self.spillSize is not None and len(frontier) > self.spillSize:
+                return None
+
+        return frontier
+
+    def load(self, depth):
+        """Reads the markings of a layer of the search back, by chunks"""
+        offset, count = self.layers[depth]
+        end = offset + count * self.width
+        width = self.width
+
+        while offset < end:
+            self.layerFile.seek(offset)
+            chunk = self.layerFile.read(min(width * self.chunkSize, end - offset))
+            offset += len(chunk)
+            yield [int.from_bytes(chunk[start:start + width], 'little') for start in range(0, len(chunk), width)]
+
+    def chunks(self, depth, frontier):
+        if frontier is None:
+            yield from self.load(depth)
+        else:
+            for start in range(0, len(frontier), self.chunkSize):
+                yield frontier[start:start + self.chunkSize]
+
+    def explore(self, stopOnViolation=False):
+        self.reset()
+        self.check(self.initialMarking)
+
+        frontier = self.store([self.initialMarking], list())
+        self.layers.append((0, 1))
+        size = 1
+
+        executor = None
+        try:
+            while size and not (stopOnViolation and self.violations):
+                if self.workers > 1 and size > self.chunkSize:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(self.workers, initializer=initialize_worker,
+                                                       initargs=(self.grafcet,))
+                    expansions = executor.map(expand_in_worker, self.chunks(self.depth, frontier))
+                else:
+                    expansions = map(self.expand, self.chunks(self.depth, frontier))
+
+                # The next layer is appended to the layer file as it is found
+                offset = self.layerFile.seek(0, os.SEEK_END)
+                successors = list()
+                size = 0
+                pending = list()
+                for expansion in expansions:
+                    for marking, markingSuccessors in expansion:
+                        for successor, fired in markingSuccessors:
+                            self.edgeCount += 1
+                            if successor not in self.visited:
+                                self.visited.add(successor)
+                                self.check(successor)
+                                pending.append(successor)
+                                size += 1
+                                if len(pending) == self.chunkSize:
+                                    successors = self.store(pending, successors)
+                                    pending = list()
+
+                frontier = self.store(pending, successors)
+                self.layers.append((offset, size))
+                if self.maxStates is not None and len(self.visited) > self.maxStates:
+                    return self
+
+                self.depth += 1
+
+            self.complete = not size
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return self
+
+    def is_complete(self):
+        return self.complete
+
+    def get_state_count(self):
+        return len(self.visited)
+
+    def get_edge_count(self):
+        return self.edgeCount
+
+    def get_depth(self):
+        return self.depth
+
+    def get_markings(self):
+        return self.visited
+
+    def get_steps(self, marking):
+        return [self.grafcet.steps[id] for id in self.bits(marking)]
+
+    def is_reachable(self, steps):
+        mask = self.mask(self.grafcet.get_step_id(step) for step in steps)
+        return any(marking & mask == mask for marking in self.visited)
+
+    def get_violations(self):
+        return self.violations
+
+    def find_layer(self, marking):
+        if marking == self.initialMarking:
+            return 0
+
+        for depth in range(len(self.layers)):
+            for chunk in self.load(depth):
+                if marking in chunk:
+                    return depth
+
+        raise KeyError(marking)
+
+    def find_parent(self, marking, depth):
+        # The first marking of the layer leading to the marking, as found by the search
+        for chunk in self.load(depth):
+            for parent in chunk:
+                for successor, fired in self.successors(parent):
+                    if successor == marking:
+                        return parent, fired
+
+    def get_trace(self, marking):
+        """Returns the list of (fired transitions, active steps) leading from the initial marking"""
+        trace = list()
+        for depth in reversed(range(self.find_layer(marking))):
+            parent, fired = self.find_parent(marking, depth)
+            trace.append(([self.grafcet.transitions[id] for id in self.bits(fired)], self.get_steps(marking)))
+            marking = parent
+        trace.append(([], self.get_steps(marking)))
+
+        trace.reverse()
+        return trace
+
+    def get_counterexamples(self):
+        return {name: self.get_trace(marking) for name, marking in self.violations.items()}
+
+    def get_report(self):
+        lines = ['{} markings, {} edges, depth {}{}'.format(self.get_state_count(), self.edgeCount, self.depth,
+                                                           '' if self.complete else ' (incomplete)')]
+        for name in self.invariants:
+            if name in self.violations:
+                lines.append('Invariant {} violated:'.format(name))
+                for fired, steps in self.get_trace(self.violations[name]):
+                    lines.append('    {} -> steps {}'.format(fired, steps))
+            else:
+                lines.append('Invariant {} holds'.format(name))
+        return '\n'.join(lines)
+
+
+workerExplorer = None
+
+
+def initialize_worker(grafcet):
+    global workerExplorer
+    workerExplorer = Explorer(grafcet, workers=1)
+
+
+def expand_in_worker(markings):
+    return workerExplorer.expand(markings)
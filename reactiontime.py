@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""reactiontime.py"""
+
+import heapq
+
+from plc import Simatic_S7_200
+from ir import LD, LDN, A, AN, O, ON, OUT, TON
+from emulator import Simatic_S7_200_Emulator
+from differential import CodeGenerationError
+
+
+class ReactionTimeAnalyser:
+    """Number of scans and latency from an input change to the first change of an output it causes
+
+    The networks of the instruction list are the nodes of a dependency graph: a network depends on
+    every network writing a bit it reads. A change written by a network is read during the same scan
+    by the networks placed after it and during the next scan by the networks placed before it, so
+    edges going backwards cost one scan. A network reading the bit it writes, like the self-hold of a
+    step, only keeps its state: this is not a propagation. Going through a TON network adds its
+    preset to the latency, and one scan since the elapsed time is only compared to the preset when
+    the TON is executed.
+
+    A change of an input propagates along every dependency path at once, so an output first reacts
+    when the change arrives by its quickest path: the first reaction of each pair is the path of least
+    latency from the networks reading the input to the ones writing the output, its scans and the
+    presets of its timers only being counted. Every backward edge of the path costing a whole scan,
+    the first reaction comes no later than this whatever the moment of the change within a scan.
+    Slower paths may change the output again afterwards: they are not bounded here.
+
+    A change of an input is sampled at the next scan: the latency adds one scan time to the scans
+    computing the change.
+    """
+
+    readOpcodes = (LD, LDN, A, AN, O, ON)
+
+    def __init__(self, code, scanTime=0.01, inputs=None, outputs=None, symbols=None):
+        self.scanTime = scanTime
+        self.symbols = dict() if symbols is None else symbols
+
+        self.emulator = Simatic_S7_200_Emulator(code)
+        self.networks = self.emulator.get_networks()
+        addresses = self.emulator.addresses
+
+        self.reads = list()
+        self.delays = list()
+        self.writers = dict()
+        for number, network in enumerate(self.networks):
+            reads = set()
+            delay = 0
+            for opcode, operand in network:
+                if opcode in self.readOpcodes:
+                    reads.add(operand)
+                elif opcode == OUT:
+                    self.writers.setdefault(operand, list()).append(number)
+                elif opcode == TON:
+                    slot, timeBase, preset = self.emulator.timers[operand]
+                    self.writers.setdefault(slot, list()).append(number)
+                    delay += timeBase * preset
+            self.reads.append(reads)
+            self.delays.append(delay)
+
+        # Inputs and outputs default to the I bits read and the Q bits written by the code
+        if inputs is None:
+            inputs = [address for address in addresses if address.startswith('I')]
+        if outputs is None:
+            outputs = [addresses[slot] for slot in self.writers if addresses[slot].startswith('Q')]
+        self.inputs = sorted(self.emulator.slots[address] for address in set(inputs) if address in self.emulator.slots)
+        self.outputs = sorted(self.emulator.slots[address] for address in set(outputs)
+                              if address in self.emulator.slots and self.emulator.slots[address] in self.writers)
+
+        self.edges = [dict() for network in self.networks]
+        self.inputReaders = {slot: list() for slot in self.inputs}
+        for number, reads in enumerate(self.reads):
+            for slot in reads:
+                if slot in self.inputReaders:
+                    self.inputReaders[slot].append(number)
+                for writer in self.writers.get(slot, ()):
+                    if writer == number:
+                        continue
+                    # A network may read several bits of another one: the costliest edge is kept
+                    weight = 1 if number < writer else 0
+                    self.edges[writer][number] = max(self.edges[writer].get(number, 0), weight)
+
+        self.reactionScans = dict()
+        self.reactionDelays = dict()
+        for slot in self.inputs:
+            self.propagate(slot)
+
+    def __str__(self):
+        return 'Reaction time analyser of {} networks'.format(len(self.networks))
+
+    def __repr__(self):
+        return str(self)
+
+    @classmethod
+    def for_grafcet(cls, grafcet, scanTime=0.01):
+        """Analyses the code generated for a GRAFCET, inputs and outputs being named after it"""
+        grafcet = grafcet.freeze()
+
+        code = Simatic_S7_200().get_code(grafcet)
+        if code is None:
+            raise CodeGenerationError(grafcet)
+
+        symbols = dict(zip(grafcet.inputPlcIndexes, grafcet.inputs))
+        symbols.update(zip(grafcet.outputPlcIndexes, grafcet.outputs))
+        symbols.setdefault(grafcet.plcReset[1], grafcet.plcReset[0])
+
+        return cls(code, scanTime, grafcet.inputPlcIndexes, grafcet.outputPlcIndexes, symbols)
+
+    def propagate(self, input):
+        # Paths of least latency from the networks reading the input, the scans of a path breaking ties
+        costs = dict()
+        queue = list()
+        for number in self.inputReaders[input]:
+            cost = (self.delays[number] + self.scanTime * (self.delays[number] > 0), int(self.delays[number] > 0),
+                    self.delays[number])
+            if number not in costs or cost < costs[number]:
+                costs[number] = cost
+                heapq.heappush(queue, cost + (number,))
+
+        while queue:
+            latency, scans, delay, number = heapq.heappop(queue)
+            if costs[number] < (latency, scans, delay):
+                continue
+            for successor, weight in self.edges[number].items():
+                timer = self.delays[successor] > 0
+                successorScans = scans + weight + timer
+                successorDelay = delay + self.delays[successor]
+                cost = (successorScans * self.scanTime + successorDelay, successorScans, successorDelay)
+                if successor not in costs or cost < costs[successor]:
+                    costs[successor] = cost
+                    heapq.heappush(queue, cost + (successor,))
+
+        for output in self.outputs:
+            reached = [costs[writer] for writer in self.writers[output] if writer in costs]
+            if reached:
+                latency, scans, delay = min(reached)
+                # The scan reading the change is counted too
+                self.reactionScans[(input, output)] = scans + 1
+                self.reactionDelays[(input, output)] = delay
+
+    def get_name(self, slot):
+        address = self.emulator.addresses[slot]
+        return self.symbols.get(address, address)
+
+    def get_slot(self, name):
+        for address, symbol in self.symbols.items():
+            if symbol == name and address in self.emulator.slots:
+                return self.emulator.slots[address]
+        return self.emulator.slots.get(name)
+
+    def get_scan_time(self):
+        return self.scanTime
+
+    def set_scan_time(self, scanTime):
+        self.scanTime = scanTime
+
+    def get_first_reaction_scans(self, input, output):
+        """Returns the number of scans computing the first change of the output from a change of the
+        input, or None if the output does not depend on the input"""
+        return self.reactionScans.get((self.get_slot(input), self.get_slot(output)))
+
+    def get_first_reaction_latency(self, input, output):
+        """Returns the time from a change of the input to the first change of the output, in seconds"""
+        key = (self.get_slot(input), self.get_slot(output))
+        if key not in self.reactionScans:
+            return None
+        return (self.reactionScans[key] + 1) * self.scanTime + self.reactionDelays[key]
+
+    def get_first_reaction_times(self):
+        """Returns {(input, output): (scans, latency)} of the first reaction of every output depending on
+        an input"""
+        return {(self.get_name(input), self.get_name(output)):
+                (scans, (scans + 1) * self.scanTime + self.reactionDelays[(input, output)])
+                for (input, output), scans in self.reactionScans.items()}
+
+    def get_report(self):
+        lines = ['{} networks, scan time {} s, first reaction of each output:'.format(len(self.networks),
+                                                                                      self.scanTime)]
+        for (input, output), (scans, latency) in sorted(self.get_first_reaction_times().items()):
+            lines.append('{} -> {}: {} scans, {:.3f} s'.format(input, output, scans, latency))
+        return '\n'.join(lines)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""scheduler.py"""
+
+from minimizer import LogicMinimizer
+
+
+class StackScheduler:
+    """Orders the members of the frozen conditions of networks so that they need the shallowest logic stack
+
+    A product or a sum loads its first member, then combines each other member with the result: a
+    single load by an A, AN, O or ON instruction, a compound member by its own instructions and an
+    ALD or OLD, one level of the stack holding the result meanwhile. As Sethi and Ullman number the
+    registers of an expression, the compound member needing the deepest stack is evaluated first and
+    the single loads last: the condition needs the depth of its deepest member, or one more than its
+    second deepest, and the first compound member saves its ALD or OLD. Products and sums are
+    commutative and every instruction of a network is executed at each scan, edges included, so the
+    order does not change the result.
+
+    Conditions still needing more than the stackSize levels of the S7-200 are split: the deepest
+    subexpression fitting in the stack is evaluated into a scratch bit before the network and read
+    instead, until the condition fits.
+    """
+
+    stackSize = 9
+
+    def __init__(self):
+        self.minimizer = LogicMinimizer()
+        self.reset()
+
+    def __str__(self):
+        return 'Stack scheduler'
+
+    def __repr__(self):
+        return str(self)
+
+    def reset(self):
+        self.networks = 0
+        self.depthsBefore = list()
+        self.depthsAfter = list()
+        self.combinationsBefore = 0
+        self.combinationsAfter = 0
+        self.scratches = list()
+
+    def order(self, condition):
+        """Returns the condition with the members of its products and sums in evaluation order"""
+        kind, value = condition
+
+        if kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return kind, self.order(value)
+
+        elif kind == 'AND' or kind == 'OR':
+            neutral = 1 if kind == 'AND' else 0
+            members = list()
+            for member in value:
+                member = self.order(member)
+                if member[0] == kind:
+                    members.extend(member[1])
+                elif member == ('CT', neutral):
+                    continue
+                elif member == ('CT', 1 - neutral):
+                    return member
+                else:
+                    members.append(member)
+
+            if not members:
+                return 'CT', neutral
+            elif len(members) == 1:
+                return members[0]
+
+            # Compound members first, the deepest first, the order being kept otherwise
+            members.sort(key=lambda member: (self.minimizer.is_simple(member), -self.minimizer.get_depth(member)))
+            return kind, tuple(members)
+
+        else:
+            return condition
+
+    def get_combinations(self, condition):
+        """Returns the number of ALD and OLD instructions of the condition once loads are combined"""
+        kind, value = condition
+
+        if kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return self.get_combinations(value)
+        elif kind == 'AND' or kind == 'OR':
+            return sum(self.get_combinations(member) + (rank > 0 and not self.minimizer.is_simple(member))
+                       for rank, member in enumerate(value))
+        else:
+            return 0
+
+    def get_subexpressions(self, condition):
+        kind, value = condition
+
+        if kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            yield from self.get_subexpressions(value)
+            if not self.minimizer.is_simple(condition):
+                yield condition
+
+        elif kind == 'AND' or kind == 'OR':
+            for member in value:
+                yield from self.get_subexpressions(member)
+            yield condition
+
+    def replace(self, condition, subexpression, bit):
+        if condition == subexpression:
+            return bit
+
+        kind, value = condition
+
+        if kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return kind, self.replace(value, subexpression, bit)
+        elif kind == 'AND' or kind == 'OR':
+            return kind, tuple(self.replace(member, subexpression, bit) for member in value)
+        else:
+            return condition
+
+    def schedule(self, condition, allocator=None):
+        """Returns the condition of a network in evaluation order and the (address, condition) of the
+        scratch bits it reads, to be evaluated before it in this order
+
+        Without allocator, the condition is ordered only.
+        """
+        self.networks += 1
+        self.depthsBefore.append(self.minimizer.get_depth(condition))
+        self.combinationsBefore += self.get_combinations(condition)
+
+        condition = self.order(condition)
+        scratches = list()
+        while allocator is not None and self.minimizer.get_depth(condition) > self.stackSize:
+            # Subexpressions are generated members first: the last deepest one fitting is the largest
+            candidates = [subexpression for subexpression in self.get_subexpressions(condition)
+                          if subexpression != condition and self.minimizer.get_depth(subexpression) <= self.stackSize]
+            rank, subexpression = max(enumerate(candidates),
+                                      key=lambda candidate: (self.minimizer.get_depth(candidate[1]), candidate[0]))
+            address = allocator.allocate(subexpression)
+            scratches.append((address, subexpression))
+            condition = self.order(self.replace(condition, subexpression, ('BT', address)))
+
+        self.depthsAfter.append(self.minimizer.get_depth(condition))
+        self.combinationsAfter += self.get_combinations(condition)
+        self.combinationsAfter += sum(self.get_combinations(subexpression) for address, subexpression in scratches)
+        self.scratches.extend(scratches)
+
+        return condition, scratches
+
+    def get_depths(self):
+        """Returns the largest depths of the logic stack needed by the networks, before and after scheduling"""
+        return max(self.depthsBefore, default=0), max(self.depthsAfter, default=0)
+
+    def get_combination_counts(self):
+        """Returns the numbers of ALD and OLD instructions of the networks, before and after scheduling"""
+        return self.combinationsBefore, self.combinationsAfter
+
+    def get_report(self):
+        before, after = self.get_depths()
+        combinationsBefore, combinationsAfter = self.get_combination_counts()
+        overflows = sum(1 for depth in self.depthsBefore if depth > self.stackSize)
+        return ('{} networks, stack depth {} before, {} after, {} ALD/OLD before, {} after, {} networks over {} '
+                'levels split into {} scratch bits').format(self.networks, before, after, combinationsBefore,
+                                                            combinationsAfter, overflows, self.stackSize,
+                                                            len(self.scratches))
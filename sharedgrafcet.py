@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""sharedgrafcet.py"""
+
+import atexit
+import hashlib
+import marshal
+import struct
+from multiprocessing import shared_memory
+
+from grafcet import *
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class SharedGrafcetError(Error):
+    """Exception raised when a shared memory block does not hold the expected GRAFCET.
+
+    Attributes:
+        name -- name of the shared memory block
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return "Shared memory block {} does not hold the expected GRAFCET".format(self.name)
+
+
+class ObjectTable:
+    """Sequence of values marshalled one after the other, decoded when they are read"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, id):
+        if id < 0:
+            id += len(self)
+        if not 0 <= id < len(self):
+            raise IndexError(id)
+        return marshal.loads(self.blob[self.offsets[id]:self.offsets[id + 1]])
+
+    def __iter__(self):
+        for id in range(len(self)):
+            yield self[id]
+
+
+class AdjacencyTable:
+    """Sequence of lists of ids, each one being a slice of a single array"""
+
+    def __init__(self, offsets, ids):
+        self.offsets = offsets
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, id):
+        return self.ids[self.offsets[id]:self.offsets[id + 1]]
+
+    def __iter__(self):
+        for id in range(len(self)):
+            yield self[id]
+
+
+class LookupTable:
+    """Read-only mapping from the values of an ObjectTable to their ids
+
+    Ids are sorted by value in the shared block, so keys are found by binary search: string hashes
+    differ from one process to the other and can not be shared.
+    """
+
+    def __init__(self, table, order):
+        self.table = table
+        self.order = order
+
+    @staticmethod
+    def sort_key(value):
+        return type(value).__name__, value
+
+    def find(self, key):
+        key = self.sort_key(key)
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.sort_key(self.table[self.order[middle]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.order) and self.sort_key(self.table[self.order[low]]) == key:
+            return self.order[low]
+        return None
+
+    def __getitem__(self, key):
+        id = self.find(key)
+        if id is None:
+            raise KeyError(key)
+        return id
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def get(self, key, default=None):
+        id = self.find(key)
+        return default if id is None else id
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return iter(self.table)
+
+
+class SharedGrafcet:
+    """Array form of a frozen GRAFCET published in a shared memory block
+
+    The block starts with a header and a table of sections. Names, indexes, PLC addresses, conditions
+    and actions are tables of marshalled values with their offsets, ids sorted by value give the
+    lookups, and adjacency lists are offsets into one array of ids. Processes attach the block from a
+    small descriptor and read it in place: fields have the interface of a FrozenGrafcet, values being
+    decoded when they are read and adjacency lists being slices of the block.
+
+    A SharedGrafcet is pickled as its descriptor, so it can be given to the workers of a process pool
+    instead of the GRAFCET itself, each worker attaching the block once. The publishing process owns
+    the block and unlinks it when closed.
+    """
+
+    magic = b'GRAFSHM1'
+    header = struct.Struct('<8s8sI')
+
+    objectFields = ('steps', 'stepCommentaries', 'stepPlcIndexes',
+                    'transitions', 'transitionPlcIndexes', 'conditions',
+                    'inputs', 'inputPlcIndexes',
+                    'outputs', 'outputPlcIndexes',
+                    'actions', 'outputActions')
+    lookupFields = (('steps', 'stepIds'), ('transitions', 'transitionIds'),
+                    ('inputs', 'inputIds'), ('outputs', 'outputIds'))
+    adjacencyFields = ('precedingSteps', 'succeedingSteps', 'precedingTransitions', 'succeedingTransitions')
+
+    def __init__(self, memory, owner=False):
+        self.memory = memory
+        self.owner = owner
+
+        buffer = memory.buf
+        magic, self.digest, sectionCount = self.header.unpack_from(buffer)
+        if magic != self.magic:
+            raise SharedGrafcetError(memory.name)
+
+        sections = list()
+        for section in range(sectionCount):
+            offset, length = struct.unpack_from('<QQ', buffer, self.header.size + 16 * section)
+            sections.append(buffer[offset:offset + length])
+        sections.reverse()
+
+        self.name, self.plcReset = marshal.loads(sections.pop())
+        self.initialSteps = sections.pop().cast('i')
+
+        for field in self.objectFields:
+            offsets = sections.pop().cast('q')
+            setattr(self, field, ObjectTable(offsets, sections.pop()))
+
+        for field, lookup in self.lookupFields:
+            setattr(self, lookup, LookupTable(getattr(self, field), sections.pop().cast('i')))
+
+        for field in self.adjacencyFields:
+            offsets = sections.pop().cast('i')
+            setattr(self, field, AdjacencyTable(offsets, sections.pop().cast('i')))
+
+    def __str__(self):
+        return 'Shared grafcet {}'.format(self.name)
+
+    def __repr__(self):
+        return str(self)
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        return type(other) is SharedGrafcet and self.digest == other.digest
+
+    def __reduce__(self):
+        return attach, (self.get_descriptor(),)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @staticmethod
+    def build_sections(grafcet):
+        sections = [marshal.dumps((grafcet.name, grafcet.plcReset)),
+                    struct.pack('<{}i'.format(len(grafcet.initialSteps)), *grafcet.initialSteps)]
+
+        for field in SharedGrafcet.objectFields:
+            values = [marshal.dumps(value) for value in getattr(grafcet, field)]
+            offsets = [0]
+            for value in values:
+                offsets.append(offsets[-1] + len(value))
+            sections.append(struct.pack('<{}q'.format(len(offsets)), *offsets))
+            sections.append(b''.join(values))
+
+        for field, lookup in SharedGrafcet.lookupFields:
+            values = getattr(grafcet, field)
+            order = sorted(range(len(values)), key=lambda id: LookupTable.sort_key(values[id]))
+            sections.append(struct.pack('<{}i'.format(len(order)), *order))
+
+        for field in SharedGrafcet.adjacencyFields:
+            lists = getattr(grafcet, field)
+            offsets = [0]
+            for ids in lists:
+                offsets.append(offsets[-1] + len(ids))
+            sections.append(struct.pack('<{}i'.format(len(offsets)), *offsets))
+            sections.append(struct.pack('<{}i'.format(offsets[-1]), *(id for ids in lists for id in ids)))
+
+        return sections
+
+    @classmethod
+    def publish(cls, grafcet):
+        """Copies the array form of the GRAFCET into a new shared memory block owned by this process"""
+        sections = cls.build_sections(grafcet.freeze())
+
+        # Sections are aligned on 8 bytes so that they can be cast in place
+        position = cls.header.size + 16 * len(sections)
+        table = list()
+        for section in sections:
+            position += -position % 8
+            table.append((position, len(section)))
+            position += len(section)
+
+        digest = hashlib.blake2b(b''.join(sections), digest_size=8).digest()
+
+        memory = shared_memory.SharedMemory(create=True, size=max(position, 1))
+        cls.header.pack_into(memory.buf, 0, cls.magic, digest, len(sections))
+        for number, ((offset, length), section) in enumerate(zip(table, sections)):
+            struct.pack_into('<QQ', memory.buf, cls.header.size + 16 * number, offset, length)
+            memory.buf[offset:offset + length] = section
+
+        grafcet = cls(memory, owner=True)
+        attachedGrafcets[memory.name] = grafcet
+
+        return grafcet
+
+    def get_descriptor(self):
+        """Returns the (block name, digest) needed to attach the GRAFCET from another process"""
+        return self.memory.name, self.digest
+
+    def get_size(self):
+        return self.memory.size
+
+    def release(self):
+        # Views of the block must be released before it is closed
+        for field in self.objectFields:
+            table = getattr(self, field)
+            table.offsets.release()
+            table.blob.release()
+        for field, lookup in self.lookupFields:
+            getattr(self, lookup).order.release()
+        for field in self.adjacencyFields:
+            table = getattr(self, field)
+            table.offsets.release()
+            table.ids.release()
+        self.initialSteps.release()
+
+    def close(self):
+        """Detaches the block, and destroys it in the publishing process"""
+        attachedGrafcets.pop(self.memory.name, None)
+        self.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def get_step_id(self, index):
+        return self.stepIds[index]
+
+    def get_transition_id(self, index):
+        return self.transitionIds[index]
+
+    def get_input_id(self, name):
+        return self.inputIds[name]
+
+    def get_output_id(self, name):
+        return self.outputIds[name]
+
+    def get_plc_reset(self):
+        return self.plcReset
+
+    def check_consistency(self):
+        return True
+
+    def freeze(self):
+        return self
+
+    def copy(self):
+        """Returns a FrozenGrafcet holding a private copy of every field"""
+        fields = list()
+        for name in FrozenGrafcet.fieldNames:
+            value = getattr(self, name)
+            if name in self.adjacencyFields:
+                value = tuple(tuple(ids) for ids in value)
+            elif name == 'initialSteps':
+                value = tuple(value)
+            elif name in self.objectFields:
+                value = tuple(value)
+            fields.append(value)
+        return FrozenGrafcet(fields)
+
+    def thaw(self):
+        return self.copy().thaw()
+
+
+attachedGrafcets = dict()
+
+
+def detach_all():
+    # Views of the blocks attached by a worker are released before the interpreter closes them
+    for grafcet in list(attachedGrafcets.values()):
+        if not grafcet.owner:
+            try:
+                grafcet.close()
+            except BufferError:
+                pass
+
+
+def attach(descriptor):
+    """Returns the GRAFCET of a shared memory block, attached once per process"""
+    name, digest = descriptor
+    if name not in attachedGrafcets:
+        if not attachedGrafcets:
+            atexit.register(detach_all)
+        # Workers share the resource tracker of the publishing process, which destroys the block
+        memory = shared_memory.SharedMemory(name=name)
+        attachedGrafcets[name] = SharedGrafcet(memory)
+
+    grafcet = attachedGrafcets[name]
+    if grafcet.digest != digest:
+        raise SharedGrafcetError(name)
+
+    return grafcet
@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""simulator.py"""
+
+import heapq
+
+from grafcet import *
+from conditioncompiler import ConditionCompiler
+from transient import TransientAnalyser
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class UnstableSituationError(Error):
+    """Exception raised when the evolution of a GRAFCET never reaches a stable situation.
+
+    Attributes:
+        situation -- active steps when the evolution was stopped
+    """
+
+    def __init__(self, situation):
+        self.situation = situation
+
+    def __str__(self):
+        return "No stable situation reached from steps {}".format(self.situation)
+
+
+class Simulator:
+    """Evolution of a GRAFCET following the NF EN 60848 rules
+
+    Situations are integers whose bit n is the activity of the step n of the frozen GRAFCET.
+    Inputs, outputs and delays are integers in the same way. Conditions are compiled by a
+    ConditionCompiler and evaluated on the state integer gathering steps, inputs and delays.
+
+    Delays waiting for their time to elapse are scheduled in an event queue, so that advance and run
+    jump straight from one input change or delay expiry to the next one. Chains of transient evolutions
+    are closed by a TransientAnalyser, so that evolve jumps to the situation where they stop.
+    """
+
+    timeTolerance = 1e-9
+    cacheSize = 65536
+
+    def __init__(self, grafcet, maxIterations=None):
+        self.grafcet = grafcet.freeze()
+
+        grafcet = self.grafcet
+
+        self.maxIterations = maxIterations
+        if self.maxIterations is None:
+            self.maxIterations = len(grafcet.transitions) + 1
+
+        self.initialSituation = 0
+        for id in grafcet.initialSteps:
+            self.initialSituation |= 1 << id
+
+        self.precedingMasks = [self.mask(steps) for steps in grafcet.precedingSteps]
+        self.succeedingMasks = [self.mask(steps) for steps in grafcet.succeedingSteps]
+
+        self.compiler = ConditionCompiler(grafcet)
+
+        self.conditions = [self.compiler.compile(condition) for condition in grafcet.conditions]
+        self.outputActions = [self.compiler.compile_output(id) for id in range(len(grafcet.outputs))]
+
+        self.delayKinds = list()
+        self.delayTimes = list()
+        self.delayExpressions = list()
+        self.delayGuards = list()
+
+        # Delays nested in the expression of a delay are appended while compiling it
+        delays = self.compiler.get_delays()
+        slot = 0
+        while slot < len(delays):
+            kind, value = delays[slot]
+            self.delayKinds.append(kind)
+            self.delayTimes.append((value[0], value[2] if kind == 'DE' else 0))
+            self.delayGuards.append(self.guard(value[1]) if kind == 'DU' or value[2] == 0 else 0)
+            self.delayExpressions.append(self.compiler.compile(value[1]))
+            slot += 1
+
+        self.unguardedDelays = tuple(slot for slot, guard in enumerate(self.delayGuards) if guard == 0)
+        self.stepDelays = [list() for step in grafcet.steps]
+        for slot, guard in enumerate(self.delayGuards):
+            if guard != 0:
+                self.stepDelays[(guard & -guard).bit_length() - 1].append(slot)
+
+        self.situationCache = dict()
+
+        self.transients = TransientAnalyser(grafcet)
+
+        self.reset()
+
+    def __str__(self):
+        return 'Simulator of {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    @staticmethod
+    def mask(ids):
+        mask = 0
+        for id in ids:
+            mask |= 1 << id
+        return mask
+
+    @staticmethod
+    def bits(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def guard(self, condition):
+        # Steps which must be active for the condition to be true
+        kind, value = condition
+
+        if kind == 'ST':
+            return 1 << self.grafcet.get_step_id(value)
+        elif kind == 'AND':
+            guard = 0
+            for member in value:
+                guard |= self.guard(member)
+            return guard
+        elif kind == 'OR':
+            guard = -1
+            for member in value:
+                guard &= self.guard(member)
+            return guard
+        elif kind == 'RE':
+            return self.guard(value)
+        else:
+            return 0
+
+    def reset(self):
+        self.situation = self.initialSituation
+        self.inputs = 0
+        self.delays = 0
+        self.time = 0.
+
+        self.previousState = self.compiler.state(self.situation, self.inputs, self.delays)
+
+        self.riseTimes = [None] * len(self.delayKinds)
+        self.fallTimes = [None] * len(self.delayKinds)
+        self.runningDelays = set()
+        self.pendingDelays = set()
+        self.expiries = [None] * len(self.delayKinds)
+        self.events = list()
+
+        self.stable = False
+        self.firedTransitions = 0
+
+    def start(self, inputs=0, time=0.):
+        """Resets the simulator as if the inputs had kept their values before the initial situation"""
+        self.reset()
+        self.set_inputs(inputs)
+        self.time = time
+        self.previousState = self.compiler.state(self.situation, self.inputs, self.delays)
+
+    def save(self):
+        """Returns a snapshot of the evolution, to be given back to restore"""
+        return (self.situation, self.inputs, self.delays, self.time, self.previousState, list(self.riseTimes),
+                list(self.fallTimes), set(self.runningDelays), set(self.pendingDelays), list(self.expiries),
+                list(self.events), self.stable, self.firedTransitions)
+
+    def restore(self, snapshot):
+        (self.situation, self.inputs, self.delays, self.time, self.previousState, riseTimes, fallTimes,
+         runningDelays, pendingDelays, expiries, events, self.stable, self.firedTransitions) = snapshot
+
+        self.riseTimes, self.fallTimes = list(riseTimes), list(fallTimes)
+        self.runningDelays, self.pendingDelays = set(runningDelays), set(pendingDelays)
+        self.expiries, self.events = list(expiries), list(events)
+
+    def get_grafcet(self):
+        return self.grafcet
+
+    def encode_inputs(self, values):
+        inputs = 0
+        for name, value in values.items():
+            if value:
+                inputs |= 1 << self.grafcet.get_input_id(name)
+        return inputs
+
+    def set_inputs(self, inputs):
+        if type(inputs) is not int:
+            inputs = self.encode_inputs(inputs)
+
+        if inputs != self.inputs:
+            self.inputs = inputs
+            self.stable = False
+
+    def get_inputs(self):
+        return self.inputs
+
+    def set_input(self, name, value):
+        bit = 1 << self.grafcet.get_input_id(name)
+        self.set_inputs(self.inputs | bit if value else self.inputs & ~bit)
+
+    def set_time(self, time):
+        if time != self.time:
+            self.time = time
+            if self.pendingDelays:
+                self.stable = False
+
+    def get_time(self):
+        return self.time
+
+    def set_situation(self, situation):
+        self.situation = situation
+        self.stable = False
+
+    def get_situation(self):
+        return self.situation
+
+    def get_delays(self):
+        return self.delays
+
+    def get_fired_transitions(self):
+        """Returns the mask of the transitions fired by evolve since the last reset"""
+        return self.firedTransitions
+
+    def get_active_steps(self):
+        return [self.grafcet.steps[id] for id in self.bits(self.situation)]
+
+    def is_active(self, index):
+        return bool(self.situation >> self.grafcet.get_step_id(index) & 1)
+
+    def is_stable(self):
+        return self.stable
+
+    def analyse(self, situation):
+        if len(self.situationCache) >= self.cacheSize:
+            self.situationCache.clear()
+
+        transitions = list()
+        delays = list(self.unguardedDelays)
+
+        for step in self.bits(situation):
+            delays += self.stepDelays[step]
+            for transition in self.grafcet.succeedingTransitions[step]:
+                precedingMask = self.precedingMasks[transition]
+                if situation & precedingMask == precedingMask and transition not in transitions:
+                    transitions.append(transition)
+
+        transitions.sort()
+        entry = (tuple((1 << transition, self.precedingMasks[transition], self.succeedingMasks[transition],
+                        self.conditions[transition]) for transition in transitions),
+                 tuple(delays))
+
+        self.situationCache[situation] = entry
+
+        return entry
+
+    def update_delays(self, slots):
+        d = self.delays
+        s, p = self.compiler.state(self.situation, self.inputs, d), self.previousState
+        time = self.time + self.timeTolerance
+        riseTimes, fallTimes = self.riseTimes, self.fallTimes
+
+        for slot in slots:
+            bit = 1 << slot
+            delayRe, delayFe = self.delayTimes[slot]
+            pending = False
+            expiry = None
+
+            if self.delayExpressions[slot](s, p):
+                fallTimes[slot] = None
+                if riseTimes[slot] is None:
+                    riseTimes[slot] = self.time
+                if self.delayKinds[slot] == 'DE':
+                    if time - riseTimes[slot] >= delayRe:
+                        d |= bit
+                    else:
+                        pending = True
+                        expiry = riseTimes[slot] + delayRe
+                elif time - riseTimes[slot] < delayRe:
+                    d |= bit
+                    pending = True
+                    expiry = riseTimes[slot] + delayRe
+                else:
+                    d &= ~bit
+            else:
+                riseTimes[slot] = None
+                if d & bit:
+                    if fallTimes[slot] is None:
+                        fallTimes[slot] = self.time
+                    if self.delayKinds[slot] == 'DU' or time - fallTimes[slot] >= delayFe:
+                        d &= ~bit
+                        fallTimes[slot] = None
+                    else:
+                        pending = True
+                        expiry = fallTimes[slot] + delayFe
+
+            if riseTimes[slot] is None and fallTimes[slot] is None:
+                self.runningDelays.discard(slot)
+            else:
+                self.runningDelays.add(slot)
+
+            if pending:
+                self.pendingDelays.add(slot)
+            else:
+                self.pendingDelays.discard(slot)
+
+            if expiry != self.expiries[slot]:
+                self.expiries[slot] = expiry
+                if expiry is not None:
+                    heapq.heappush(self.events, (expiry, slot))
+
+        self.delays = d
+
+    def cycle(self):
+        situation = self.situation
+
+        entry = self.situationCache.get(situation)
+        if entry is None:
+            entry = self.analyse(situation)
+        transitions, delays = entry
+
+        if delays or self.runningDelays:
+            self.update_delays(self.runningDelays.union(delays) if self.runningDelays else delays)
+
+        s, p = self.compiler.state(situation, self.inputs, self.delays), self.previousState
+
+        fired = cleared = activated = 0
+        for bit, precedingMask, succeedingMask, condition in transitions:
+            if condition(s, p):
+                fired |= bit
+                cleared |= precedingMask
+                activated |= succeedingMask
+
+        self.previousState = s
+
+        # Activation has priority over deactivation when a step is both cleared and activated
+        if fired:
+            self.situation = situation & ~cleared | activated
+
+        return fired
+
+    def evolve(self, inputs=None, time=None):
+        if inputs is not None:
+            self.set_inputs(inputs)
+        if time is not None:
+            self.set_time(time)
+
+        if self.stable:
+            return 0
+
+        # A cycle changing only delays is followed by another one for the delays reading them
+        iterations = 0
+        while True:
+            closure = self.transients.closure(self.situation, self.inputs)
+            if closure is not None:
+                situation, previousSituation, fired, count = closure
+                # Delays are updated as by the first cycle of the chain, the other ones do not change them
+                entry = self.situationCache.get(self.situation)
+                if entry is None:
+                    entry = self.analyse(self.situation)
+                if entry[1] or self.runningDelays:
+                    self.update_delays(self.runningDelays.union(entry[1]) if self.runningDelays else entry[1])
+
+                self.firedTransitions |= fired
+                iterations += count
+                if situation is None or iterations > self.maxIterations:
+                    raise UnstableSituationError(self.get_active_steps())
+                # The cycle on the stable situation compares its edges with the end of the chain
+                self.situation = situation
+                self.previousState = self.compiler.state(previousSituation, self.inputs, self.delays)
+
+            delays = self.delays
+            fired = self.cycle()
+            if fired:
+                self.firedTransitions |= fired
+                iterations += 1
+                if iterations > self.maxIterations:
+                    raise UnstableSituationError(self.get_active_steps())
+            elif self.delays == delays:
+                break
+
+        # Nothing changes until the inputs change or a pending delay expires
+        self.stable = True
+
+        return iterations
+
+    def get_next_expiry(self):
+        # Events of delays which were restarted or stopped since they were scheduled are dropped
+        events = self.events
+        while events:
+            expiry, slot = events[0]
+            if self.expiries[slot] == expiry and slot in self.pendingDelays:
+                return expiry
+            heapq.heappop(events)
+
+        return None
+
+    def record(self, trace):
+        if trace is not None and self.situation != trace[-1][1]:
+            trace.append((self.time, self.situation, self.get_outputs()))
+
+    def advance(self, time, trace=None):
+        """Evolves until time through every delay expiry, returns the number of expiries"""
+        self.evolve()
+        self.record(trace)
+
+        expiries = 0
+        expiry = self.get_next_expiry()
+        while expiry is not None and expiry <= time:
+            self.set_time(expiry)
+            self.evolve()
+            self.record(trace)
+            expiries += 1
+            expiry = self.get_next_expiry()
+
+        self.set_time(time)
+        self.evolve()
+        self.record(trace)
+
+        return expiries
+
+    def run(self, changes, until=None):
+        """Evolves through the (time, inputs) changes sorted by time, then until the given time
+
+        Returns the list of (time, situation, outputs) for the initial situation and after each event
+        changing the situation.
+        """
+        trace = [(self.time, self.situation, self.get_outputs())]
+
+        for time, inputs in changes:
+            self.advance(time, trace)
+            self.set_inputs(inputs)
+
+        self.advance(self.time if until is None else until, trace)
+
+        return trace
+
+    def get_outputs(self):
+        s, p = self.compiler.state(self.situation, self.inputs, self.delays), self.previousState
+
+        outputs = 0
+        for id, output in enumerate(self.outputActions):
+            if output(s, p):
+                outputs |= 1 << id
+
+        return outputs
+
+    def get_output_values(self):
+        outputs = self.get_outputs()
+        return {name: bool(outputs >> id & 1) for id, name in enumerate(self.grafcet.outputs)}
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""subexpressions.py"""
+
+from minimizer import LogicMinimizer
+
+
+class SubexpressionEliminator:
+    """Evaluates the subexpressions shared by several conditions once per scan into scratch bits
+
+    Conditions are given by scopes: the conditions of a scope are evaluated while the bits they read
+    keep their value, like the transitions of a GRAFCET or the actions of the outputs. A subexpression
+    used several times in a scope is evaluated into a scratch bit before the networks of the scope and
+    the conditions read this bit instead. Subexpressions which only read inputs, delays and other
+    such scratch bits do not change during a scan: they are shared by every scope and evaluated at
+    the start of the program.
+
+    Subexpressions are the products, sums, negations and edges of the canonical conditions, and the
+    pairs of members of products and sums, so that common factors are found within larger terms. The
+    one saving the most instructions is replaced first, then the uses are counted again, until no
+    subexpression saves instructions. Edges used several times are always replaced: their EU or ED is
+    then executed exactly once per scan.
+
+    Scratch bits are read as ('BT', address) atoms.
+    """
+
+    invariantKinds = ('IN', 'DE', 'DU', 'CT')
+
+    def __init__(self):
+        self.minimizer = LogicMinimizer()
+        self.reset()
+
+    def __str__(self):
+        return 'Subexpression eliminator'
+
+    def __repr__(self):
+        return str(self)
+
+    def reset(self):
+        self.scratches = list()
+        self.invariantBits = set()
+        self.instructionsBefore = 0
+        self.instructionsAfter = 0
+
+    def is_invariant(self, condition):
+        kind, value = condition
+
+        if kind == 'BT':
+            return value in self.invariantBits
+        elif kind in self.invariantKinds:
+            return True
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return self.is_invariant(value)
+        elif kind == 'AND' or kind == 'OR':
+            return all(self.is_invariant(member) for member in value)
+        else:
+            return False
+
+    def get_subexpressions(self, condition):
+        kind, value = condition
+
+        if kind == 'NOT':
+            # A negated bit is a single load
+            if not self.minimizer.is_atom(value):
+                yield condition
+                yield from self.get_subexpressions(value)
+
+        elif kind == 'RE' or kind == 'FE':
+            yield condition
+            if not self.minimizer.is_atom(value):
+                yield from self.get_subexpressions(value)
+
+        elif kind == 'AND' or kind == 'OR':
+            yield condition
+            if len(value) > 2:
+                for rank, member in enumerate(value):
+                    for other in value[rank + 1:]:
+                        yield kind, (member, other)
+            for member in value:
+                yield from self.get_subexpressions(member)
+
+    def replace(self, condition, subexpression, bit):
+        if condition == subexpression:
+            return bit
+
+        kind, value = condition
+
+        if kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return kind, self.replace(value, subexpression, bit)
+
+        elif kind == 'AND' or kind == 'OR':
+            members = [self.replace(member, subexpression, bit) for member in value]
+            # Pairs of members are replaced within larger products or sums
+            if subexpression[0] == kind and all(member in members for member in subexpression[1]):
+                members = [member for member in members if member not in subexpression[1]] + [bit]
+            return self.minimizer.canonical((kind, tuple(members)))
+
+        else:
+            return condition
+
+    def get_gain(self, subexpression, uses):
+        # Each use loads the bit instead of evaluating the subexpression, evaluated once and stored
+        cost = self.minimizer.get_cost(subexpression)
+        return uses * (cost - 1) - (cost + 1)
+
+    def eliminate(self, scopes, allocator):
+        """Returns the conditions of the scopes with their shared subexpressions replaced by scratch bits
+
+        Scopes are lists of frozen conditions. Unchanged conditions are returned as they are. The
+        scratch bits are allocated by the allocator, get_scratches gives their conditions.
+        """
+        self.reset()
+
+        conditions = [[self.minimizer.canonical(condition) for condition in scope] for scope in scopes]
+        # Scratch conditions of the scopes, the invariant ones being in scope None
+        scratches = list()
+
+        while True:
+            uses = dict()
+            for scope, scopeConditions in enumerate(conditions):
+                for condition in scopeConditions:
+                    self.count(condition, scope, uses)
+            for scope, address, condition in scratches:
+                self.count(condition, scope, uses)
+
+            best = None
+            bestKey = None
+            for key, count in uses.items():
+                if count < 2:
+                    continue
+                subexpression = key[1]
+                edge = subexpression[0] == 'RE' or subexpression[0] == 'FE'
+                gain = self.get_gain(subexpression, count)
+                if not edge and gain <= 0:
+                    continue
+                # Edges first, then the largest gains, then the largest subexpressions
+                candidate = (edge, gain, self.minimizer.get_cost(subexpression), repr(subexpression))
+                if best is None or candidate > best:
+                    best = candidate
+                    bestKey = key
+
+            if bestKey is None:
+                break
+
+            scope, subexpression = bestKey
+            address = allocator.allocate(subexpression)
+            bit = ('BT', address)
+            if scope is None:
+                self.invariantBits.add(address)
+
+            for scopeIndex, scopeConditions in enumerate(conditions):
+                if scope is None or scope == scopeIndex:
+                    scopeConditions[:] = [self.replace(condition, subexpression, bit) for condition in scopeConditions]
+            scratches = [(scratchScope, scratchAddress,
+                          self.replace(condition, subexpression, bit) if scope is None or scope == scratchScope
+                          else condition)
+                         for scratchScope, scratchAddress, condition in scratches]
+            scratches.append((scope, address, subexpression))
+
+        self.scratches = self.sort(scratches)
+
+        results = list()
+        for scope, scopeConditions in zip(scopes, conditions):
+            results.append([original if self.minimizer.canonical(original) == condition else condition
+                            for original, condition in zip(scope, scopeConditions)])
+
+        self.instructionsBefore = sum(self.minimizer.get_cost(condition) for scope in scopes for condition in scope)
+        self.instructionsAfter = (sum(self.minimizer.get_cost(condition) for scope in results for condition in scope)
+                                  + sum(self.minimizer.get_cost(condition) + 1 for scope, address, condition in scratches))
+
+        return results
+
+    def count(self, condition, scope, uses):
+        for subexpression in self.get_subexpressions(condition):
+            key = (None if self.is_invariant(subexpression) else scope, subexpression)
+            uses[key] = uses.get(key, 0) + 1
+
+    def get_bits(self, condition, bits):
+        kind, value = condition
+
+        if kind == 'BT':
+            bits.add(value)
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            self.get_bits(value, bits)
+        elif kind == 'AND' or kind == 'OR':
+            for member in value:
+                self.get_bits(member, bits)
+
+        return bits
+
+    def sort(self, scratches):
+        # Scratch bits are evaluated after the ones they read
+        byAddress = {address: (scope, address, condition) for scope, address, condition in scratches}
+        ordered = list()
+        visited = set()
+
+        def visit(address):
+            if address in visited:
+                return
+            visited.add(address)
+            for bit in sorted(self.get_bits(byAddress[address][2], set())):
+                visit(bit)
+            ordered.append(byAddress[address])
+
+        for scope, address, condition in scratches:
+            visit(address)
+
+        return ordered
+
+    def get_scratches(self, scope=None):
+        """Returns the (address, condition) of the scratch bits evaluated before the scope, in order"""
+        return [(address, condition) for scratchScope, address, condition in self.scratches if scratchScope == scope]
+
+    def get_instruction_counts(self):
+        """Returns the instructions per scan of the conditions, before and after the elimination"""
+        return self.instructionsBefore, self.instructionsAfter
+
+    def get_report(self):
+        before, after = self.get_instruction_counts()
+        lines = ['{} scratch bits, {} instructions per scan before, {} after'.format(len(self.scratches), before, after)]
+        for scope, address, condition in self.scratches:
+            lines.append('{}: {}'.format(address, condition))
+        return '\n'.join(lines)
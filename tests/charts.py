@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""charts.py
+
+GRAFCETs shared by the tests: the example of the repository and random charts.
+"""
+
+import csv
+import os
+import random
+
+from grafcetparser import GrafcetParser
+from grafcet import *
+
+exampleFolder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'example')
+
+
+def read_csv(name):
+    with open(os.path.join(exampleFolder, name + '.csv'), newline='') as csvfile:
+        return list(csv.reader(csvfile, delimiter=';', quotechar='"'))
+
+
+def load_example(steps=True, transitions=True):
+    """Returns the GRAFCET of the example folder with its symbols, step and transition addresses being
+    imported on demand"""
+    with open(os.path.join(exampleFolder, 'inputGrafcet.txt'), 'r', encoding='latin1') as file:
+        data = file.read()
+
+    grafcet = Grafcet('example')
+    grafcet.generate(GrafcetParser.parser_cadepa()(data))
+
+    grafcet.import_plc_data_inputs(read_csv('inputs'))
+    grafcet.import_plc_data_outputs(read_csv('outputs'))
+    if steps:
+        grafcet.import_plc_data_steps(read_csv('steps'))
+    if transitions:
+        grafcet.import_plc_data_transitions(read_csv('transitions'))
+    grafcet.import_plc_data_reset(read_csv('plcReset'))
+
+    return grafcet
+
+
+def link(grafcet, index, precedingSteps, succeedingSteps, condition):
+    """Adds a transition between steps, its condition being given in the form of process_expression"""
+    transition = Transition(str(index))
+    grafcet.add_transition(transition)
+
+    for step in precedingSteps:
+        transition.add_preceding_step(step)
+        step.add_succeeding_transition(transition)
+    for step in succeedingSteps:
+        transition.add_succeeding_step(step)
+        step.add_preceding_transition(transition)
+
+    transition.set_condition(grafcet.process_expression(condition))
+
+    return transition
+
+
+def random_grafcet(seed, stepCount=12, transitionCount=16, inputCount=5, falling=True):
+    """Returns a random GRAFCET whose conditions mix inputs, steps, edges and delays, every step having
+    a preceding and a succeeding transition, with addresses for every symbol"""
+    generator = random.Random(seed)
+    grafcet = Grafcet('Random {}'.format(seed))
+
+    steps = [Step(str(index), initial=index == 0 or generator.random() < 0.1) for index in range(stepCount)]
+    for step in steps:
+        grafcet.add_step(step)
+
+    for index in range(inputCount):
+        grafcet.get_inputs()['i{}'.format(index)] = Input('i{}'.format(index))
+
+    for step in steps:
+        if generator.random() < 0.6:
+            name = 'o{}'.format(generator.randrange(4))
+            output = grafcet.get_outputs().setdefault(name, Output(name))
+            action = Action(step=step, output=output)
+            output.add_action(action)
+            step.add_action(action)
+
+    def condition(depth):
+        draw = generator.random()
+        if depth > 2 or draw < 0.45:
+            return 'IN', 'i{}'.format(generator.randrange(inputCount))
+        elif draw < 0.55:
+            return 'ST', str(generator.randrange(stepCount))
+        elif draw < 0.65:
+            return 'NOT', condition(depth + 1)
+        elif draw < 0.72:
+            # Edges are taken on inputs only: the simulators compare an edge with the cycle before only
+            return generator.choice(['RE', 'FE']), ('IN', 'i{}'.format(generator.randrange(inputCount)))
+        elif draw < 0.80:
+            return 'DE', [generator.choice([0.1, 0.3, 0.5]), condition(depth + 1),
+                          generator.choice([0, 0.2]) if falling else 0]
+        return generator.choice(['AND', 'OR']), [condition(depth + 1) for member in range(generator.randint(2, 3))]
+
+    for index in range(transitionCount):
+        link(grafcet, index, generator.sample(steps, generator.choice([1, 1, 1, 2])),
+             generator.sample(steps, generator.choice([1, 1, 1, 2])), condition(0))
+
+    index = transitionCount
+    for step in steps:
+        if not step.get_preceding_transitions():
+            link(grafcet, index, [generator.choice(steps)], [step], condition(0))
+            index += 1
+        if not step.get_succeeding_transitions():
+            link(grafcet, index, [step], [generator.choice(steps)], condition(0))
+            index += 1
+
+    set_plc_indexes(grafcet)
+
+    return grafcet
+
+
+def sequential_grafcet(seed, stepCount=10, inputCount=4):
+    """Returns a random loop of steps with selections of exclusive conditions, guarded by delays on the
+    steps, with addresses for every symbol"""
+    generator = random.Random(seed)
+    grafcet = Grafcet('Sequential {}'.format(seed))
+
+    steps = [Step(str(index), initial=index == 0) for index in range(stepCount)]
+    for step in steps:
+        grafcet.add_step(step)
+
+    for index in range(inputCount):
+        grafcet.get_inputs()['i{}'.format(index)] = Input('i{}'.format(index))
+
+    for index, step in enumerate(steps):
+        if generator.random() < 0.5:
+            name = 'o{}'.format(generator.randrange(3))
+            output = grafcet.get_outputs().setdefault(name, Output(name))
+            action = Action(step=step, output=output)
+            if generator.random() < 0.5:
+                action.set_condition(grafcet.process_expression(('DE', [generator.choice([0.2, 0.3]),
+                                                                        ('ST', str(index)), 0])))
+            output.add_action(action)
+            step.add_action(action)
+
+    # Steps of a selection go to the next step on a choice input and elsewhere on its complement
+    selections = {index: 'i{}'.format(generator.randrange(inputCount))
+                  for index in generator.sample(range(stepCount), 3)}
+    pairs = [(index, (index + 1) % stepCount) for index in range(stepCount)]
+    pairs += [(index, generator.randrange(stepCount)) for index in selections]
+    for index, (preceding, succeeding) in enumerate(pairs):
+        condition = 'IN', 'i{}'.format(generator.randrange(inputCount))
+        if preceding in selections:
+            choice = 'IN', selections[preceding]
+            condition = 'AND', [condition, choice if index < stepCount else ('NOT', choice)]
+        if generator.random() < 0.7:
+            condition = 'AND', [('DE', [generator.choice([0.2, 0.3]), ('ST', str(preceding)), 0]), condition]
+        link(grafcet, index, [steps[preceding]], [steps[succeeding]], condition)
+
+    set_plc_indexes(grafcet)
+
+    return grafcet
+
+
+def set_plc_indexes(grafcet):
+    for rank, input in enumerate(sorted(grafcet.get_inputs().values(), key=Input.get_name)):
+        input.set_plc_index('I{}.{}'.format(rank // 8, rank % 8))
+    for rank, output in enumerate(sorted(grafcet.get_outputs().values(), key=Output.get_name)):
+        output.set_plc_index('Q{}.{}'.format(rank // 8, rank % 8))
+    grafcet.set_plc_reset(Input('reset', 'I9.0'))
+    grafcet.allocate_plc_indexes()
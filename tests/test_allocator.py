@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_allocator.py"""
+
+import unittest
+
+from allocator import AddressAllocator, AddressError
+from project import Project
+
+from charts import load_example, read_csv
+
+
+class TestAddressAllocator(unittest.TestCase):
+
+    def test_pinned_addresses_are_skipped(self):
+        allocator = AddressAllocator()
+        allocator.reserve('V0.2', 'pinned')
+
+        addresses = allocator.allocate_block(range(4))
+
+        self.assertEqual(addresses, ['V1.0', 'V1.1', 'V1.2', 'V1.3'])
+        self.assertEqual(allocator.get_owner('V0.2'), 'pinned')
+
+    def test_wide_blocks_start_on_a_word(self):
+        allocator = AddressAllocator()
+        allocator.allocate_block(range(3))
+
+        addresses = allocator.allocate_block(range(12))
+
+        self.assertEqual(addresses[0], 'V2.0')
+        self.assertEqual(allocator.get_blocks(), [('V0.0', 3), ('V2.0', 12)])
+
+    def test_collision_is_refused(self):
+        allocator = AddressAllocator()
+        allocator.reserve('V0.0', 'first')
+
+        with self.assertRaises(AddressError):
+            allocator.reserve('V0.0', 'second')
+
+
+class TestGrafcetAllocation(unittest.TestCase):
+
+    def test_given_addresses_are_kept(self):
+        grafcet = load_example()
+        given = {step.get_index(): step.get_plc_index() for step in grafcet.get_steps().values()
+                 if step.get_plc_index() is not None}
+
+        grafcet.allocate_plc_indexes()
+
+        for index, address in given.items():
+            self.assertEqual(grafcet.get_steps()[index].get_plc_index(), address)
+
+    def test_missing_addresses_are_packed(self):
+        grafcet = load_example(steps=False, transitions=False)
+
+        allocator = grafcet.allocate_plc_indexes()
+
+        steps = [step.get_plc_index() for branch in grafcet.get_branches() for step in branch]
+        start = AddressAllocator.parse(steps[0])[1]
+        self.assertEqual(steps, [AddressAllocator.format('V', bit) for bit in range(start, start + len(steps))])
+
+        transitions = [transition.get_plc_index() for transition in grafcet.get_ordered_transitions()]
+        self.assertEqual(len(set(steps + transitions)), len(steps) + len(transitions))
+        for address, length in allocator.get_blocks():
+            if length > 8:
+                self.assertEqual(AddressAllocator.parse(address)[1] % 16, 0)
+
+    def test_exported_rows_match_the_imported_ones(self):
+        grafcet = load_example()
+        grafcet.allocate_plc_indexes()
+
+        rows = {row[0]: row[1] for row in grafcet.export_plc_data_steps()}
+
+        for name, address, comment in read_csv('steps'):
+            self.assertEqual(rows[name], address)
+
+    def test_project_reserves_every_chart_first(self):
+        project = Project('plant')
+        first = load_example(steps=False, transitions=False)
+        second = load_example(steps=False, transitions=False)
+        second.name = 'second'
+        second.get_steps()['1'].set_plc_index('V0.0')
+        project.add_grafcet(first)
+        project.add_grafcet(second)
+
+        project.allocate_plc_indexes()
+
+        self.assertIs(project.get_allocator().get_owner('V0.0'), second.get_steps()['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
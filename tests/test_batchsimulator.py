@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_batchsimulator.py"""
+
+import unittest
+
+import numpy
+
+from grafcet import *
+from simulator import Simulator, UnstableSituationError
+from batchsimulator import BatchSimulator
+
+from charts import link, random_grafcet, set_plc_indexes
+
+
+class TestBatchSimulator(unittest.TestCase):
+
+    scenarios = 24
+    evolutions = 30
+
+    @staticmethod
+    def situation(row):
+        return sum(1 << int(id) for id in numpy.flatnonzero(row))
+
+    def check(self, grafcet, inputs, times):
+        """Runs every scenario in a batch, alone in a batch and in a Simulator and compares them"""
+        grafcet = grafcet.freeze()
+        batch = BatchSimulator(grafcet, len(inputs[0]))
+        alone = [BatchSimulator(grafcet, 1) for scenario in range(len(inputs[0]))]
+        simulators = [Simulator(grafcet) for scenario in range(len(inputs[0]))]
+
+        for evolution, time in enumerate(times):
+            batch.evolve(inputs[evolution], time)
+            outputs = batch.get_outputs()
+            for scenario, simulator in enumerate(simulators):
+                alone[scenario].evolve(inputs[evolution, scenario:scenario + 1], time)
+                simulator.evolve(self.situation(inputs[evolution, scenario]), time)
+
+                message = 'scenario {} at {}'.format(scenario, time)
+                self.assertEqual(self.situation(batch.get_situations()[scenario]), simulator.get_situation(), message)
+                self.assertEqual(self.situation(outputs[scenario]), simulator.get_outputs(), message)
+                self.assertTrue((alone[scenario].get_situations()[0] == batch.get_situations()[scenario]).all(),
+                                message)
+
+    def test_random_charts(self):
+        checked = 0
+        for seed in range(40):
+            generator = numpy.random.default_rng(seed)
+            grafcet = random_grafcet(seed)
+            inputs = generator.random((self.evolutions, self.scenarios, len(grafcet.get_inputs()))) < 0.4
+            # Scenarios often keep their inputs: only their pending delays make them evolve
+            for evolution in range(1, self.evolutions):
+                kept = generator.random(self.scenarios) < 0.5
+                inputs[evolution, kept] = inputs[evolution - 1, kept]
+            times = numpy.cumsum(generator.choice([0.05, 0.1, 0.25], self.evolutions))
+
+            try:
+                self.check(grafcet, inputs, times)
+            except UnstableSituationError:
+                continue
+            checked += 1
+
+        self.assertGreater(checked, 10)
+
+    def test_stable_scenarios_keep_their_edges(self):
+        # The rising edge of i0 forbids the first transition in the cycle where it occurs only: the
+        # scenario is then stable and the transition does not fire until its inputs change
+        grafcet = Grafcet('edges')
+        steps = [Step(str(index), initial=index in (0, 2)) for index in range(6)]
+        for step in steps:
+            grafcet.add_step(step)
+        for name in ('i0', 'i1', 'i2'):
+            grafcet.get_inputs()[name] = Input(name)
+        link(grafcet, 0, [steps[0]], [steps[1]], ('AND', [('IN', 'i1'), ('NOT', ('RE', ('IN', 'i0')))]))
+        link(grafcet, 1, [steps[1]], [steps[0]], ('NOT', ('IN', 'i1')))
+        # A chain of evolutions in the other scenario keeps the batch cycling
+        for index in range(2, 5):
+            link(grafcet, index, [steps[index]], [steps[index + 1]], ('IN', 'i2'))
+        link(grafcet, 5, [steps[5]], [steps[2]], ('NOT', ('IN', 'i2')))
+        set_plc_indexes(grafcet)
+
+        inputs = numpy.zeros((4, 2, 3), dtype=bool)
+        inputs[1:3, 0] = [True, True, False]
+        inputs[1, 1] = [False, False, True]
+        inputs[3, 0] = [True, False, False]
+
+        self.check(grafcet, inputs, [0.1, 0.2, 0.3, 0.4])
+
+if __name__ == '__main__':
+    unittest.main()
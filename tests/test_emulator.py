@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_emulator.py"""
+
+import random
+import unittest
+
+from emulator import Simatic_S7_200_Emulator, StackError
+from differential import DifferentialTester
+
+from charts import load_example, random_grafcet
+
+
+class TestEmulator(unittest.TestCase):
+
+    def test_instructions(self):
+        emulator = Simatic_S7_200_Emulator('Network 1\n'
+                                           'LD I0.0\nA I0.1\nLDN I0.2\nOLD\n= Q0.0\n'
+                                           'Network 2\n'
+                                           'LD I0.3\nEU\n= Q0.1\n'
+                                           'Network 3\n'
+                                           'LD I0.4\nTON T37, 5\n')
+
+        emulator.set_bits({'I0.2': True})
+        emulator.scan(0.)
+        self.assertFalse(emulator.get_bit('Q0.0'))
+
+        emulator.set_bits({'I0.0': True, 'I0.1': True, 'I0.3': True, 'I0.4': True})
+        emulator.scan(0.1)
+        self.assertTrue(emulator.get_bit('Q0.0'))
+        self.assertTrue(emulator.get_bit('Q0.1'))
+        self.assertFalse(emulator.get_bit('T37'))
+
+        emulator.scan(0.6)
+        self.assertFalse(emulator.get_bit('Q0.1'))
+        self.assertTrue(emulator.get_bit('T37'))
+
+    def test_stack_overflow_is_refused(self):
+        code = 'Network 1\n' + 'LD I0.0\n' * 10 + 'OLD\n' * 9 + '= Q0.0\n'
+
+        with self.assertRaises(StackError):
+            Simatic_S7_200_Emulator(code)
+
+
+class TestEmulatorAgainstSimulator(unittest.TestCase):
+    """The program generated for a GRAFCET, run by the emulator, behaves as the Simulator scan by scan"""
+
+    def check(self, grafcet, scenarios=10, length=100):
+        tester = DifferentialTester(grafcet, 0.1)
+        divergences = tester.check([tester.random_scenario(length, random.Random(seed))
+                                    for seed in range(scenarios)])
+
+        self.assertEqual(divergences, [], grafcet)
+
+    def test_example(self):
+        self.check(load_example())
+
+    def test_random_charts(self):
+        for seed in range(12):
+            self.check(random_grafcet(seed, falling=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_minimizer.py"""
+
+import itertools
+import random
+import unittest
+
+from minimizer import LogicMinimizer
+from plc import Simatic_S7_200
+from emulator import Simatic_S7_200_Emulator
+
+from charts import load_example, random_grafcet
+
+
+def evaluate(condition, values):
+    kind, value = condition
+
+    if kind == 'CT':
+        return bool(value)
+    elif kind == 'NOT':
+        return not evaluate(value, values)
+    elif kind == 'AND':
+        return all(evaluate(member, values) for member in value)
+    elif kind == 'OR':
+        return any(evaluate(member, values) for member in value)
+    else:
+        return values[condition]
+
+
+def random_condition(generator, atoms, depth=0):
+    draw = generator.random()
+    if depth > 3 or draw < 0.35:
+        return generator.choice(atoms)
+    elif draw < 0.45:
+        return 'NOT', random_condition(generator, atoms, depth + 1)
+    elif draw < 0.48:
+        return 'CT', generator.randrange(2)
+    return (generator.choice(['AND', 'OR']),
+            tuple(random_condition(generator, atoms, depth + 1) for member in range(generator.randint(2, 4))))
+
+
+class TestLogicMinimizer(unittest.TestCase):
+
+    def check(self, condition, minimized):
+        atoms = sorted(LogicMinimizer().get_atoms(condition, set()), key=repr)
+        self.assertEqual(LogicMinimizer().get_atoms(minimized, set()) - set(atoms), set())
+        for bits in itertools.product((False, True), repeat=len(atoms)):
+            values = dict(zip(atoms, bits))
+            self.assertEqual(evaluate(minimized, values), evaluate(condition, values), (condition, minimized))
+
+    def test_minimized_conditions_are_equivalent(self):
+        # Few atoms go through Quine-McCluskey, more through Espresso
+        for count in (3, 6, 11):
+            generator = random.Random(count)
+            atoms = [('IN', 'i{}'.format(index)) for index in range(count - 2)] + \
+                    [('RE', ('IN', 'i0')), ('DE', (0.5, ('ST', '1'), 0))]
+            minimizer = LogicMinimizer()
+            for condition in range(40):
+                condition = random_condition(generator, atoms)
+                minimized = minimizer.minimize(condition)
+                self.check(condition, minimized)
+                self.assertLessEqual(minimizer.get_cost(minimized), minimizer.get_cost(condition))
+
+    def test_cache_is_per_minimizer(self):
+        condition = 'OR', (('AND', (('IN', 'a'), ('IN', 'b'))), ('AND', (('IN', 'a'), ('NOT', ('IN', 'b')))))
+        minimizer = LogicMinimizer()
+
+        self.assertEqual(minimizer.minimize(condition), ('IN', 'a'))
+        self.assertEqual(LogicMinimizer().results, dict())
+
+        minimizer.clear_cache()
+        self.assertEqual(minimizer.results, dict())
+
+
+class TestMinimizedProgram(unittest.TestCase):
+    """The program with minimized conditions behaves as the one converted as typed, scan by scan"""
+
+    def check(self, grafcet, scans=300):
+        plc = Simatic_S7_200()
+        typed = Simatic_S7_200()
+        typed.minimizer = None
+        emulators = [Simatic_S7_200_Emulator(plc.get_code(grafcet)),
+                     Simatic_S7_200_Emulator(typed.get_code(grafcet))]
+
+        inputs = [input.get_plc_index() for input in grafcet.get_inputs().values()]
+        inputs.append(grafcet.get_plc_reset().get_plc_index())
+        bits = [step.get_plc_index() for step in grafcet.get_steps().values()] + \
+               [output.get_plc_index() for output in grafcet.get_outputs().values()]
+
+        generator = random.Random(0)
+        values = {input: False for input in inputs}
+        for scan in range(scans):
+            for input in inputs:
+                if generator.random() < 0.1:
+                    values[input] = not values[input]
+            states = list()
+            for emulator in emulators:
+                emulator.set_bits(values)
+                emulator.scan(scan * 0.1)
+                states.append([emulator.get_bit(bit) for bit in bits])
+            self.assertEqual(states[0], states[1], 'scan {}'.format(scan))
+
+    def test_example(self):
+        self.check(load_example())
+
+    def test_random_charts(self):
+        # Falling delays are not converted yet
+        for seed in range(12):
+            self.check(random_grafcet(seed, falling=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
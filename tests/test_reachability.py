@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_reachability.py"""
+
+import unittest
+
+from reachability import Explorer
+
+from charts import random_grafcet
+
+
+class TestExplorer(unittest.TestCase):
+
+    def check_trace(self, explorer, marking):
+        grafcet = explorer.get_grafcet()
+        trace = explorer.get_trace(marking)
+
+        self.assertEqual(trace[0], ([], explorer.get_steps(explorer.initialMarking)))
+        self.assertEqual(trace[-1][1], explorer.get_steps(marking))
+        # Each marking of the trace follows the one before by firing the given transitions
+        for (fired, steps), (nextFired, nextSteps) in zip(trace, trace[1:]):
+            source = explorer.mask(grafcet.get_step_id(step) for step in steps)
+            target = explorer.mask(grafcet.get_step_id(step) for step in nextSteps)
+            transitions = explorer.mask(grafcet.get_transition_id(transition) for transition in nextFired)
+            self.assertIn((target, transitions), explorer.successors(source))
+
+    def test_traces_are_rebuilt_from_the_layers(self):
+        for seed in (0, 3, 7):
+            grafcet = random_grafcet(seed)
+            for spillSize in (None, 4):
+                explorer = Explorer(grafcet, workers=1, spillSize=spillSize).explore()
+                self.assertTrue(explorer.is_complete())
+                markings = sorted(explorer.get_markings())
+                for marking in markings[::max(1, len(markings) // 10)]:
+                    self.check_trace(explorer, marking)
+
+    def test_spilled_frontiers_give_the_same_markings(self):
+        grafcet = random_grafcet(7)
+        explorer = Explorer(grafcet, workers=1).explore()
+        spilled = Explorer(grafcet, workers=1, spillSize=2).explore()
+
+        self.assertEqual(set(spilled.get_markings()), set(explorer.get_markings()))
+        self.assertEqual(spilled.get_depth(), explorer.get_depth())
+
+
+if __name__ == '__main__':
+    unittest.main()
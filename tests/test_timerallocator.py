@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""test_timerallocator.py"""
+
+import random
+import unittest
+from unittest import mock
+
+from grafcet import *
+from timerallocator import TimerAllocator, BoundedExplorer
+from plc import Simatic_S7_200
+from differential import DifferentialTester
+
+from charts import link, sequential_grafcet, set_plc_indexes
+
+
+class TestTimerAllocator(unittest.TestCase):
+
+    def test_situations_explored_once(self):
+        grafcet = sequential_grafcet(0)
+        plc = Simatic_S7_200()
+        explore = BoundedExplorer.explore
+
+        with mock.patch.object(BoundedExplorer, 'explore', autospec=True, side_effect=explore) as explorations:
+            plc.get_code(grafcet)
+            report = plc.timerAllocator.get_report()
+            plc.get_code(grafcet)
+            self.assertEqual(plc.timerAllocator.get_report(), report)
+
+        self.assertEqual(explorations.call_count, 1)
+
+    def test_structural_overlaps(self):
+        grafcet = Grafcet('selection')
+        steps = [Step(str(index), initial=index in (0, 4)) for index in range(6)]
+        for step in steps:
+            grafcet.add_step(step)
+        grafcet.get_inputs()['i0'] = Input('i0')
+        grafcet.get_inputs()['i1'] = Input('i1')
+
+        # Exclusive selection from 0 to 1 or 2, then 3 and back to 0
+        link(grafcet, 0, [steps[0]], [steps[1]], ('IN', 'i0'))
+        link(grafcet, 1, [steps[0]], [steps[2]], ('NOT', ('IN', 'i0')))
+        link(grafcet, 2, [steps[1]], [steps[3]], ('IN', 'i1'))
+        link(grafcet, 3, [steps[2]], [steps[3]], ('IN', 'i1'))
+        link(grafcet, 4, [steps[3]], [steps[0]], ('IN', 'i1'))
+        # Non exclusive selection from 4 to 5 or back to 4
+        link(grafcet, 5, [steps[4]], [steps[5]], ('IN', 'i0'))
+        link(grafcet, 6, [steps[4]], [steps[4]], ('IN', 'i1'))
+        link(grafcet, 7, [steps[5]], [steps[4]], ('IN', 'i1'))
+        set_plc_indexes(grafcet)
+
+        frozen = grafcet.freeze()
+        overlaps = TimerAllocator([0.1], {0.1: [37]}).get_structural_overlaps(frozen)
+
+        def overlap(step, other):
+            return bool(overlaps[frozen.get_step_id(str(step))] >> frozen.get_step_id(str(other)) & 1)
+
+        self.assertFalse(overlap(1, 2))
+        self.assertTrue(overlap(1, 3))
+        self.assertTrue(overlap(1, 0))
+        self.assertTrue(overlap(4, 5))
+        self.assertTrue(overlap(5, 2))
+
+    def test_structural_fallback(self):
+        shared = 0
+        with mock.patch.object(TimerAllocator, 'maxStates', 0):
+            for seed in range(6):
+                grafcet = sequential_grafcet(seed)
+                plc = Simatic_S7_200()
+                plc.get_code(grafcet)
+                shared += len(plc.timerAllocator.delays) - len(plc.timerAllocator.members)
+                self.assertIn('not all explored', plc.timerAllocator.get_report())
+
+                tester = DifferentialTester(grafcet, 0.1)
+                divergences = tester.check([tester.random_scenario(150, random.Random(seed))
+                                            for seed in range(4)])
+                self.assertEqual(divergences, [], grafcet)
+
+        self.assertGreater(shared, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""testvectors.py"""
+
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from reachability import Explorer
+from simulator import Simulator, UnstableSituationError
+
+
+def simulate_scenario(arguments):
+    """Returns the masks of the transitions fired, steps activated and outputs set by a scenario"""
+    grafcet, scenario, until = arguments
+    simulator = Simulator(grafcet)
+
+    try:
+        trace = simulator.run(scenario, until)
+    except UnstableSituationError:
+        return 0, 0, 0
+
+    # Steps of transient situations are activated by the transitions fired
+    fired = simulator.get_fired_transitions()
+    steps = outputs = 0
+    for transition in simulator.bits(fired):
+        steps |= simulator.succeedingMasks[transition]
+    for time, situation, situationOutputs in trace:
+        steps |= situation
+        outputs |= situationOutputs
+
+    return fired, steps, outputs
+
+
+class TestVectorGenerator:
+    """Input sequences covering the transitions, steps and outputs of a GRAFCET
+
+    Sequences are searched on the markings of the Explorer: from the current situation, a breadth
+    first search finds the nearest evolution firing a transition, activating a step or setting an
+    output not covered yet. Its valuation of the atoms is turned into timed input vectors, edges of
+    inputs getting a preceding vector with the opposite value and delays being waited for, and the
+    vectors are simulated. The evolution is kept if the simulation reaches the expected situation,
+    otherwise it is discarded for the rest of the sequence. A new sequence starts from the initial
+    situation when nothing new can be reached. Search trees and evolutions are kept for every marking
+    they were computed from.
+
+    The sequences kept are replayed from scratch in a pool of processes, so the reported coverage is
+    the one of the scenarios written.
+    """
+
+    def __init__(self, grafcet, period=0.1, workers=None, maxLength=1000):
+        self.grafcet = grafcet.freeze()
+        self.period = period
+        self.maxLength = maxLength
+
+        self.workers = workers
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+
+        self.explorer = Explorer(self.grafcet, workers=1)
+        self.atoms = self.explorer.compiler.get_atoms()
+        self.atomOffset = self.explorer.compiler.atomOffset
+
+        # Outputs are expected as soon as one step acting on them is active
+        self.outputMasks = [self.explorer.mask(stepId for stepId, rank in actions)
+                            for actions in self.grafcet.outputActions]
+
+        self.simulator = Simulator(self.grafcet)
+
+        self.edges = dict()
+        self.trees = dict()
+
+        self.scenarios = list()
+        self.coverage = (0, 0, 0)
+
+    def __str__(self):
+        return 'Test vector generator of {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    def get_edges(self, marking):
+        if marking not in self.edges:
+            self.edges[marking] = self.explorer.get_edges(marking)
+        return self.edges[marking]
+
+    def get_tree(self, source):
+        """Returns the markings reachable from source in breadth first order, and their parents"""
+        if source not in self.trees:
+            parents = {source: None}
+            order = [source]
+            queue = deque(order)
+            while queue:
+                marking = queue.popleft()
+                for successor, fired, valuation in self.get_edges(marking):
+                    if successor not in parents:
+                        parents[successor] = (marking, fired, valuation)
+                        order.append(successor)
+                        queue.append(successor)
+            self.trees[source] = (order, parents)
+
+        return self.trees[source]
+
+    def get_outputs(self, marking):
+        outputs = 0
+        for id, mask in enumerate(self.outputMasks):
+            if marking & mask:
+                outputs |= 1 << id
+        return outputs
+
+    def gain(self, coverage, fired, successor):
+        transitions, steps, outputs = coverage
+        return (fired & ~transitions) | (successor & ~steps) | (self.get_outputs(successor) & ~outputs)
+
+    def find_edge(self, source, coverage, discarded):
+        # First evolution of the path to the nearest one covering something new, and whether it is
+        # this one
+        order, parents = self.get_tree(source)
+
+        for marking in order:
+            for successor, fired, valuation in self.get_edges(marking):
+                if (marking, successor) not in discarded and self.gain(coverage, fired, successor):
+                    edge = (marking, successor, valuation)
+                    parent = marking
+                    while parents[parent] is not None:
+                        edge = (parents[parent][0], parent, parents[parent][2])
+                        parent = parents[parent][0]
+                    # Paths starting with an evolution which could not be simulated are not tried again
+                    if edge[:2] not in discarded:
+                        return edge, edge[1] == successor and edge[0] == source
+
+        return None
+
+    def get_input_bit(self, condition):
+        if condition[0] == 'IN':
+            return 1 << self.grafcet.get_input_id(condition[1])
+        return 0
+
+    def get_required_inputs(self, condition):
+        # Inputs which are true in every valuation making the condition true
+        if condition[0] == 'IN':
+            return self.get_input_bit(condition)
+        elif condition[0] == 'AND':
+            inputs = 0
+            for member in condition[1]:
+                inputs |= self.get_required_inputs(member)
+            return inputs
+        elif condition[0] == 'DE' or condition[0] == 'DU':
+            return self.get_required_inputs(condition[1][1])
+        return 0
+
+    def concretise(self, valuation, time):
+        """Returns the (time, inputs) vectors of a valuation and the time to wait until"""
+        inputs = before = edges = 0
+        wait = self.period
+
+        for id, atom in enumerate(self.atoms):
+            value = valuation >> (self.atomOffset + id) & 1
+            kind, member = atom
+            if kind == 'IN':
+                inputs |= self.get_input_bit(atom) if value else 0
+            elif kind == 'RE' or kind == 'FE':
+                bit = self.get_input_bit(member)
+                if value and bit:
+                    edges |= bit
+                    if kind == 'RE':
+                        inputs |= bit
+                    else:
+                        before |= bit
+            elif value:
+                inputs |= self.get_required_inputs(atom)
+                if kind == 'DE':
+                    wait = max(wait, member[0] + self.period)
+
+        vectors = list()
+        if edges:
+            vectors.append((time, inputs & ~edges | before))
+            time += self.period
+        vectors.append((time, inputs))
+
+        return vectors, time + wait
+
+    def play(self, vectors, until, coverage):
+        simulator = self.simulator
+        trace = [(simulator.get_time(), simulator.get_situation(), simulator.get_outputs())]
+
+        for time, inputs in vectors:
+            simulator.advance(time, trace)
+            simulator.set_inputs(inputs)
+        simulator.advance(until, trace)
+
+        transitions, steps, outputs = coverage
+        fired = simulator.get_fired_transitions()
+        for transition in simulator.bits(fired & ~transitions):
+            steps |= simulator.succeedingMasks[transition]
+        for time, situation, situationOutputs in trace:
+            steps |= situation
+            outputs |= situationOutputs
+
+        return transitions | fired, steps, outputs
+
+    def search(self):
+        """Returns the scenarios of (time, inputs) vectors, with their end time, covering the GRAFCET"""
+        simulator = self.simulator
+        simulator.start()
+        coverage = (0, simulator.get_situation(), simulator.get_outputs())
+
+        scenarios = list()
+        while True:
+            simulator.start()
+            initialCoverage = coverage
+            vectors = [(0., 0)]
+            time = self.period
+            discarded = set()
+
+            # Evolutions kept without covering anything may go round a cycle: attempts are bounded too
+            attempts = 0
+            while len(vectors) < self.maxLength and attempts < self.maxLength:
+                attempts += 1
+                marking = simulator.get_situation()
+                found = self.find_edge(marking, coverage, discarded)
+                if found is None:
+                    break
+                edge, isTarget = found
+
+                snapshot = simulator.save()
+                edgeVectors, until = self.concretise(edge[2], time)
+                try:
+                    edgeCoverage = self.play(edgeVectors, until, coverage)
+                except UnstableSituationError:
+                    edgeCoverage = None
+
+                # Transient evolutions may go past the expected situation, they are kept if they cover
+                # something new
+                if edgeCoverage is not None and (edgeCoverage != coverage or
+                                                 not isTarget and simulator.get_situation() == edge[1]):
+                    vectors += edgeVectors
+                    time = until
+                    coverage = edgeCoverage
+                else:
+                    simulator.restore(snapshot)
+                    discarded.add(edge[:2])
+
+            if coverage == initialCoverage:
+                return scenarios
+            scenarios.append((vectors, time))
+
+    def generate(self):
+        """Searches, concretises and simulates the sequences, returns the scenarios kept"""
+        scenarios = self.search()
+        arguments = [(self.grafcet, vectors, until) for vectors, until in scenarios]
+
+        if self.workers > 1 and len(arguments) > 1:
+            with ProcessPoolExecutor(self.workers) as executor:
+                results = list(executor.map(simulate_scenario, arguments))
+        else:
+            results = list(map(simulate_scenario, arguments))
+
+        # Scenarios adding nothing to the coverage reached by the previous ones are dropped
+        self.scenarios = list()
+        self.coverage = (0, 0, 0)
+        for scenario, result in zip(scenarios, results):
+            coverage = tuple(old | new for old, new in zip(self.coverage, result))
+            if coverage != self.coverage:
+                self.scenarios.append(scenario)
+                self.coverage = coverage
+
+        return self.scenarios
+
+    def get_scenarios(self):
+        return self.scenarios
+
+    def get_coverage(self):
+        return self.coverage
+
+    def get_uncovered(self):
+        transitions, steps, outputs = self.coverage
+        return {'transitions': [name for id, name in enumerate(self.grafcet.transitions) if not transitions >> id & 1],
+                'steps': [name for id, name in enumerate(self.grafcet.steps) if not steps >> id & 1],
+                'outputs': [name for id, name in enumerate(self.grafcet.outputs) if not outputs >> id & 1]}
+
+    def write_csv(self, file):
+        writer = csv.writer(file, delimiter=';', quotechar='"')
+        writer.writerow(['scenario', 'time'] + list(self.grafcet.inputs))
+        for number, (vectors, until) in enumerate(self.scenarios, 1):
+            for time, inputs in vectors:
+                writer.writerow([number, round(time, 9)] + [inputs >> id & 1 for id in range(len(self.grafcet.inputs))])
+            writer.writerow([number, round(until, 9)] + [''] * len(self.grafcet.inputs))
+
+    def write_json(self, file):
+        content = {'grafcet': self.grafcet.name,
+                   'inputs': list(self.grafcet.inputs),
+                   'scenarios': [{'vectors': [[round(time, 9), [name for id, name in enumerate(self.grafcet.inputs)
+                                                               if inputs >> id & 1]]
+                                              for time, inputs in vectors],
+                                  'until': round(until, 9)}
+                                 for vectors, until in self.scenarios],
+                   'uncovered': self.get_uncovered()}
+        json.dump(content, file, indent=1)
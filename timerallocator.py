@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""timerallocator.py"""
+
+from grafcet import *
+from reachability import Explorer
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class TimerOverflowError(Error):
+    """Exception raised when no timer is left for a delay.
+
+    Attributes:
+        delay -- concerned delay
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __str__(self):
+        return "No timer left for delay {}".format(self.delay)
+
+
+class BoundedExplorer(Explorer):
+    """Explorer giving up on markings whose enabled transitions read more than maxAtoms atoms
+
+    Every valuation of these atoms is tried for each marking: such markings are not expanded, which
+    leaves the exploration incomplete instead of trying thousands of valuations.
+    """
+
+    maxAtoms = 10
+
+    def __init__(self, grafcet, maxStates=None):
+        super().__init__(grafcet, workers=1, maxStates=maxStates)
+
+    def reset(self):
+        super().reset()
+        self.truncated = False
+
+    def get_edges(self, marking):
+        support = 0
+        for transition, precedingMask in enumerate(self.precedingMasks):
+            if marking & precedingMask == precedingMask:
+                support |= self.supports[transition]
+        if bin(support).count('1') > self.maxAtoms:
+            self.truncated = True
+            return []
+
+        return super().get_edges(marking)
+
+    def is_complete(self):
+        return self.complete and not self.truncated
+
+
+class TimerAllocator:
+    """Allocates the timers of the delays, delays never enabled at the same time sharing a timer
+
+    The guard of a delay is the set of the steps which are active whenever its expression is true.
+    Two delays of the same duration can share a timer, enabled by the Or of their expressions, when
+    one step of the guard of each is never active in the same situation as the other nor in a
+    situation following the other: the Or is false for at least one scan between them, which resets
+    the timer. Situations are those reachable by the GRAFCET, initial steps being activated by the
+    reset from any situation. They are explored once per frozen GRAFCET, the overlaps being cached by
+    the allocator.
+
+    When the situations of a GRAFCET can not all be explored, its steps are only known apart by its
+    structure: in a component of steps linked by transitions of one preceding and one succeeding step,
+    holding one initial step and whose alternative transitions have exclusive conditions, one step only
+    is active at a time. Two steps of such a component overlap when a transition links them.
+
+    The timer is then on for a delay when it is on and the guard of the delay was active at the end of
+    the previous scan. Delays read by the transitions of the GRAFCET of their guard, which are
+    evaluated before its steps change, or by the actions of the steps of their guard only can share a
+    timer; the reads AND the timer with the guard.
+
+    Delays sharing a timer are the colours of the interference graph of the delays of each duration,
+    coloured by DSatur. Each colour gets a timer of the time base giving the smallest rounding error of
+    the duration, the coarser base on a tie, or of the next best base when no timer of it is left.
+
+    Delays of equal keys, their frozen form by default, are the same delay: they get one timer.
+    """
+
+    maxPreset = 32767
+    maxStates = 20000
+
+    def __init__(self, timeBases, indexes, key=None):
+        self.timeBases = timeBases
+        self.indexes = indexes
+        self.key = key if key is not None else lambda delay: delay.freeze()
+        self.overlaps = dict()
+
+        self.reset()
+
+    def __str__(self):
+        return 'Timer allocator of {} delays'.format(len(self.delays))
+
+    def __repr__(self):
+        return str(self)
+
+    def reset(self):
+        self.delays = list()
+        self.readers = dict()
+        self.guards = dict()
+        self.timers = dict()
+        self.members = dict()
+        self.counters = {timeBase: 0 for timeBase in self.timeBases}
+        self.unexplored = list()
+
+    def clear_cache(self):
+        self.overlaps = dict()
+
+    def collect(self, expression, reader):
+        member = expression.get_expression()
+
+        if type(member) is ExpressionBinary:
+            for submember in member.get_members():
+                self.collect(submember, reader)
+        elif type(member) is ExpressionUnary:
+            self.collect(member.get_member(), reader)
+        elif type(member) is Delay:
+            key = self.key(member)
+            if key not in self.readers:
+                self.delays.append(member)
+                self.readers[key] = list()
+            self.readers[key].append(reader)
+            # Delays read by the expression of a delay are read after the steps changed
+            self.collect(member.get_expression(), ('delay', None))
+
+    def find_guard(self, expression):
+        member = expression.get_expression()
+
+        if type(member) is Step:
+            return {member}
+        elif type(member) is ExpressionBinary and member.get_type() == 'AND':
+            return set().union(*(self.find_guard(submember) for submember in member.get_members()))
+        elif type(member) is ExpressionBinary and member.get_type() == 'OR':
+            return set.intersection(*(self.find_guard(submember) for submember in member.get_members()))
+        else:
+            return set()
+
+    def get_shareable_guard(self, delay, stepGrafcets):
+        # Steps of the guard in one GRAFCET, or None when the delay can not share its timer
+        guard = self.find_guard(delay.get_expression())
+        grafcets = {stepGrafcets[step] for step in guard if step in stepGrafcets}
+        for kind, reader in self.readers[self.key(delay)]:
+            if kind == 'transition':
+                grafcets &= {reader}
+            elif kind == 'delay':
+                return None
+
+        if len(grafcets) != 1:
+            return None
+        grafcet = grafcets.pop()
+
+        guard = {step for step in guard if stepGrafcets.get(step) is grafcet}
+        for kind, reader in self.readers[self.key(delay)]:
+            if kind == 'action' and reader not in guard:
+                return None
+
+        return grafcet, guard
+
+    def get_literals(self, condition):
+        # Literals ANDed at the top of a frozen condition, with their polarity
+        if condition is not None and condition[0] == 'AND':
+            return set().union(*(self.get_literals(member) for member in condition[1]))
+        elif condition is not None and condition[0] == 'NOT':
+            return {(condition[1], False)}
+        else:
+            return {(condition, True)}
+
+    def are_exclusive(self, condition, otherCondition):
+        literals = self.get_literals(condition)
+        return any((literal, not polarity) in literals for literal, polarity in self.get_literals(otherCondition))
+
+    def get_structural_overlaps(self, frozen):
+        """Returns for each step the mask of the steps it may be active with or follow, known from the
+        structure of the GRAFCET only"""
+        everything = (1 << len(frozen.steps)) - 1
+        overlaps = [everything] * len(frozen.steps)
+
+        components = list(range(len(frozen.steps)))
+
+        def find(step):
+            while components[step] != step:
+                components[step] = components[components[step]]
+                step = components[step]
+            return step
+
+        # Transitions which do not move a single activity make the components of their steps unsafe
+        unsafe = set()
+        for preceding, succeeding in zip(frozen.precedingSteps, frozen.succeedingSteps):
+            if len(preceding) == 1 and len(succeeding) == 1:
+                components[find(preceding[0])] = find(succeeding[0])
+            else:
+                unsafe.update(preceding + succeeding)
+        for step, transitions in enumerate(frozen.succeedingTransitions):
+            if any(not self.are_exclusive(frozen.conditions[transition], frozen.conditions[other])
+                   for transition in transitions for other in transitions if transition < other):
+                unsafe.add(step)
+
+        unsafe = {find(step) for step in unsafe}
+        initialCounts = dict()
+        for step in frozen.initialSteps:
+            initialCounts[find(step)] = initialCounts.get(find(step), 0) + 1
+
+        initialSteps = Explorer.mask(frozen.initialSteps)
+        for step in range(len(frozen.steps)):
+            component = find(step)
+            if component in unsafe or initialCounts.get(component) != 1 or step in frozen.initialSteps:
+                continue
+            overlaps[step] = 1 << step | initialSteps
+            for transition in frozen.precedingTransitions[step] + frozen.succeedingTransitions[step]:
+                overlaps[step] |= Explorer.mask(frozen.precedingSteps[transition] + frozen.succeedingSteps[transition])
+
+        return overlaps
+
+    def get_overlaps(self, grafcet):
+        """Returns the frozen GRAFCET, for each step the mask of the steps active in the same situation or
+        in a situation following or preceding it, and whether the situations could all be explored, the
+        overlaps being then known from the structure of the GRAFCET only"""
+        frozen = grafcet.freeze()
+        if frozen in self.overlaps:
+            return self.overlaps[frozen]
+
+        explorer = BoundedExplorer(frozen, self.maxStates).explore()
+        if not explorer.is_complete():
+            self.overlaps[frozen] = frozen, self.get_structural_overlaps(frozen), False
+            return self.overlaps[frozen]
+
+        overlaps = [0] * len(frozen.steps)
+        for marking in explorer.get_markings():
+            successors = 0
+            for successor, fired in explorer.successors(marking):
+                successors |= successor
+                for step in explorer.bits(successor):
+                    overlaps[step] |= marking
+            for step in explorer.bits(marking):
+                overlaps[step] |= marking | successors
+
+        initialSteps = explorer.mask(frozen.initialSteps)
+        for step in range(len(frozen.steps)):
+            overlaps[step] |= initialSteps
+        for step in frozen.initialSteps:
+            overlaps[step] = (1 << len(frozen.steps)) - 1
+
+        self.overlaps[frozen] = frozen, overlaps, True
+        return self.overlaps[frozen]
+
+    def get_time_bases(self, duration):
+        # Time bases by rounding error of the duration, then coarser first
+        candidates = list()
+        for timeBase in self.timeBases:
+            preset = round(duration / timeBase)
+            if 1 <= preset <= self.maxPreset:
+                # Errors are rounded so that exact durations do not depend on floating point noise
+                candidates.append((round(abs(preset * timeBase - duration), 9), -timeBase, timeBase, preset))
+
+        return [(timeBase, preset) for error, negatedBase, timeBase, preset in sorted(candidates)]
+
+    @staticmethod
+    def colour(nodes, neighbours):
+        # DSatur: the node with the most colours around it, then the most neighbours, is coloured first
+        colours = dict()
+        while len(colours) < len(nodes):
+            node = max((node for node in nodes if node not in colours),
+                       key=lambda node: (len({colours[other] for other in neighbours[node] if other in colours}),
+                                         len(neighbours[node]), -nodes.index(node)))
+            used = {colours[other] for other in neighbours[node] if other in colours}
+            colours[node] = min(colour for colour in range(len(nodes) + 1) if colour not in used)
+
+        return colours
+
+    def allocate(self, grafcets, outputs):
+        """Allocates the timers of the delays of the transitions of the GRAFCETs and of the actions of
+        the outputs"""
+        self.reset()
+
+        stepGrafcets = dict()
+        for grafcet in grafcets:
+            for step in grafcet.get_steps().values():
+                stepGrafcets[step] = grafcet
+            for transition in grafcet.get_transitions().values():
+                self.collect(transition.get_condition(), ('transition', grafcet))
+        for output in outputs.values():
+            for action in output.get_actions():
+                if action.get_condition() is not None:
+                    self.collect(action.get_condition(), ('action', action.get_step()))
+
+        shareable = dict()
+        for delay in self.delays:
+            guard = self.get_shareable_guard(delay, stepGrafcets)
+            if guard is not None:
+                shareable[delay] = guard
+
+        overlaps = dict()
+        for grafcet, guard in shareable.values():
+            if grafcet not in overlaps:
+                overlaps[grafcet] = self.get_overlaps(grafcet)
+                if not overlaps[grafcet][2]:
+                    self.unexplored.append(grafcet.name)
+
+        def compatible(delay, other):
+            if delay not in shareable or other not in shareable or delay.get_delay_re() != other.get_delay_re():
+                return False
+            grafcet, guard = shareable[delay]
+            otherGrafcet, otherGuard = shareable[other]
+            if grafcet is not otherGrafcet:
+                return False
+            frozen, stepOverlaps, explored = overlaps[grafcet]
+            return any(not stepOverlaps[frozen.get_step_id(step.get_index())] >> frozen.get_step_id(otherStep.get_index()) & 1
+                       for step in guard for otherStep in otherGuard)
+
+        neighbours = {delay: [other for other in self.delays if other is not delay and not compatible(delay, other)]
+                      for delay in self.delays}
+        colours = self.colour(self.delays, neighbours)
+
+        # Timers are numbered in the order the delays are read
+        classes = dict()
+        for delay in self.delays:
+            classes.setdefault(colours[delay], list()).append(delay)
+
+        for members in classes.values():
+            for timeBase, preset in self.get_time_bases(members[0].get_delay_re()):
+                if self.counters[timeBase] < len(self.indexes[timeBase]):
+                    index = self.indexes[timeBase][self.counters[timeBase]]
+                    self.counters[timeBase] += 1
+                    break
+            else:
+                raise TimerOverflowError(members[0])
+
+            self.members[index] = members
+            for delay in members:
+                self.timers[self.key(delay)] = (index, preset)
+                if len(members) > 1:
+                    self.guards[self.key(delay)] = sorted(shareable[delay][1], key=lambda step: str(step.get_index()))
+
+    def get_timer(self, delay):
+        """Returns the (timer index, preset) of the delay, or None if it was not allocated"""
+        return self.timers.get(self.key(delay))
+
+    def get_members(self, index):
+        return self.members[index]
+
+    def get_guard(self, delay):
+        """Returns the steps ANDed with the timer when the delay is read, empty for a timer of its own"""
+        return self.guards.get(self.key(delay), list())
+
+    def get_report(self):
+        shared = sum(1 for members in self.members.values() if len(members) > 1)
+        report = '{} delays, {} timers, {} of them shared'.format(len(self.delays), len(self.members), shared)
+        for name in self.unexplored:
+            report += '\nSituations of {} not all explored: its delays share timers by its structure only'.format(name)
+
+        return report
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""tracerecorder.py"""
+
+import bisect
+import mmap
+import operator
+import os
+import struct
+import tempfile
+from itertools import compress
+
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    pass
+
+
+class TraceFormatError(Error):
+    """Exception raised when a file is not a trace of the expected GRAFCET.
+
+    Attributes:
+        path -- path of the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return "{} is not a trace of this GRAFCET".format(self.path)
+
+
+class TraceRecorder:
+    """Columnar record of the evolution of a GRAFCET in a memory-mapped file
+
+    Every row holds a time, the situation, the inputs and the outputs as the integers used by the
+    Simulator. The file starts with a header, then each column is stored contiguously: times as
+    doubles, then the step, input and output bitsets as little-endian fixed-width bytes. The capacity
+    doubles when it is reached, columns being moved inside the file.
+
+    Queries read one column, or one byte of a bitset column with a stride, so they never load the
+    whole trace.
+    """
+
+    header = struct.Struct('<8sQQIII')
+    magic = b'GRAFTRC1'
+    headerSize = 64
+
+    def __init__(self, grafcet, path=None, capacity=1024):
+        self.grafcet = grafcet.freeze()
+        self.path = path
+
+        self.widths = (8,
+                       (len(self.grafcet.steps) + 7) // 8,
+                       (len(self.grafcet.inputs) + 7) // 8,
+                       (len(self.grafcet.outputs) + 7) // 8)
+
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(path, 'w+b')
+
+        self.length = 0
+        self.capacity = max(1, capacity)
+        self.file.truncate(self.headerSize + self.capacity * sum(self.widths))
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.write_header()
+
+    @classmethod
+    def open(cls, grafcet, path):
+        """Opens an existing trace of the GRAFCET to read or to extend it"""
+        recorder = cls.__new__(cls)
+        recorder.grafcet = grafcet.freeze()
+        recorder.path = path
+        recorder.file = open(path, 'r+b')
+        recorder.map = mmap.mmap(recorder.file.fileno(), 0)
+
+        magic, recorder.length, recorder.capacity, *widths = cls.header.unpack_from(recorder.map)
+        recorder.widths = (8, *widths)
+        if magic != cls.magic or widths != [(len(recorder.grafcet.steps) + 7) // 8,
+                                            (len(recorder.grafcet.inputs) + 7) // 8,
+                                            (len(recorder.grafcet.outputs) + 7) // 8]:
+            recorder.close()
+            raise TraceFormatError(path)
+
+        return recorder
+
+    def __str__(self):
+        return 'Trace of {} with {} rows'.format(self.grafcet, self.length)
+
+    def __repr__(self):
+        return str(self)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+        return self.get_row(row)
+
+    def __iter__(self):
+        for row in range(self.length):
+            yield self.get_row(row)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def write_header(self):
+        self.header.pack_into(self.map, 0, self.magic, self.length, self.capacity, *self.widths[1:])
+
+    def offset(self, column, capacity=None):
+        if capacity is None:
+            capacity = self.capacity
+        return self.headerSize + capacity * sum(self.widths[:column])
+
+    def grow(self):
+        capacity = self.capacity * 2
+        self.map.resize(self.headerSize + capacity * sum(self.widths))
+
+        # Columns are moved from the last one so that none is overwritten before being moved
+        for column in reversed(range(1, len(self.widths))):
+            self.map.move(self.offset(column, capacity), self.offset(column), self.length * self.widths[column])
+
+        self.capacity = capacity
+
+    def append(self, time, situation, inputs=0, outputs=0):
+        if self.length == self.capacity:
+            self.grow()
+
+        row = self.length
+        struct.pack_into('<d', self.map, self.offset(0) + row * 8, time)
+        for column, value in ((1, situation), (2, inputs), (3, outputs)):
+            width = self.widths[column]
+            start = self.offset(column) + row * width
+            self.map[start:start + width] = value.to_bytes(width, 'little')
+
+        self.length += 1
+
+    def record(self, simulator):
+        """Appends the current row of the simulator, its inputs included"""
+        self.append(simulator.get_time(), simulator.get_situation(), simulator.get_inputs(),
+                    simulator.get_outputs())
+
+    def flush(self):
+        self.write_header()
+        self.map.flush()
+
+    def close(self):
+        if not self.map.closed:
+            if self.file.writable():
+                self.flush()
+            self.map.close()
+        self.file.close()
+
+    def get_grafcet(self):
+        return self.grafcet
+
+    def get_value(self, column, row):
+        width = self.widths[column]
+        start = self.offset(column) + row * width
+        return int.from_bytes(self.map[start:start + width], 'little')
+
+    def get_time(self, row):
+        return struct.unpack_from('<d', self.map, self.offset(0) + row * 8)[0]
+
+    def get_row(self, row):
+        if row < 0:
+            row += self.length
+        if not 0 <= row < self.length:
+            raise IndexError(row)
+
+        return self.get_time(row), self.get_value(1, row), self.get_value(2, row), self.get_value(3, row)
+
+    def get_times(self):
+        # Callers must release the view before the trace grows
+        with memoryview(self.map) as view:
+            return view[self.offset(0):self.offset(0) + self.length * 8].cast('d')
+
+    def find_row(self, time):
+        """Returns the last row recorded at or before time, or None"""
+        times = self.get_times()
+        try:
+            row = bisect.bisect_right(times, time) - 1
+        finally:
+            times.release()
+
+        return row if row >= 0 else None
+
+    def get_situation_at(self, time):
+        row = self.find_row(time)
+        return None if row is None else self.get_value(1, row)
+
+    def get_bit_flags(self, column, id):
+        # One byte per row, 1 when the bit is set
+        width = self.widths[column]
+        start = self.offset(column) + id // 8
+        column = self.map[start:start + self.length * width:width]
+        return column.translate(bytes(byte >> id % 8 & 1 for byte in range(256)))
+
+    def first_active_time(self, index):
+        """Returns the first time the step was active, or None"""
+        row = self.get_bit_flags(1, self.grafcet.get_step_id(index)).find(1)
+        return None if row < 0 else self.get_time(row)
+
+    def active_time(self, column, id, end=None):
+        if self.length == 0:
+            return 0.
+
+        flags = self.get_bit_flags(column, id)
+        times = self.get_times()
+        try:
+            total = sum(map(operator.sub, compress(times[1:], flags), compress(times[:-1], flags)))
+            if end is not None and flags[-1]:
+                total += end - times[-1]
+        finally:
+            times.release()
+
+        return total
+
+    def get_step_active_time(self, index, end=None):
+        return self.active_time(1, self.grafcet.get_step_id(index), end)
+
+    def get_output_active_time(self, name, end=None):
+        return self.active_time(3, self.grafcet.get_output_id(name), end)
+
+    def get_output_active_times(self, end=None):
+        return {name: self.active_time(3, id, end) for id, name in enumerate(self.grafcet.outputs)}
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""transient.py"""
+
+from grafcet import *
+from conditioncompiler import ConditionCompiler
+
+
+def strongly_connected_components(successors):
+    """Returns the strongly connected components of a graph, in topological order
+
+    The graph is given as the list of the successors of every node, nodes being numbered from 0. The
+    iterative Tarjan algorithm is used, so large graphs do not hit the recursion limit.
+    """
+    count = len(successors)
+    indexes = [None] * count
+    lowLinks = [0] * count
+    onStack = [False] * count
+    stack = list()
+    components = list()
+    index = 0
+
+    for root in range(count):
+        if indexes[root] is not None:
+            continue
+        work = [(root, iter(successors[root]))]
+        indexes[root] = lowLinks[root] = index
+        index += 1
+        stack.append(root)
+        onStack[root] = True
+
+        while work:
+            node, nodeSuccessors = work[-1]
+            for successor in nodeSuccessors:
+                if indexes[successor] is None:
+                    indexes[successor] = lowLinks[successor] = index
+                    index += 1
+                    stack.append(successor)
+                    onStack[successor] = True
+                    work.append((successor, iter(successors[successor])))
+                    break
+                elif onStack[successor]:
+                    lowLinks[node] = min(lowLinks[node], indexes[successor])
+            else:
+                work.pop()
+                if work:
+                    lowLinks[work[-1][0]] = min(lowLinks[work[-1][0]], lowLinks[node])
+                if lowLinks[node] == indexes[node]:
+                    component = list()
+                    while True:
+                        member = stack.pop()
+                        onStack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+
+    # Tarjan finds the components in reverse topological order
+    components.reverse()
+    return components
+
+
+class TransientAnalyser:
+    """Transient evolutions of a GRAFCET, which go on without any input change
+
+    A transition is transient when its condition only reads steps, inputs and constants: inputs do not
+    change during an evolution, so such a transition may fire again and again while the situation
+    changes. Transitions reading edges or delays are not, their value changing from one cycle to the
+    next one. The transient transitions link their preceding steps to their succeeding steps; the
+    strongly connected components of this graph are the cycles which may never reach a stable
+    situation.
+
+    From a situation where every enabled transition is transient, the following cycles only depend on
+    the situation and the inputs. Their closure is computed once and cached: it gives the situation
+    where the chain stops, either stable or enabling a transition which is not transient, so that an
+    evolution jumps there in one step.
+    """
+
+    cacheSize = 65536
+
+    def __init__(self, grafcet):
+        self.grafcet = grafcet.freeze()
+
+        grafcet = self.grafcet
+
+        self.allSteps = (1 << len(grafcet.steps)) - 1
+
+        self.compiler = ConditionCompiler(grafcet)
+        self.conditions = [self.compiler.compile(condition) for condition in grafcet.conditions]
+        self.transients = [self.is_transient(('CT', 1) if condition is None else condition)
+                           for condition in grafcet.conditions]
+
+        self.precedingMasks = [self.mask(steps) for steps in grafcet.precedingSteps]
+        self.succeedingMasks = [self.mask(steps) for steps in grafcet.succeedingSteps]
+
+        # Delays reading a step changed in the middle of a chain would see it, a jump would not. The
+        # delays of the outputs read by conditions are those of the actions
+        self.delaySteps = 0
+        for condition in grafcet.conditions:
+            if condition is not None:
+                self.delaySteps |= self.get_delay_steps(condition)
+        for actions in grafcet.actions:
+            for action in actions:
+                if action[1] is not None:
+                    self.delaySteps |= self.get_delay_steps(action[1])
+
+        successors = [set() for step in grafcet.steps]
+        for transition, transient in enumerate(self.transients):
+            if transient:
+                for step in grafcet.precedingSteps[transition]:
+                    successors[step].update(grafcet.succeedingSteps[transition])
+        self.unstableCycles = [component for component in strongly_connected_components(successors)
+                               if len(component) > 1 or component[0] in successors[component[0]]]
+
+        self.closures = dict()
+
+    def __str__(self):
+        return 'Transient analyser of {}'.format(self.grafcet)
+
+    def __repr__(self):
+        return str(self)
+
+    @staticmethod
+    def mask(ids):
+        mask = 0
+        for id in ids:
+            mask |= 1 << id
+        return mask
+
+    @staticmethod
+    def bits(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def is_transient(self, condition):
+        kind, value = condition
+
+        if kind == 'ST' or kind == 'IN' or kind == 'CT':
+            return True
+        elif kind == 'NOT':
+            return self.is_transient(value)
+        elif kind == 'AND' or kind == 'OR':
+            return all(self.is_transient(member) for member in value)
+        else:
+            return False
+
+    def get_steps_read(self, condition):
+        kind, value = condition
+
+        if kind == 'ST':
+            return 1 << self.grafcet.get_step_id(value)
+        elif kind == 'OU':
+            # Outputs depend on the steps acting on them and on the conditions of their actions
+            return self.allSteps
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return self.get_steps_read(value)
+        elif kind == 'AND' or kind == 'OR':
+            steps = 0
+            for member in value:
+                steps |= self.get_steps_read(member)
+            return steps
+        elif kind == 'DE' or kind == 'DU':
+            return self.get_steps_read(value[1])
+        else:
+            return 0
+
+    def get_delay_steps(self, condition):
+        # Steps read by the expressions of the delays used in the condition
+        kind, value = condition
+
+        if kind == 'DE' or kind == 'DU':
+            return self.get_steps_read(value[1])
+        elif kind == 'NOT' or kind == 'RE' or kind == 'FE':
+            return self.get_delay_steps(value)
+        elif kind == 'AND' or kind == 'OR':
+            steps = 0
+            for member in value:
+                steps |= self.get_delay_steps(member)
+            return steps
+        else:
+            return 0
+
+    def get_transient_transitions(self):
+        return [self.grafcet.transitions[id] for id, transient in enumerate(self.transients) if transient]
+
+    def get_unstable_cycles(self):
+        """Returns the lists of steps which may be activated again and again without any input change"""
+        return [[self.grafcet.steps[id] for id in component] for component in self.unstableCycles]
+
+    def step(self, situation, inputs):
+        # One evolution cycle if every enabled transition is transient, None otherwise
+        state = self.compiler.state(situation, inputs, 0)
+
+        fired = cleared = activated = 0
+        for step in self.bits(situation):
+            for transition in self.grafcet.succeedingTransitions[step]:
+                precedingMask = self.precedingMasks[transition]
+                if situation & precedingMask == precedingMask:
+                    if not self.transients[transition]:
+                        return None
+                    if self.conditions[transition](state, state):
+                        fired |= 1 << transition
+                        cleared |= precedingMask
+                        activated |= self.succeedingMasks[transition]
+
+        return fired, situation & ~cleared | activated
+
+    def closure(self, situation, inputs):
+        """Returns where the chain of transient evolutions from the situation stops
+
+        The result is (situation, previous situation, fired transitions, cycles) for chains of two cycles
+        or more which change no step read by a delay, None otherwise. The chain stops at a stable
+        situation or at a situation enabling a transition which is not transient. For a chain which never
+        stops, the result is (None, situations of the cycle, fired transitions, cycles).
+        """
+        key = (situation, inputs)
+        if key in self.closures:
+            return self.closures[key]
+
+        if len(self.closures) >= self.cacheSize:
+            self.closures.clear()
+
+        situations = [situation]
+        seen = {situation}
+        fired = changed = 0
+        while True:
+            result = self.step(situations[-1], inputs)
+            if result is None or not result[0]:
+                break
+            fired |= result[0]
+            changed |= situations[-1] ^ result[1]
+            if result[1] in seen:
+                cycle = situations[situations.index(result[1]):]
+                self.closures[key] = (None, cycle, fired, len(situations))
+                return self.closures[key]
+            situations.append(result[1])
+            seen.add(result[1])
+
+        if len(situations) > 2 and not changed & self.delaySteps:
+            self.closures[key] = (situations[-1], situations[-2], fired, len(situations) - 1)
+        else:
+            self.closures[key] = None
+
+        return self.closures[key]